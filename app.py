@@ -1,37 +1,75 @@
-from typing import Any, Dict
-from flask import Flask, abort, request, jsonify
+from functools import partial
+from typing import Optional, Tuple
+from flask import Flask, Response, abort, request, jsonify, url_for
+import math
 import os
-from conversation import manager_logger, ConversationManager
+from conversation import manager_logger, BulkResult, ConversationBusyError, ConversationManager, ConversationNotFoundError
+from serialization import compress_body, format_sse, history_page_body, parse_history_window, serialize_bulk_result
 from google.genai import types
 from google_client import client
-from config import RAG_ASSISTANT_CONFIG, GOOGLE_SEARCH_CONFIG, create_config_from_json_data
+from config import conversation_manager_options, deadline_options, job_queue_options, model_router_options
+from config_registry import ConfigRegistry
+from rate_limiter import RateLimitError
+from model_router import RoutingDecision, build_model_router
+from deadline import Deadline, DeadlineExceeded, deadline_scope, parse_timeout
+from jobs import JobQueue, QueueFullError
+import metrics
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-print(f"--- SCRIPT TOP LEVEL ---")
-print(f"WERKZEUG_RUN_MAIN: {os.environ.get('WERKZEUG_RUN_MAIN')}")
-print(f"FLASK_DEBUG env: {os.environ.get('FLASK_DEBUG')}")
-print(f"FLASK_ENV env: {os.environ.get('FLASK_ENV')}")
-
 app = Flask(__name__)
+metrics.instrument_flask(app)
 
 
-# TODO: consider persistence in the future
-conversation_manager = ConversationManager()
-print(f"Global conversation_manager created, id: {id(conversation_manager)}")
+conversation_manager = ConversationManager(**conversation_manager_options(client))
+# compiled generation_config overrides kept for reuse, plus the named presets
+config_registry = ConfigRegistry(
+    max_entries=int(os.environ.get("CONFIG_CACHE_SIZE", "256")), default_id="google_search")
 
+metrics.registry.gauge(
+    "conversations", "Conversations held by this worker's ConversationManager.").set_function(
+    lambda: len(conversation_manager))
+metrics.registry.gauge(
+    "conversation_history_bytes", "Text held by all conversation histories of this worker.").set_function(
+    lambda: conversation_manager.stats()["history_bytes"])
 
-DEFAULT_CHAT_MODEL_NAME = os.environ.get("DEFAULT_CHAT_MODEL_NAME")
+# keeps the local retrieval index in step with the documents table
+if conversation_manager.retriever is not None:
+    conversation_manager.retriever.start()
 
+# background messages, see jobs.py
+job_queue = JobQueue(**job_queue_options())
+metrics.registry.gauge(
+    "jobs_queued", "Jobs of this worker waiting for a job worker.").set_function(
+    lambda: job_queue.stats()["queued"])
+metrics.registry.gauge(
+    "jobs_running", "Jobs of this worker being run.").set_function(
+    lambda: job_queue.stats()["running"])
 
-def serialize_content(content: types.Content) -> Dict[str, Any]:
-    part_text = ""
-    if content.parts:
-        part_text = " ".join(
-            [part.text for part in content.parts if hasattr(part, 'text')])
-    return {"role": content.role, "text": part_text}
+# build the genai client and open its first connection before taking traffic
+if os.environ.get("WARM_UP_CLIENTS", "").lower() in ("1", "true"):
+    from google_client import warm_up
+    warm_up()
+
+
+DEFAULT_CHAT_MODEL_NAME = os.environ.get("DEFAULT_CHAT_MODEL_NAME")
+
+# latency-aware routing over MODEL_ROUTES for requests naming the router alias
+model_router = None
+model_router_settings = model_router_options()
+if model_router_settings["routes"]:
+    from google_client import regional_client
+    model_router = build_model_router(regional_client, **model_router_settings)
+    # with a pool configured, requests without a model_name are routed too
+    DEFAULT_CHAT_MODEL_NAME = model_router.alias
+# upper bound for the items of one bulk message request
+MAX_BULK_ITEMS = int(os.environ.get("MAX_BULK_ITEMS", "1000"))
+# upper bound for the turns of one history page, 0 returns the full history by default
+MAX_HISTORY_PAGE = int(os.environ.get("MAX_HISTORY_PAGE", "0"))
+# default deadline per route, overridable per request with X-Request-Timeout
+DEADLINES = deadline_options()
 
 
 @app.route("/conversations", methods=["POST"])
@@ -48,25 +86,41 @@ def create_conversation_api():
 @app.route("/conversations/<string:conversation_id>", methods=["GET"])
 def get_conversation_api(conversation_id: str):
     """
-    Retrieves the history of a specific conversation.
+    Retrieves the history of a specific conversation, optionally one page of it.
     Args:
         conversation_id (str): The ID of the conversation.
+        since (query, optional): index of the first turn to return, e.g. the
+            `next` of the previous poll.
+        limit (query, optional): maximum number of turns to return.
     Returns:
-        JSON: {"conversation_id": "id", "history": [{"role": "user/model", "text": "..."}]}
-              or 404 if not found.
+        JSON: {"conversation_id": "id", "history": [{"role": "user/model", "text": "..."}],
+               "length": n, "since": i, "next": j}
+              304 if the If-None-Match ETag still matches, 404 if not found.
     """
     conversation = conversation_manager.get_conversation(conversation_id)
     if not conversation:
         abort(
             404, description=f"Conversation with ID '{conversation_id}' not found.")
+    try:
+        since, limit = parse_history_window(request.args, MAX_HISTORY_PAGE)
+    except ValueError as e:
+        abort(400, description=str(e))
 
-    serialized_history = [serialize_content(
-        content) for content in conversation.contents]
-    return jsonify({
-        "conversation_id": conversation_id,
-        "history": serialized_history,
-        "length": len(conversation)
-    })
+    turns_json, count, total, version = conversation.serialized_turns(since, limit)
+    if request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+    else:
+        body, encoding = compress_body(
+            history_page_body(conversation_id, turns_json, count, total, since),
+            request.headers.get("Accept-Encoding", ""))
+        response = Response(body, content_type="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    # the version covers the whole history, so it is valid for every page
+    response.set_etag(version, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 @app.route("/conversations/<string:conversation_id>", methods=["DELETE"])
@@ -85,20 +139,41 @@ def delete_conversation_api(conversation_id: str):
             404, description=f"Conversation with ID '{conversation_id}' not found for deletion.")
 
 
-@app.route("/conversations/<string:conversation_id>/messages", methods=["POST"])
-def send_message_api(conversation_id: str):
+def request_deadline(route: str) -> Optional[Deadline]:
     """
-    Sends a message to a specific conversation and gets a response from the model.
-    Args:
-        conversation_id (str): The ID of the conversation.
-    JSON Body:
-        {
-            "message": ,
-            "model_name":,
-            "generation_config": { ... optional override ... },
-        }
+    The request's deadline from X-Request-Timeout or the route's default, aborts with 400 on a bad header.
+    """
+    try:
+        return parse_timeout(request.headers.get("X-Request-Timeout"), DEADLINES[route], DEADLINES["max"])
+    except ValueError as e:
+        abort(400, description=str(e))
+
+
+def parse_job_request() -> Optional[Tuple[int, Optional[str]]]:
+    """
+    (priority, webhook) if the message asks to run as a background job with
+    "async": true or Prefer: respond-async, None otherwise. Aborts with 400 on bad values.
+    """
+    data = request.get_json()
+    if data.get("async") is not True and "respond-async" not in request.headers.get("Prefer", ""):
+        return None
+    priority = data.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        abort(400, description="'priority' must be an integer.")
+    webhook = data.get("webhook")
+    if webhook is not None:
+        try:
+            job_queue.check_webhook(webhook if isinstance(webhook, str) else "")
+        except ValueError as e:
+            abort(400, description=str(e))
+    return priority, webhook
+
+
+def parse_message_request(conversation_id: str) -> Tuple[str, str, types.GenerateContentConfig, bool]:
+    """
+    Validates a message request body shared by the blocking and streaming endpoints.
     Returns:
-        JSON: {"response": "Model's answer"} or 404/400/500 errors.
+        (user_message, model_name, generation_config, use_cache), aborts with 404/400 otherwise.
     """
     conversation = conversation_manager.get_conversation(conversation_id)
     if not conversation:
@@ -114,35 +189,366 @@ def send_message_api(conversation_id: str):
     # allow overriding model and generation config from request
     model_name_override = data.get("model_name", DEFAULT_CHAT_MODEL_NAME)
 
+    # "generation_config" wins over a preset "config_id", both are compiled once and shared
     gen_config_override_dict = data.get("generation_config")
-    current_gen_config = GOOGLE_SEARCH_CONFIG
-    if gen_config_override_dict and isinstance(gen_config_override_dict, dict):
-        current_gen_config = create_config_from_json_data(
-            gen_config_override_dict)
-
+    if not isinstance(gen_config_override_dict, dict):
+        gen_config_override_dict = None
     try:
-        model_response = conversation_manager.send_message_to_conversation(
-            conversation_id=conversation_id,
-            model_name=model_name_override,
-            client=client,
-            message=user_message,
-            generation_config=current_gen_config,
+        current_gen_config = config_registry.resolve(
+            config_id=data.get("config_id"),
+            data=gen_config_override_dict,
         )
-        if model_response is None and not conversation_manager.get_conversation(conversation_id):
-            abort(
-                404, description=f"Conversation with ID '{conversation_id}' not found after attempting to send message.")
+    except (ValueError, TypeError) as e:
+        abort(400, description=f"Invalid 'generation_config': {e}")
+
+    # "cache": false or Cache-Control: no-cache skip the response cache
+    use_cache = data.get("cache", True) is not False and \
+        "no-cache" not in request.headers.get("Cache-Control", "")
+
+    return user_message, model_name_override, current_gen_config, use_cache
+
+
+def run_message(conversation_id: str, user_message: str, model_name: str,
+                generation_config: types.GenerateContentConfig, use_cache: bool) -> dict:
+    """
+    Sends one message, through the model router for its alias.
+    Returns:
+        The response body: {"response": "...", "routing": {...} (routed requests only)}
+    """
+    send = partial(
+        conversation_manager.send_message_to_conversation,
+        conversation_id=conversation_id,
+        message=user_message,
+        generation_config=generation_config,
+        use_cache=use_cache,
+    )
+    routing = None
+    if model_router is not None and model_router.handles(model_name):
+        routing = RoutingDecision()
+        model_response = model_router.call(
+            lambda route: send(model_name=route.model, client=route.client), routing)
+    else:
+        model_response = send(model_name=model_name, client=client)
+    if model_response is None and not conversation_manager.get_conversation(conversation_id):
+        raise ConversationNotFoundError(
+            f"Conversation with ID '{conversation_id}' not found after attempting to send message.")
+    body = {"response": model_response}
+    if routing is not None:
+        body["routing"] = routing.to_dict()
+    return body
+
+
+def submit_message_job(conversation_id: str, job_options: Tuple[int, Optional[str]], *message_args):
+    """
+    Queues run_message as a background job, answers 202 with the job to poll.
+    """
+    def run():
+        # the deadline starts when a worker picks the job up, not at submission
+        with deadline_scope(parse_timeout(None, DEADLINES["jobs"], DEADLINES["max"])):
+            return run_message(conversation_id, *message_args)
+
+    priority, webhook = job_options
+    try:
+        job = job_queue.submit(conversation_id, run, priority=priority, webhook=webhook)
+    except QueueFullError as qf:
+        abort(503, description=str(qf), retry_after=5)
+    status_url = url_for("get_job_api", job_id=job.id)
+    return jsonify({"job_id": job.id, "status": job.status, "status_url": status_url}), 202, {
+        "Location": status_url}
+
+
+@app.route("/conversations/<string:conversation_id>/messages", methods=["POST"])
+def send_message_api(conversation_id: str):
+    """
+    Sends a message to a specific conversation and gets a response from the model.
+    Args:
+        conversation_id (str): The ID of the conversation.
+    JSON Body:
+        {
+            "message": ,
+            "model_name":,
+            "generation_config": { ... optional override ... },
+            "config_id": "rag_assistant" | "google_search" (optional preset, default google_search),
+            "cache": false (optional, bypasses the response cache),
+            "async": true (optional, runs as a background job, as does Prefer: respond-async),
+            "priority": 0 (optional, higher background jobs run first),
+            "webhook": "https://..." (optional, receives the finished background job),
+        }
+    A model_name equal to the router alias ("auto") picks a model and region
+    from MODEL_ROUTES and fails over to the next one on retryable errors.
+    X-Request-Timeout: seconds (optional) overrides the route's default deadline.
+    Returns:
+        JSON: {"response": "Model's answer", "routing": {...} (routed requests only)}
+              or 404/400/409/500 errors.
+              409 means another message of this conversation is still in flight.
+              504 means the deadline passed, the model call was given up and the turn rolled back.
+        Background jobs answer 202 {"job_id": "...", "status": "queued", "status_url": "/jobs/..."},
+        or 503 if too many jobs are queued.
+    """
+    user_message, model_name_override, current_gen_config, use_cache = parse_message_request(
+        conversation_id)
+    job_options = parse_job_request()
+    if job_options is not None:
+        return submit_message_job(conversation_id, job_options, user_message,
+                                  model_name_override, current_gen_config, use_cache)
+    deadline = request_deadline("messages")
 
-        return jsonify({"response": model_response})
+    try:
+        with deadline_scope(deadline):
+            body = run_message(conversation_id, user_message,
+                               model_name_override, current_gen_config, use_cache)
+        return jsonify(body)
+    except ConversationNotFoundError as nf:
+        abort(404, description=str(nf))
     except ValueError as ve:
         manager_logger.error(
             f"ValueError in send_message_api for {conversation_id}: {ve}")
         abort(400, description=str(ve))
+    except ConversationBusyError as be:
+        abort(409, description=str(be))
+    except RateLimitError as rl:
+        abort(429, description=str(rl), retry_after=max(1, math.ceil(rl.retry_after)))
+    except DeadlineExceeded as de:
+        abort(504, description=str(de))
     except Exception as e:
         manager_logger.error(
             f"Unexpected error in send_message_api for {conversation_id}: {e}", exc_info=True)
         abort(500, description="An internal server error occurred.")
 
 
+@app.route("/jobs/<string:job_id>", methods=["GET"])
+def get_job_api(job_id: str):
+    """
+    Polls a background message job.
+    Returns:
+        JSON: {"job_id": "...", "conversation_id": "...", "status": "queued|running|succeeded|failed",
+               "priority": 0, "submitted_at": epoch seconds, "queue_seconds": ..., "run_seconds": ...,
+               "result": {"response": "...", ...} (succeeded), "error": {"status": 409, "message": "..."} (failed)}
+              or 404 if unknown or no longer retained. Unfinished jobs carry Retry-After.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404, description=f"Job with ID '{job_id}' not found.")
+    headers = {} if job.done else {"Retry-After": "1"}
+    return jsonify(job.to_dict()), 200, headers
+
+
+@app.route("/conversations/<string:conversation_id>/messages:stream", methods=["POST"])
+def stream_message_api(conversation_id: str):
+    """
+    Streaming variant of send_message_api, pushes chunks as Server-Sent Events.
+    Args:
+        conversation_id (str): The ID of the conversation.
+    JSON Body:
+        Same as send_message_api.
+    Returns:
+        text/event-stream:
+            data: {"text": "chunk"}                  (one per chunk)
+            event: done / data: {"response": "...", "routing": {...}} (the committed model turn)
+            event: error / data: {"error": "..."}   (stream failed or ran out of time, turn rolled back)
+        or 404/400/409/500/504 errors if the stream could not be started.
+        Routed streams fail over only before the first chunk.
+    A client that disconnects mid-stream closes the upstream call and rolls the turn back.
+    """
+    user_message, model_name_override, current_gen_config, use_cache = parse_message_request(
+        conversation_id)
+    deadline = request_deadline("stream")
+
+    open_stream = partial(
+        conversation_manager.send_message_stream_to_conversation,
+        conversation_id=conversation_id,
+        message=user_message,
+        generation_config=current_gen_config,
+        use_cache=use_cache,
+    )
+    routing = None
+    if model_router is not None and model_router.handles(model_name_override):
+        routing = RoutingDecision()
+        stream = model_router.stream(
+            lambda route: open_stream(model_name=route.model, client=route.client), routing)
+    else:
+        stream = open_stream(model_name=model_name_override, client=client)
+    # pull the first chunk eagerly so that failures to start the stream
+    # still map onto a proper HTTP status code
+    try:
+        with deadline_scope(deadline):
+            first_chunk = next(stream, None)
+    except ConversationNotFoundError as nf:
+        abort(404, description=str(nf))
+    except ValueError as ve:
+        manager_logger.error(
+            f"ValueError in stream_message_api for {conversation_id}: {ve}")
+        abort(400, description=str(ve))
+    except ConversationBusyError as be:
+        abort(409, description=str(be))
+    except RateLimitError as rl:
+        abort(429, description=str(rl), retry_after=max(1, math.ceil(rl.retry_after)))
+    except DeadlineExceeded as de:
+        abort(504, description=str(de))
+    except Exception as e:
+        manager_logger.error(
+            f"Unexpected error in stream_message_api for {conversation_id}: {e}", exc_info=True)
+        abort(500, description="An internal server error occurred.")
+
+    def generate():
+        text_chunks = []
+        try:
+            if first_chunk is not None:
+                text_chunks.append(first_chunk)
+                yield format_sse({"text": first_chunk})
+            while True:
+                # the scope must not span the yield, the server may resume us elsewhere
+                with deadline_scope(deadline):
+                    chunk = next(stream, None)
+                if chunk is None:
+                    break
+                text_chunks.append(chunk)
+                yield format_sse({"text": chunk})
+        except DeadlineExceeded as de:
+            yield format_sse({"error": str(de)}, event="error")
+            return
+        except Exception as e:
+            manager_logger.error(
+                f"Stream for {conversation_id} failed mid-way: {e}", exc_info=True)
+            yield format_sse({"error": "An internal server error occurred."}, event="error")
+            return
+        finally:
+            # also reached when the client went away, cancels the upstream call
+            with deadline_scope(deadline):
+                stream.close()
+        done = {"response": "".join(text_chunks)}
+        if routing is not None:
+            done["routing"] = routing.to_dict()
+        yield format_sse(done, event="done")
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.route("/conversations:batchMessages", methods=["POST"])
+def batch_message_api():
+    """
+    Sends messages to many conversations concurrently on a bounded executor.
+    JSON Body:
+        {
+            "items": [{"conversation_id": , "message": , "generation_config"/"config_id": optional}, ...],
+            "model_name": (optional, shared by all items, with the router alias each item is routed),
+            "max_concurrency": (optional, conversations in flight),
+            "cache": false (optional, bypasses the response cache),
+        }
+    Messages to the same conversation run in request order.
+    Returns:
+        text/event-stream, one event per item in completion order:
+            data: {"index": 0, "conversation_id": "...", "status": 200, "response": "...",
+                   "routing": {...} (routed requests only)}
+            data: {"index": 1, "conversation_id": "...", "status": 404, "error": "..."}
+            event: done / data: {"succeeded": n, "failed": m}
+        A failing item never aborts the others. 400 if the body itself is malformed.
+    """
+    data = request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        abort(400, description="Missing 'items' in request body.")
+    if len(items) > MAX_BULK_ITEMS:
+        abort(400, description=f"At most {MAX_BULK_ITEMS} items per request.")
+
+    model_name_override = data.get("model_name", DEFAULT_CHAT_MODEL_NAME)
+    # the router alias routes every item on its own, with failover
+    bulk_router = model_router if model_router is not None and model_router.handles(
+        model_name_override) else None
+    max_concurrency = data.get("max_concurrency")
+    if max_concurrency is not None and (not isinstance(max_concurrency, int) or max_concurrency < 1):
+        abort(400, description="'max_concurrency' must be a positive integer.")
+    use_cache = data.get("cache", True) is not False and \
+        "no-cache" not in request.headers.get("Cache-Control", "")
+    deadline = request_deadline("bulk")
+
+    # items that fail validation are reported right away, the rest fans out
+    rejected, valid, positions = [], [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or "conversation_id" not in item or "message" not in item:
+            rejected.append(BulkResult(
+                index, item.get("conversation_id") if isinstance(item, dict) else None,
+                error=ValueError("Missing 'conversation_id' or 'message'.")))
+            continue
+        gen_config_override_dict = item.get("generation_config")
+        try:
+            gen_config = config_registry.resolve(
+                config_id=item.get("config_id"),
+                data=gen_config_override_dict if isinstance(
+                    gen_config_override_dict, dict) else None,
+                )
+        except (ValueError, TypeError) as e:
+            rejected.append(BulkResult(index, item["conversation_id"],
+                                       error=ValueError(f"Invalid 'generation_config': {e}")))
+            continue
+        valid.append((item["conversation_id"], item["message"], gen_config))
+        positions.append(index)
+
+    def generate():
+        counts = {"succeeded": 0, "failed": 0}
+        # the fan-out copies the deadline into its workers when it starts them
+        with deadline_scope(deadline):
+            results = conversation_manager.send_messages(
+                valid, model_name=model_name_override, client=client,
+                max_concurrency=max_concurrency, use_cache=use_cache, router=bulk_router)
+        try:
+            for result in rejected:
+                counts["failed"] += 1
+                yield format_sse(serialize_bulk_result(result))
+            for result in results:
+                result = result._replace(index=positions[result.index])
+                counts["failed" if result.error else "succeeded"] += 1
+                yield format_sse(serialize_bulk_result(result))
+        finally:
+            results.close()
+        yield format_sse(counts, event="done")
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.route("/stats", methods=["GET"])
+def stats_api():
+    """
+    Reports the footprint of in-process state, e.g. conversation count,
+    history bytes and eviction counters.
+    """
+    stats = {
+        "conversations": conversation_manager.stats(),
+        "config_registry": config_registry.stats(),
+    }
+    if conversation_manager.context_cache is not None:
+        stats["context_cache"] = conversation_manager.context_cache.stats()
+    if conversation_manager.response_cache is not None:
+        stats["response_cache"] = conversation_manager.response_cache.stats()
+    if conversation_manager.thinking_policy is not None:
+        stats["thinking_policy"] = conversation_manager.thinking_policy.stats()
+    if conversation_manager.single_flight is not None:
+        stats["single_flight"] = conversation_manager.single_flight.stats()
+    if conversation_manager.retriever is not None:
+        stats["retrieval"] = conversation_manager.retriever.stats()
+    stats["jobs"] = job_queue.stats()
+    limiter = getattr(client, "limiter", None)
+    if limiter is not None:
+        stats["rate_limiter"] = limiter.stats()
+    if model_router is not None:
+        stats["model_router"] = model_router.stats()
+    return jsonify(stats)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_api():
+    """
+    Prometheus text exposition of this worker's HTTP and model metrics.
+    """
+    return Response(metrics.registry.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.errorhandler(400)
 def bad_request(error):
     return jsonify(error=str(error.description)), 400
@@ -153,11 +559,33 @@ def not_found(error):
     return jsonify(error=str(error.description)), 404
 
 
+@app.errorhandler(409)
+def conflict(error):
+    return jsonify(error=str(error.description)), 409
+
+
+@app.errorhandler(429)
+def too_many_requests(error):
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else {}
+    return jsonify(error=str(error.description)), 429, headers
+
+
 @app.errorhandler(500)
 def internal_server_error(error):
     return jsonify(error=str(error.description)), 500
 
 
+@app.errorhandler(503)
+def service_unavailable(error):
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else {}
+    return jsonify(error=str(error.description)), 503, headers
+
+
+@app.errorhandler(504)
+def gateway_timeout(error):
+    return jsonify(error=str(error.description)), 504
+
+
 if __name__ == '__main__':
     print(f"--- RUNNING __main__ ---")
     print(f"Flask app debug actual: {app.debug}")
@@ -0,0 +1,494 @@
+"""
+ASGI flavour of app.py built on Quart and client.aio, so an in-flight model
+call only holds a coroutine instead of a worker thread.
+Run with:
+    hypercorn async_app:app --bind 0.0.0.0:9797
+"""
+from functools import partial
+from typing import Optional, Tuple
+from quart import Quart, Response, abort, request, jsonify, url_for
+import asyncio
+import math
+import os
+from async_conversation import AsyncConversationManager
+from conversation import manager_logger, BulkResult, ConversationBusyError, ConversationNotFoundError
+from google.genai import types
+from google_client import client
+from config import conversation_manager_options, deadline_options, job_queue_options, model_router_options
+from config_registry import ConfigRegistry
+from model_router import RoutingDecision, build_model_router
+from deadline import Deadline, DeadlineExceeded, deadline_scope, parse_timeout
+from jobs import JobQueue, QueueFullError
+from rate_limiter import RateLimitError
+from serialization import compress_body, format_sse, history_page_body, parse_history_window, serialize_bulk_result
+import metrics
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+app = Quart(__name__)
+
+conversation_manager = AsyncConversationManager(
+    **conversation_manager_options(client))
+# compiled generation_config overrides kept for reuse, plus the named presets
+config_registry = ConfigRegistry(
+    max_entries=int(os.environ.get("CONFIG_CACHE_SIZE", "256")), default_id="google_search")
+
+metrics.registry.gauge(
+    "conversations", "Conversations held by this worker's ConversationManager.").set_function(
+    lambda: len(conversation_manager))
+metrics.registry.gauge(
+    "conversation_history_bytes", "Text held by all conversation histories of this worker.").set_function(
+    lambda: conversation_manager.stats()["history_bytes"])
+
+# keeps the local retrieval index in step with the documents table
+if conversation_manager.retriever is not None:
+    conversation_manager.retriever.start()
+
+# background messages, the workers are threads that hand the turn to the event loop
+job_queue = JobQueue(**job_queue_options())
+metrics.registry.gauge(
+    "jobs_queued", "Jobs of this worker waiting for a job worker.").set_function(
+    lambda: job_queue.stats()["queued"])
+metrics.registry.gauge(
+    "jobs_running", "Jobs of this worker being run.").set_function(
+    lambda: job_queue.stats()["running"])
+
+
+@app.before_serving
+async def warm_up_clients():
+    # client.aio pools are bound to the serving loop, so warm up from inside it
+    if os.environ.get("WARM_UP_CLIENTS", "").lower() in ("1", "true"):
+        from google_client import async_warm_up
+        await async_warm_up()
+
+
+DEFAULT_CHAT_MODEL_NAME = os.environ.get("DEFAULT_CHAT_MODEL_NAME")
+
+# latency-aware routing over MODEL_ROUTES, see app.py
+model_router = None
+model_router_settings = model_router_options()
+if model_router_settings["routes"]:
+    from google_client import regional_client
+    model_router = build_model_router(regional_client, **model_router_settings)
+    DEFAULT_CHAT_MODEL_NAME = model_router.alias
+# upper bound for the items of one bulk message request
+MAX_BULK_ITEMS = int(os.environ.get("MAX_BULK_ITEMS", "1000"))
+MAX_HISTORY_PAGE = int(os.environ.get("MAX_HISTORY_PAGE", "0"))
+DEADLINES = deadline_options()
+
+
+def request_deadline(route: str) -> Optional[Deadline]:
+    try:
+        return parse_timeout(request.headers.get("X-Request-Timeout"), DEADLINES[route], DEADLINES["max"])
+    except ValueError as e:
+        abort(400, description=str(e))
+
+
+async def parse_job_request() -> Optional[Tuple[int, Optional[str]]]:
+    """
+    Async counterpart of app.parse_job_request.
+    """
+    data = await request.get_json(silent=True)
+    if data.get("async") is not True and "respond-async" not in request.headers.get("Prefer", ""):
+        return None
+    priority = data.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        abort(400, description="'priority' must be an integer.")
+    webhook = data.get("webhook")
+    if webhook is not None:
+        try:
+            job_queue.check_webhook(webhook if isinstance(webhook, str) else "")
+        except ValueError as e:
+            abort(400, description=str(e))
+    return priority, webhook
+
+
+async def parse_message_request(conversation_id: str) -> Tuple[str, str, types.GenerateContentConfig, bool]:
+    """
+    Async counterpart of app.parse_message_request.
+    """
+    conversation = conversation_manager.get_conversation(conversation_id)
+    if not conversation:
+        abort(
+            404, description=f"Conversation with ID '{conversation_id}' not found.")
+
+    data = await request.get_json(silent=True)
+    if not data or "message" not in data:
+        abort(400, description="Missing 'message' in request body.")
+
+    user_message = data["message"]
+    model_name_override = data.get("model_name", DEFAULT_CHAT_MODEL_NAME)
+
+    # "generation_config" wins over a preset "config_id", both are compiled once and shared
+    gen_config_override_dict = data.get("generation_config")
+    if not isinstance(gen_config_override_dict, dict):
+        gen_config_override_dict = None
+    try:
+        current_gen_config = config_registry.resolve(
+            config_id=data.get("config_id"),
+            data=gen_config_override_dict,
+        )
+    except (ValueError, TypeError) as e:
+        abort(400, description=f"Invalid 'generation_config': {e}")
+
+    # "cache": false or Cache-Control: no-cache skip the response cache
+    use_cache = data.get("cache", True) is not False and \
+        "no-cache" not in request.headers.get("Cache-Control", "")
+
+    return user_message, model_name_override, current_gen_config, use_cache
+
+
+@app.route("/conversations", methods=["POST"])
+async def create_conversation_api():
+    conversation_id = conversation_manager.create_conversation()
+    return jsonify({"conversation_id": conversation_id}), 201
+
+
+@app.route("/conversations/<string:conversation_id>", methods=["GET"])
+async def get_conversation_api(conversation_id: str):
+    conversation = conversation_manager.get_conversation(conversation_id)
+    if not conversation:
+        abort(
+            404, description=f"Conversation with ID '{conversation_id}' not found.")
+    try:
+        since, limit = parse_history_window(request.args, MAX_HISTORY_PAGE)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    turns_json, count, total, version = conversation.serialized_turns(since, limit)
+    if request.if_none_match.contains_weak(version):
+        response = Response(b"", status=304)
+    else:
+        body, encoding = compress_body(
+            history_page_body(conversation_id, turns_json, count, total, since),
+            request.headers.get("Accept-Encoding", ""))
+        response = Response(body, content_type="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(version, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@app.route("/conversations/<string:conversation_id>", methods=["DELETE"])
+async def delete_conversation_api(conversation_id: str):
+    if conversation_manager.delete_conversation(conversation_id):
+        return jsonify({"message": f"Conversation '{conversation_id}' deleted successfully."}), 200
+    else:
+        abort(
+            404, description=f"Conversation with ID '{conversation_id}' not found for deletion.")
+
+
+async def run_message(conversation_id: str, user_message: str, model_name: str,
+                      generation_config: types.GenerateContentConfig, use_cache: bool) -> dict:
+    send = partial(
+        conversation_manager.send_message_to_conversation,
+        conversation_id=conversation_id,
+        message=user_message,
+        generation_config=generation_config,
+        use_cache=use_cache,
+    )
+    routing = None
+    if model_router is not None and model_router.handles(model_name):
+        routing = RoutingDecision()
+        model_response = await model_router.async_call(
+            lambda route: send(model_name=route.model, client=route.client), routing)
+    else:
+        model_response = await send(model_name=model_name, client=client)
+    body = {"response": model_response}
+    if routing is not None:
+        body["routing"] = routing.to_dict()
+    return body
+
+
+def submit_message_job(conversation_id: str, job_options: Tuple[int, Optional[str]], *message_args):
+    loop = asyncio.get_running_loop()
+
+    async def run_async():
+        with deadline_scope(parse_timeout(None, DEADLINES["jobs"], DEADLINES["max"])):
+            return await run_message(conversation_id, *message_args)
+
+    def run():
+        # the job worker thread holds its slot until the turn is done on the loop
+        return asyncio.run_coroutine_threadsafe(run_async(), loop).result()
+
+    priority, webhook = job_options
+    try:
+        job = job_queue.submit(conversation_id, run, priority=priority, webhook=webhook)
+    except QueueFullError as qf:
+        abort(503, description=str(qf), retry_after=5)
+    status_url = url_for("get_job_api", job_id=job.id)
+    return jsonify({"job_id": job.id, "status": job.status, "status_url": status_url}), 202, {
+        "Location": status_url}
+
+
+@app.route("/conversations/<string:conversation_id>/messages", methods=["POST"])
+async def send_message_api(conversation_id: str):
+    user_message, model_name_override, current_gen_config, use_cache = await parse_message_request(
+        conversation_id)
+    job_options = await parse_job_request()
+    if job_options is not None:
+        return submit_message_job(conversation_id, job_options, user_message,
+                                  model_name_override, current_gen_config, use_cache)
+    deadline = request_deadline("messages")
+
+    try:
+        with deadline_scope(deadline):
+            body = await run_message(conversation_id, user_message,
+                                     model_name_override, current_gen_config, use_cache)
+        return jsonify(body)
+    except ConversationNotFoundError as nf:
+        abort(404, description=str(nf))
+    except ValueError as ve:
+        manager_logger.error(
+            f"ValueError in async send_message_api for {conversation_id}: {ve}")
+        abort(400, description=str(ve))
+    except ConversationBusyError as be:
+        abort(409, description=str(be))
+    except RateLimitError as rl:
+        abort(429, description=str(rl), retry_after=max(1, math.ceil(rl.retry_after)))
+    except DeadlineExceeded as de:
+        abort(504, description=str(de))
+    except Exception as e:
+        manager_logger.error(
+            f"Unexpected error in async send_message_api for {conversation_id}: {e}", exc_info=True)
+        abort(500, description="An internal server error occurred.")
+
+
+@app.route("/jobs/<string:job_id>", methods=["GET"])
+async def get_job_api(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404, description=f"Job with ID '{job_id}' not found.")
+    headers = {} if job.done else {"Retry-After": "1"}
+    return jsonify(job.to_dict()), 200, headers
+
+
+@app.route("/conversations/<string:conversation_id>/messages:stream", methods=["POST"])
+async def stream_message_api(conversation_id: str):
+    user_message, model_name_override, current_gen_config, use_cache = await parse_message_request(
+        conversation_id)
+    deadline = request_deadline("stream")
+
+    open_stream = partial(
+        conversation_manager.send_message_stream_to_conversation,
+        conversation_id=conversation_id,
+        message=user_message,
+        generation_config=current_gen_config,
+        use_cache=use_cache,
+    )
+    routing = None
+    if model_router is not None and model_router.handles(model_name_override):
+        routing = RoutingDecision()
+        stream = model_router.async_stream(
+            lambda route: open_stream(model_name=route.model, client=route.client), routing)
+    else:
+        stream = open_stream(model_name=model_name_override, client=client)
+    try:
+        with deadline_scope(deadline):
+            first_chunk = await anext(stream, None)
+    except ConversationNotFoundError as nf:
+        abort(404, description=str(nf))
+    except ValueError as ve:
+        manager_logger.error(
+            f"ValueError in async stream_message_api for {conversation_id}: {ve}")
+        abort(400, description=str(ve))
+    except ConversationBusyError as be:
+        abort(409, description=str(be))
+    except RateLimitError as rl:
+        abort(429, description=str(rl), retry_after=max(1, math.ceil(rl.retry_after)))
+    except DeadlineExceeded as de:
+        abort(504, description=str(de))
+    except Exception as e:
+        manager_logger.error(
+            f"Unexpected error in async stream_message_api for {conversation_id}: {e}", exc_info=True)
+        abort(500, description="An internal server error occurred.")
+
+    async def generate():
+        text_chunks = []
+        try:
+            if first_chunk is not None:
+                text_chunks.append(first_chunk)
+                yield format_sse({"text": first_chunk})
+            while True:
+                with deadline_scope(deadline):
+                    chunk = await anext(stream, None)
+                if chunk is None:
+                    break
+                text_chunks.append(chunk)
+                yield format_sse({"text": chunk})
+        except DeadlineExceeded as de:
+            yield format_sse({"error": str(de)}, event="error")
+            return
+        except Exception as e:
+            manager_logger.error(
+                f"Async stream for {conversation_id} failed mid-way: {e}", exc_info=True)
+            yield format_sse({"error": "An internal server error occurred."}, event="error")
+            return
+        finally:
+            # also reached when the client went away, cancels the upstream call
+            with deadline_scope(deadline):
+                await stream.aclose()
+        done = {"response": "".join(text_chunks)}
+        if routing is not None:
+            done["routing"] = routing.to_dict()
+        yield format_sse(done, event="done")
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.route("/conversations:batchMessages", methods=["POST"])
+async def batch_message_api():
+    """
+    Async counterpart of app.batch_message_api.
+    """
+    data = await request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        abort(400, description="Missing 'items' in request body.")
+    if len(items) > MAX_BULK_ITEMS:
+        abort(400, description=f"At most {MAX_BULK_ITEMS} items per request.")
+
+    model_name_override = data.get("model_name", DEFAULT_CHAT_MODEL_NAME)
+    # the router alias routes every item on its own, with failover
+    bulk_router = model_router if model_router is not None and model_router.handles(
+        model_name_override) else None
+    max_concurrency = data.get("max_concurrency")
+    if max_concurrency is not None and (not isinstance(max_concurrency, int) or max_concurrency < 1):
+        abort(400, description="'max_concurrency' must be a positive integer.")
+    use_cache = data.get("cache", True) is not False and \
+        "no-cache" not in request.headers.get("Cache-Control", "")
+    deadline = request_deadline("bulk")
+
+    # items that fail validation are reported right away, the rest fans out
+    rejected, valid, positions = [], [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or "conversation_id" not in item or "message" not in item:
+            rejected.append(BulkResult(
+                index, item.get("conversation_id") if isinstance(item, dict) else None,
+                error=ValueError("Missing 'conversation_id' or 'message'.")))
+            continue
+        gen_config_override_dict = item.get("generation_config")
+        try:
+            gen_config = config_registry.resolve(
+                config_id=item.get("config_id"),
+                data=gen_config_override_dict if isinstance(
+                    gen_config_override_dict, dict) else None,
+                )
+        except (ValueError, TypeError) as e:
+            rejected.append(BulkResult(index, item["conversation_id"],
+                                       error=ValueError(f"Invalid 'generation_config': {e}")))
+            continue
+        valid.append((item["conversation_id"], item["message"], gen_config))
+        positions.append(index)
+
+    async def generate():
+        counts = {"succeeded": 0, "failed": 0}
+        results = conversation_manager.send_messages(
+            valid, model_name=model_name_override, client=client,
+            max_concurrency=max_concurrency, use_cache=use_cache, router=bulk_router)
+        try:
+            for result in rejected:
+                counts["failed"] += 1
+                yield format_sse(serialize_bulk_result(result))
+            while True:
+                # the fan-out tasks start on the first pull and copy the deadline then
+                with deadline_scope(deadline):
+                    result = await anext(results, None)
+                if result is None:
+                    break
+                result = result._replace(index=positions[result.index])
+                counts["failed" if result.error else "succeeded"] += 1
+                yield format_sse(serialize_bulk_result(result))
+        finally:
+            await results.aclose()
+        yield format_sse(counts, event="done")
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.route("/stats", methods=["GET"])
+async def stats_api():
+    """
+    Reports the footprint of in-process state, e.g. conversation count,
+    history bytes and eviction counters.
+    """
+    stats = {
+        "conversations": conversation_manager.stats(),
+        "config_registry": config_registry.stats(),
+    }
+    if conversation_manager.context_cache is not None:
+        stats["context_cache"] = conversation_manager.context_cache.stats()
+    if conversation_manager.response_cache is not None:
+        stats["response_cache"] = conversation_manager.response_cache.stats()
+    if conversation_manager.thinking_policy is not None:
+        stats["thinking_policy"] = conversation_manager.thinking_policy.stats()
+    if conversation_manager.single_flight is not None:
+        stats["single_flight"] = conversation_manager.single_flight.stats()
+    if conversation_manager.retriever is not None:
+        stats["retrieval"] = conversation_manager.retriever.stats()
+    stats["jobs"] = job_queue.stats()
+    limiter = getattr(client, "limiter", None)
+    if limiter is not None:
+        stats["rate_limiter"] = limiter.stats()
+    if model_router is not None:
+        stats["model_router"] = model_router.stats()
+    return jsonify(stats)
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_api():
+    """
+    Model metrics of this worker, HTTP handlers are only timed by app.py and bigquery_app.py.
+    """
+    return Response(metrics.registry.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.errorhandler(400)
+async def bad_request(error):
+    return jsonify(error=str(error.description)), 400
+
+
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify(error=str(error.description)), 404
+
+
+@app.errorhandler(409)
+async def conflict(error):
+    return jsonify(error=str(error.description)), 409
+
+
+@app.errorhandler(429)
+async def too_many_requests(error):
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else {}
+    return jsonify(error=str(error.description)), 429, headers
+
+
+@app.errorhandler(500)
+async def internal_server_error(error):
+    return jsonify(error=str(error.description)), 500
+
+
+@app.errorhandler(503)
+async def service_unavailable(error):
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else {}
+    return jsonify(error=str(error.description)), 503, headers
+
+
+@app.errorhandler(504)
+async def gateway_timeout(error):
+    return jsonify(error=str(error.description)), 504
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=9797, debug=False, use_reloader=False)
@@ -0,0 +1,396 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from google import genai
+from google.genai import types
+
+import deadline as deadlines
+from conversation import (
+    BulkMessage,
+    BulkResult,
+    ConversationBusyError,
+    ConversationHistory,
+    ConversationManager,
+    ConversationNotFoundError,
+    ModelCall,
+    assemble_stream_response,
+    extract_response_text,
+    group_bulk_messages,
+    manager_logger,
+)
+from model_router import RoutingDecision
+from rate_limiter import RateLimitError
+
+
+async def _aiter(chunks):
+    if isinstance(chunks, list):
+        for chunk in chunks:
+            yield chunk
+    else:
+        async for chunk in chunks:
+            yield chunk
+
+
+async def _within(deadline: Optional[deadlines.Deadline], awaitable):
+    """
+    Awaits until the deadline, cancelling the awaitable (and with it the
+    upstream request) once it passes.
+    """
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, deadline.remaining())
+    except asyncio.TimeoutError:
+        deadline.check()
+        raise
+
+
+async def _aiter_within(chunks, deadline: Optional[deadlines.Deadline]):
+    iterator = _aiter(chunks)
+    try:
+        while True:
+            try:
+                chunk = await _within(deadline, iterator.__anext__())
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        await iterator.aclose()
+        if hasattr(chunks, "aclose"):
+            # cancels the upstream request instead of leaving it to the GC
+            await chunks.aclose()
+
+
+class AsyncConversationHistory(ConversationHistory):
+    """
+    ConversationHistory driven by client.aio. Turns of one conversation are
+    serialized by an asyncio.Lock (queued or rejected as per busy_timeout),
+    while other conversations keep running on the event loop.
+    """
+
+    def __init__(self, busy_timeout: Optional[float] = 0, context_policy=None):
+        super().__init__(busy_timeout=busy_timeout, context_policy=context_policy)
+        self._send_lock = asyncio.Lock()
+
+    @property
+    def is_busy(self) -> bool:
+        return self._send_lock.locked()
+
+    def refresh(self) -> bool:
+        if self._store is None or self.is_busy:
+            return True
+        return self.sync()
+
+    async def async_prepare_call(
+        self,
+        model_name: str,
+        generation_config: Optional[types.GenerateContentConfig],
+        use_cache: bool = True,
+    ) -> ModelCall:
+        if self.context_policy.may_block or self.context_cache is not None or \
+                (self.retriever is not None and self.retriever.may_block):
+            # summarization, embedding and cache calls are blocking, keep them off the event loop
+            return await asyncio.to_thread(self.prepare_call, model_name, generation_config, use_cache)
+        return self.prepare_call(model_name, generation_config, use_cache)
+
+    async def _async_prepare_call_coalesced(
+        self,
+        model_name: str,
+        generation_config: Optional[types.GenerateContentConfig],
+        use_cache: bool = True,
+    ) -> ModelCall:
+        call = await self.async_prepare_call(model_name, generation_config, use_cache)
+        while call.follows:
+            response = await self.single_flight.async_wait(call.flight, deadlines.remaining())
+            if response is not None:
+                call.cached_response = response
+                break
+            call = await self.async_prepare_call(model_name, generation_config, use_cache)
+        return call
+
+    @asynccontextmanager
+    async def async_turn(self):
+        timeout = self._turn_wait()
+        if timeout is not None and timeout <= 0:
+            if self._send_lock.locked():
+                raise ConversationBusyError(
+                    "Conversation is busy with another message, retry later.")
+            await self._send_lock.acquire()
+        else:
+            try:
+                await asyncio.wait_for(self._send_lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                deadline = deadlines.current()
+                if deadline is not None:
+                    deadline.check()
+                raise ConversationBusyError(
+                    "Conversation is busy with another message, retry later.") from None
+        try:
+            yield
+        finally:
+            self._send_lock.release()
+
+    async def send_message(
+        self,
+        model_name: str,
+        client: genai.Client,
+        message: str,
+        generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
+    ) -> types.GenerateContentResponse:
+        async with self.async_turn():
+            user_turn = self._start_turn(message)
+            started_at = time.perf_counter()
+            deadline = deadlines.current()
+            call = None
+            try:
+                call = await self._async_prepare_call_coalesced(
+                    model_name, generation_config, use_cache)
+                response = call.cached_response
+                if response is None:
+                    response = await _within(deadline, client.aio.models.generate_content(
+                        model=model_name,
+                        contents=call.contents,
+                        config=deadlines.with_timeout(call.config, deadline),
+                    ))
+                self.finish_call(call, response=response)
+                self._commit_turn(
+                    user_turn, extract_response_text(response))
+                return response
+            except BaseException as e:
+                # CancelledError included: the request was dropped mid-call
+                print(f"Error during async API call: {e!r}")
+                exceeded = self._turn_failed(call, user_turn, e, started_at)
+                if exceeded is not None:
+                    raise exceeded from e
+                raise
+
+    async def send_message_stream(
+        self,
+        model_name: str,
+        client: genai.Client,
+        message: str,
+        generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[types.GenerateContentResponse]:
+        async with self.async_turn():
+            user_turn = self._start_turn(message)
+            started_at = time.perf_counter()
+            deadline = deadlines.current()
+            text_chunks: List[str] = []
+            call = None
+            try:
+                call = await self._async_prepare_call_coalesced(
+                    model_name, generation_config, use_cache)
+                if call.cached_response is not None:
+                    chunks = [call.cached_response]
+                else:
+                    chunks = await _within(deadline, client.aio.models.generate_content_stream(
+                        model=model_name,
+                        contents=call.contents,
+                        config=deadlines.with_timeout(call.config, deadline),
+                    ))
+                last_chunk = None
+                # every chunk has to arrive before the deadline, the upstream
+                # stream is closed as soon as it passes
+                async for chunk in _aiter_within(chunks, deadline):
+                    if chunk.text:
+                        text_chunks.append(chunk.text)
+                    last_chunk = chunk
+                    yield chunk
+
+                model_response_text = "".join(text_chunks)
+                self.finish_call(call, response=assemble_stream_response(
+                    model_response_text, last_chunk))
+                if not model_response_text:
+                    print("Warning: Stream finished with no usable text content.")
+                    model_response_text = "[No response text found]"
+                self._commit_turn(user_turn, model_response_text)
+            except BaseException as e:
+                print(f"Error during async streaming API call: {e!r}")
+                exceeded = self._turn_failed(call, user_turn, e, started_at)
+                if exceeded is not None:
+                    raise exceeded from e
+                raise
+
+
+class AsyncConversationManager(ConversationManager):
+    """
+    ConversationManager for the asyncio serving path (async_app.py).
+    Lookups stay synchronous, the manager lock is never held across an await.
+    """
+    history_class = AsyncConversationHistory
+    _fanout_tasks: set = set()
+
+    async def send_message_to_conversation(
+        self,
+        conversation_id: str,
+        model_name: str,
+        client: genai.Client,
+        message: str,
+        generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
+    ) -> Optional[str]:
+        manager_logger.info(
+            f"Attempting to send message to conversation '{conversation_id}' using model '{model_name}' (async).")
+
+        conversation = self.get_conversation(conversation_id)
+        if not conversation:
+            manager_logger.error(
+                f"Conversation with ID '{conversation_id}' not found for sending message.")
+            raise ConversationNotFoundError(
+                f"Conversation with ID '{conversation_id}' not found.")
+
+        try:
+            response = await conversation.send_message(
+                model_name=model_name,
+                client=client,
+                message=message,
+                generation_config=generation_config,
+                use_cache=use_cache,
+            )
+            manager_logger.info(
+                f"Successfully sent message and received response for conversation '{conversation_id}'.")
+            self._after_turn(conversation_id)
+            return response.text
+        except ConversationBusyError as be:
+            manager_logger.warning(
+                f"Conversation '{conversation_id}' is busy: {be}")
+            raise
+        except RateLimitError as rl:
+            manager_logger.warning(
+                f"Model call for conversation '{conversation_id}' throttled: {rl}")
+            raise
+        except ValueError as ve:
+            manager_logger.error(
+                f"ValueError during message sending for conversation '{conversation_id}': {ve}", exc_info=False)
+            raise
+        except Exception as e:
+            manager_logger.error(
+                f"An unexpected error occurred while sending message to conversation '{conversation_id}': {e}",
+                exc_info=True
+            )
+            raise
+
+    async def send_message_stream_to_conversation(
+        self,
+        conversation_id: str,
+        model_name: str,
+        client: genai.Client,
+        message: str,
+        generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        manager_logger.info(
+            f"Attempting to stream message to conversation '{conversation_id}' using model '{model_name}' (async).")
+
+        conversation = self.get_conversation(conversation_id)
+        if not conversation:
+            manager_logger.error(
+                f"Conversation with ID '{conversation_id}' not found for streaming message.")
+            raise ConversationNotFoundError(
+                f"Conversation with ID '{conversation_id}' not found.")
+
+        started_at = time.perf_counter()
+        first_token_at = None
+        stream = conversation.send_message_stream(
+            model_name=model_name,
+            client=client,
+            message=message,
+            generation_config=generation_config,
+            use_cache=use_cache,
+        )
+        try:
+            async for chunk in stream:
+                if not chunk.text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    manager_logger.info(
+                        f"Time to first token for conversation '{conversation_id}': {first_token_at - started_at:.3f}s")
+                yield chunk.text
+            manager_logger.info(
+                f"Successfully streamed response for conversation '{conversation_id}' in {time.perf_counter() - started_at:.3f}s.")
+            self._after_turn(conversation_id)
+        except ConversationBusyError as be:
+            manager_logger.warning(
+                f"Conversation '{conversation_id}' is busy: {be}")
+            raise
+        except RateLimitError as rl:
+            manager_logger.warning(
+                f"Model call for conversation '{conversation_id}' throttled: {rl}")
+            raise
+        except GeneratorExit:
+            manager_logger.warning(
+                f"Stream for conversation '{conversation_id}' closed before completion, turn rolled back.")
+            raise
+        except Exception as e:
+            manager_logger.error(
+                f"An unexpected error occurred while streaming message to conversation '{conversation_id}': {e}",
+                exc_info=True
+            )
+            raise
+        finally:
+            await stream.aclose()
+
+    async def send_messages(
+        self,
+        items: Iterable[Tuple],
+        model_name: str,
+        client: genai.Client,
+        max_concurrency: Optional[int] = None,
+        use_cache: bool = True,
+        router=None,
+    ) -> AsyncIterator[BulkResult]:
+        """
+        Async counterpart of ConversationManager.send_messages, fanout_workers
+        bounds the conversations in flight instead of a thread pool.
+        """
+        groups = group_bulk_messages(items)
+        semaphore = asyncio.Semaphore(
+            min(max_concurrency or self.fanout_workers, self.fanout_workers))
+        remaining = sum(len(group) for group in groups.values())
+        results: "asyncio.Queue[BulkResult]" = asyncio.Queue()
+        stopped = False
+
+        async def run_group(group: List[Tuple[int, BulkMessage]]):
+            async with semaphore:
+                for index, item in group:
+                    if stopped:
+                        return
+                    send = partial(
+                        self.send_message_to_conversation,
+                        conversation_id=item.conversation_id,
+                        message=item.message,
+                        generation_config=item.generation_config,
+                        use_cache=use_cache,
+                    )
+                    routing = RoutingDecision() if router is not None else None
+                    try:
+                        if router is not None:
+                            response = await router.async_call(
+                                lambda route: send(model_name=route.model, client=route.client), routing)
+                        else:
+                            response = await send(model_name=model_name, client=client)
+                        results.put_nowait(BulkResult(
+                            index, item.conversation_id, response=response,
+                            routing=routing.to_dict() if routing else None))
+                    except Exception as e:
+                        results.put_nowait(BulkResult(
+                            index, item.conversation_id, error=e,
+                            routing=routing.to_dict() if routing else None))
+
+        # the loop only keeps weak references, in-flight turns must outlive an early close
+        tasks = {asyncio.create_task(run_group(group))
+                 for group in groups.values()}
+        self._fanout_tasks.update(tasks)
+        for task in tasks:
+            task.add_done_callback(self._fanout_tasks.discard)
+        try:
+            for _ in range(remaining):
+                yield await results.get()
+        finally:
+            stopped = True
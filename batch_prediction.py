@@ -0,0 +1,411 @@
+"""
+Offline batch mode for bulk prompts that do not need interactive latency.
+
+Prompts are written into sharded JSONL request files, one
+{"key": ..., "request": GenerateContentRequest} line each, submitted as batch
+prediction jobs and polled. Predictions are streamed back into an output JSONL
+matched by key as each job finishes. All progress lives in `work_dir`, so
+running the same command again resumes in-flight jobs and retries only the
+lines without a result yet.
+
+    python batch_prediction.py prompts.jsonl results.jsonl --config rag_assistant \\
+        --work-dir batch_runs/news --gcs-prefix gs://bucket/batch
+    python batch_prediction.py prompts.jsonl results.jsonl --local
+
+Input lines are {"key": "...", "prompt": "..."}, the key defaults to the line number.
+Output lines are {"key": "...", "response": "..."}, keys that still failed after
+all attempts end up in `work_dir`/failed.jsonl.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from google.genai import types
+
+from conversation import extract_response_text
+
+batch_logger = logging.getLogger(__name__)
+
+# GenerateContentConfig fields that sit on the request itself, the rest
+# belongs to generationConfig
+REQUEST_FIELDS = {
+    "systemInstruction", "tools", "toolConfig", "safetySettings", "cachedContent", "labels"}
+# fields the batch API does not take per line
+IGNORED_FIELDS = {"httpOptions", "shouldReturnHttpResponse"}
+
+DONE_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+}
+TERMINAL_STATES = DONE_STATES | {
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+}
+
+
+def request_template(config: Optional[types.GenerateContentConfig]) -> Dict[str, Any]:
+    """
+    Turns a GenerateContentConfig into the REST request fields shared by every line.
+    """
+    if config is None:
+        return {}
+    data = config.model_dump(mode="json", by_alias=True, exclude_none=True)
+    template: Dict[str, Any] = {}
+    generation_config = {}
+    for field, value in data.items():
+        if field in IGNORED_FIELDS:
+            continue
+        if field in REQUEST_FIELDS:
+            template[field] = value
+        else:
+            generation_config[field] = value
+    if generation_config:
+        template["generationConfig"] = generation_config
+
+    system_instruction = template.get("systemInstruction")
+    if isinstance(system_instruction, str):
+        template["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    elif isinstance(system_instruction, list):
+        # a list of parts, the request takes a single Content
+        template["systemInstruction"] = {"parts": system_instruction}
+    return template
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_prompts(path: str) -> Iterator[Tuple[str, str]]:
+    for line_number, record in enumerate(read_jsonl(path)):
+        yield str(record.get("key", line_number)), record["prompt"]
+
+
+class LocalStorage:
+    """
+    Keeps request and prediction files on the local filesystem, which is
+    what the local stand-in of the batch API reads and writes.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def upload(self, local_path: str) -> str:
+        return os.path.abspath(local_path)
+
+    def output_uri(self, name: str) -> str:
+        return os.path.join(self.root, "output", name)
+
+    def read_jsonl(self, uri: str) -> Iterator[Dict[str, Any]]:
+        for path in sorted(glob.glob(os.path.join(uri, "**", "*.jsonl"), recursive=True)):
+            yield from read_jsonl(path)
+
+
+class GCSStorage:
+    """
+    Stages request files in and reads predictions from Cloud Storage under
+    `prefix` (gs://bucket/path). Needs google-cloud-storage.
+    """
+
+    def __init__(self, prefix: str, project: Optional[str] = None):
+        from google.cloud import storage
+
+        bucket_name, _, path = prefix[len("gs://"):].partition("/")
+        self.client = storage.Client(project=project)
+        self.bucket = self.client.bucket(bucket_name)
+        self.path = path.strip("/")
+
+    def _uri(self, name: str) -> str:
+        return f"gs://{self.bucket.name}/{self.path}/{name}" if self.path else f"gs://{self.bucket.name}/{name}"
+
+    def upload(self, local_path: str) -> str:
+        name = f"input/{os.path.basename(os.path.dirname(local_path))}/{os.path.basename(local_path)}"
+        blob_name = f"{self.path}/{name}" if self.path else name
+        self.bucket.blob(blob_name).upload_from_filename(local_path)
+        return self._uri(name)
+
+    def output_uri(self, name: str) -> str:
+        return self._uri(f"output/{name}")
+
+    def read_jsonl(self, uri: str) -> Iterator[Dict[str, Any]]:
+        prefix = uri[len(f"gs://{self.bucket.name}/"):]
+        for blob in self.client.list_blobs(self.bucket, prefix=prefix):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            for line in blob.download_as_text().splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class BatchPipeline:
+    def __init__(self, client, model_name: str, config: Optional[types.GenerateContentConfig],
+                 work_dir: str, storage=None, shard_size: int = 1000,
+                 poll_interval: float = 30.0, max_attempts: int = 3):
+        """
+        Args:
+            client: genai client, or a stand-in providing client.batches.
+            config: generation config applied to every prompt.
+            work_dir: request shards, the job manifest and failed.jsonl go here.
+            storage: LocalStorage (default) or GCSStorage for the Vertex AI batch API.
+            shard_size: prompts per request file, one batch job per file.
+            max_attempts: submissions per run for lines that have not succeeded yet.
+        """
+        self.client = client
+        self.model_name = model_name
+        self.work_dir = work_dir
+        self.storage = storage or LocalStorage(work_dir)
+        self.shard_size = shard_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        # every line shares the config, serialize it once
+        self._template = request_template(config)
+        self._manifest_path = os.path.join(work_dir, "manifest.json")
+        os.makedirs(work_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"jobs": []}
+        # tells the display names of this work_dir's jobs apart from other runs in the project
+        manifest.setdefault("run", uuid.uuid4().hex[:8])
+        return manifest
+
+    def _save_manifest(self):
+        # write-then-rename, a crash never leaves a truncated manifest behind
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self._manifest_path)
+
+    def request_line(self, key: str, prompt: str) -> Dict[str, Any]:
+        request = dict(self._template)
+        request["contents"] = [
+            {"role": "user", "parts": [{"text": prompt}]}]
+        return {"key": key, "request": request}
+
+    def _write_shards(self, attempt: int, prompts: Dict[str, str], keys: List[str]) -> List[str]:
+        attempt_dir = os.path.join(self.work_dir, f"attempt-{attempt:03d}")
+        os.makedirs(attempt_dir, exist_ok=True)
+        paths = []
+        for start in range(0, len(keys), self.shard_size):
+            path = os.path.join(
+                attempt_dir, f"input-{start // self.shard_size:05d}.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                for key in keys[start:start + self.shard_size]:
+                    f.write(json.dumps(self.request_line(
+                        key, prompts[key]), ensure_ascii=False) + "\n")
+            paths.append(path)
+        return paths
+
+    def _submit(self, attempt: int, shard_path: str):
+        name = f"attempt-{attempt:03d}/{os.path.splitext(os.path.basename(shard_path))[0]}"
+        entry = {
+            "attempt": attempt,
+            "shard": shard_path,
+            "job": None,
+            "display_name": f"{self.manifest['run']}-{name.replace('/', '-')}",
+            "dest": self.storage.output_uri(name),
+            "collected": False,
+        }
+        # recorded before the job exists, a crash in between is reconciled by
+        # display_name on resume instead of paying for the shard twice
+        self.manifest["jobs"].append(entry)
+        self._save_manifest()
+        self._create(entry)
+
+    def _create(self, entry: Dict[str, Any]):
+        job = self.client.batches.create(
+            model=self.model_name,
+            src=self.storage.upload(entry["shard"]),
+            config=types.CreateBatchJobConfig(
+                display_name=entry["display_name"], dest=entry["dest"]),
+        )
+        batch_logger.info(f"Submitted {entry['shard']} as {job.name}")
+        entry["job"] = job.name
+        self._save_manifest()
+
+    def _reconcile(self) -> int:
+        """
+        Finds the jobs of entries a previous run recorded but did not get a
+        job name back for, and submits the ones that were never created.
+        Returns:
+            The number of jobs submitted.
+        """
+        unknown = {entry["display_name"]: entry for entry in self.manifest["jobs"]
+                   if entry["job"] is None}
+        if not unknown:
+            return 0
+        for job in self.client.batches.list():
+            entry = unknown.pop(job.display_name, None)
+            if entry is not None:
+                batch_logger.info(f"Found {job.name} for {entry['shard']}")
+                entry["job"] = job.name
+        self._save_manifest()
+        for entry in unknown.values():
+            self._create(entry)
+        return len(unknown)
+
+    @staticmethod
+    def _done_keys(output_path: str) -> Set[str]:
+        if not os.path.exists(output_path):
+            return set()
+        keys = set()
+        with open(output_path, "r+b") as f:
+            lines = f.readlines()
+            offset = 0
+            for number, line in enumerate(lines):
+                if line.strip():
+                    try:
+                        keys.add(json.loads(line)["key"])
+                    except ValueError:
+                        if number < len(lines) - 1:
+                            raise
+                        # a run died mid-write, drop the partial line so the
+                        # next result starts on a line of its own
+                        batch_logger.warning(f"Dropping a partial last line of {output_path}")
+                        f.truncate(offset)
+                        break
+                offset += len(line)
+            else:
+                if lines and not lines[-1].endswith(b"\n"):
+                    f.write(b"\n")
+        return keys
+
+    def _collect(self, entry: Dict[str, Any], job: types.BatchJob, prompts: Dict[str, str],
+                 done: Set[str], errors: Dict[str, str], output):
+        missing = "Missing from batch output."
+        if job.state in DONE_STATES:
+            output_dir = (job.output_info and job.output_info.gcs_output_directory) or entry["dest"]
+            for record in self.storage.read_jsonl(output_dir):
+                key = record.get("key")
+                if key not in prompts or key in done:
+                    continue
+                if record.get("status") or not record.get("response"):
+                    errors[key] = record.get("status") or "Empty response."
+                    continue
+                response = types.GenerateContentResponse.model_validate(
+                    record["response"])
+                output.write(json.dumps(
+                    {"key": key, "response": extract_response_text(response)}, ensure_ascii=False) + "\n")
+                done.add(key)
+                errors.pop(key, None)
+            output.flush()
+        else:
+            missing = job.error.message if job.error else job.state.name
+            batch_logger.warning(
+                f"Batch job {job.name} ended in {job.state.name}: {missing}")
+        for record in read_jsonl(entry["shard"]):
+            if record["key"] not in done:
+                errors.setdefault(record["key"], missing)
+        entry["collected"] = True
+        entry["state"] = job.state.name
+        self._save_manifest()
+
+    def _wait_and_collect(self, prompts: Dict[str, str], done: Set[str], errors: Dict[str, str], output):
+        """
+        Polls every uncollected job and streams results of whichever finishes first.
+        """
+        while True:
+            pending = [entry for entry in self.manifest["jobs"]
+                       if not entry["collected"]]
+            if not pending:
+                return
+            for entry in pending:
+                job = self.client.batches.get(name=entry["job"])
+                if job.state in TERMINAL_STATES:
+                    self._collect(entry, job, prompts, done, errors, output)
+            if any(not entry["collected"] for entry in pending):
+                time.sleep(self.poll_interval)
+
+    def run(self, prompts: Iterable[Tuple[str, str]], output_path: str) -> Dict[str, Any]:
+        """
+        Runs (or resumes) the batch until every prompt has a result or the
+        attempts of this run are used up.
+        Args:
+            prompts: (key, prompt) pairs, keys must be unique.
+            output_path: JSONL of results, appended to across runs.
+        Returns:
+            Summary with succeeded/failed counts and the number of jobs submitted.
+        """
+        prompts = dict(prompts)
+        done = self._done_keys(output_path) & prompts.keys()
+        errors: Dict[str, str] = {}
+        submitted = 0
+        with open(output_path, "a", encoding="utf-8") as output:
+            # a previous run may have stopped while its jobs were still running
+            submitted += self._reconcile()
+            self._wait_and_collect(prompts, done, errors, output)
+
+            first_attempt = max((entry["attempt"] for entry in self.manifest["jobs"]), default=-1) + 1
+            for attempt in range(first_attempt, first_attempt + self.max_attempts):
+                remaining = [key for key in prompts if key not in done]
+                if not remaining:
+                    break
+                for shard_path in self._write_shards(attempt, prompts, remaining):
+                    self._submit(attempt, shard_path)
+                    submitted += 1
+                self._wait_and_collect(prompts, done, errors, output)
+
+        failed = {key: errors.get(key, "Not submitted.")
+                  for key in prompts if key not in done}
+        with open(os.path.join(self.work_dir, "failed.jsonl"), "w", encoding="utf-8") as f:
+            for key, error in failed.items():
+                f.write(json.dumps({"key": key, "error": error}, ensure_ascii=False) + "\n")
+        return {
+            "total": len(prompts),
+            "succeeded": len(done),
+            "failed": len(failed),
+            "jobs_submitted": submitted,
+        }
+
+
+def main():
+    from config_registry import ConfigRegistry
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("prompts", help="input JSONL of {\"key\", \"prompt\"}")
+    parser.add_argument("output", help="output JSONL of {\"key\", \"response\"}")
+    parser.add_argument("--config", default="google_search",
+                        help="preset from config.py, e.g. rag_assistant or google_search")
+    parser.add_argument("--model", default=os.environ.get("DEFAULT_CHAT_MODEL_NAME", "gemini-2.5-flash"))
+    parser.add_argument("--work-dir", default="batch_runs/default")
+    parser.add_argument("--gcs-prefix", help="gs://bucket/path for request and prediction files")
+    parser.add_argument("--shard-size", type=int, default=1000)
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--local", action="store_true",
+                        help="run against the local stand-in of the batch API")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.local:
+        from fake_genai import FakeClient
+        client, storage = FakeClient(), LocalStorage(args.work_dir)
+    else:
+        if not args.gcs_prefix:
+            parser.error("--gcs-prefix is required unless --local is set")
+        from google_client import client
+        storage = GCSStorage(args.gcs_prefix)
+
+    pipeline = BatchPipeline(
+        client, args.model, ConfigRegistry().preset(args.config), args.work_dir,
+        storage=storage, shard_size=args.shard_size,
+        poll_interval=0.0 if args.local else args.poll_interval,
+        max_attempts=args.max_attempts,
+    )
+    print(pipeline.run(read_prompts(args.prompts), args.output))
+
+
+if __name__ == "__main__":
+    main()
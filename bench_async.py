@@ -0,0 +1,96 @@
+"""
+Load test for the asyncio serving path against a simulated high-latency backend.
+
+Fires N concurrent message requests at async_app (in-process ASGI) and, for
+comparison, at the Flask app behind a fixed-size thread pool that models a
+WSGI worker budget. No network access or credentials are needed.
+
+    python bench_async.py --requests 500 --latency 2.0 --wsgi-workers 16
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import types as pytypes
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_genai import FakeClient
+
+# the apps import their client from google_client, which talks to Vertex AI
+# at import time. Swap in the fake before they are imported.
+fake_client_module = pytypes.ModuleType("google_client")
+fake_client_module.client = FakeClient()
+fake_client_module.bigquery_client = None
+sys.modules["google_client"] = fake_client_module
+
+
+def report(name: str, latencies: list, elapsed: float):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>6}: {len(latencies)} requests in {elapsed:.2f}s "
+          f"-> {len(latencies) / elapsed:.1f} req/s, p50 {p50:.3f}s, p99 {p99:.3f}s")
+
+
+async def run_async(num_requests: int, latency: float):
+    import async_app
+    async_app.client = FakeClient(latency=latency)
+    test_client = async_app.app.test_client()
+
+    conversation_ids = []
+    for _ in range(num_requests):
+        response = await test_client.post("/conversations")
+        conversation_ids.append((await response.get_json())["conversation_id"])
+
+    # latencies are measured from the start of the burst, so time spent
+    # queueing for a free worker counts too
+    async def send(conversation_id: str) -> float:
+        response = await test_client.post(
+            f"/conversations/{conversation_id}/messages", json={"message": "hello"})
+        assert response.status_code == 200, await response.get_data()
+        return time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    latencies = await asyncio.gather(*(send(cid) for cid in conversation_ids))
+    report("asgi", latencies, time.perf_counter() - started_at)
+
+
+def run_wsgi(num_requests: int, latency: float, workers: int):
+    import app
+    app.client = FakeClient(latency=latency)
+    test_client = app.app.test_client()
+
+    conversation_ids = [
+        test_client.post("/conversations").get_json()["conversation_id"]
+        for _ in range(num_requests)
+    ]
+
+    def send(conversation_id: str) -> float:
+        response = test_client.post(
+            f"/conversations/{conversation_id}/messages", json={"message": "hello"})
+        assert response.status_code == 200, response.data
+        return time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        latencies = list(executor.map(send, conversation_ids))
+    report("wsgi", latencies, time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=2.0,
+                        help="simulated model latency in seconds")
+    parser.add_argument("--wsgi-workers", type=int, default=16,
+                        help="thread budget for the WSGI comparison, 0 to skip")
+    args = parser.parse_args()
+
+    asyncio.run(run_async(args.requests, args.latency))
+    if args.wsgi_workers:
+        run_wsgi(args.requests, args.latency, args.wsgi_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+Load test of the chat app against a local fake Gemini backend.
+
+Closed-loop virtual users each own their conversations and send messages one
+after another, so turns never collide with 409s. The backend is FakeClient,
+wrapped in the same rate limiter and metrics layers as in production, with
+configurable latency distribution, chunk cadence and injected errors. No
+network access or credentials are needed.
+
+Worker models:
+    threads   app.py in-process, one thread per virtual user (like gthread)
+    asgi      async_app.py in-process, one event loop for all users
+    gunicorn  app.py behind real gunicorn workers over HTTP, --workers x --threads,
+              conversations shared through a temporary SQLite store
+
+    python bench_load.py --worker-model threads --users 32 --requests 2000 --latency lognormal:1,0.5
+    python bench_load.py --worker-model gunicorn --workers 4 --threads 8 --stream --chunk-interval 0.05
+    python bench_load.py --memory 1000,5000,10000 --turns 4
+    python bench_load.py --memory 10000 --turn-store content,compact
+
+Reports throughput and p50/p95/p99 latency (time to first chunk too with
+--stream), or memory growth per conversation count with --memory, per turn
+store representation with --turn-store. Exits
+non-zero when --max-p99 or --min-throughput is violated, so CI can catch
+perf regressions.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types as pytypes
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+def fake_backend_options(args) -> Dict:
+    from fake_genai import parse_latency
+    return {
+        "latency": parse_latency(args.latency),
+        "chunk_count": args.chunks,
+        "chunk_interval": args.chunk_interval,
+        "error_rate": args.error_rate,
+        "error_codes": [int(code) for code in args.error_codes.split(",")],
+        "seed": args.seed,
+    }
+
+
+def install_fake_backend(args):
+    """
+    Swaps google_client for a module serving FakeClient, before the apps import it.
+    """
+    from config import rate_limiter_options
+    from fake_genai import FakeClient
+    from metrics import InstrumentedClient
+    from rate_limiter import RateLimitedClient, RateLimiter
+
+    fake_client_module = pytypes.ModuleType("google_client")
+    fake_client_module.client = InstrumentedClient(RateLimitedClient(
+        FakeClient(**fake_backend_options(args)), RateLimiter(**rate_limiter_options())))
+    fake_client_module.bigquery_client = None
+    sys.modules["google_client"] = fake_client_module
+    return fake_client_module.client
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Results:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.first_chunk: List[float] = []
+        self.statuses: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, status: int, latency: float, first_chunk: Optional[float] = None):
+        with self._lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append(latency)
+                if first_chunk is not None:
+                    self.first_chunk.append(first_chunk)
+
+    def report(self, name: str, elapsed: float) -> Dict:
+        latencies = sorted(self.latencies)
+        summary = {
+            "worker_model": name,
+            "requests": sum(self.statuses.values()),
+            "ok": len(latencies),
+            "statuses": dict(self.statuses),
+            "throughput": len(latencies) / elapsed if elapsed else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+        print(f"{name:>9}: {summary['requests']} requests in {elapsed:.2f}s -> "
+              f"{summary['throughput']:.1f} ok/s, p50 {summary['p50']:.3f}s, "
+              f"p95 {summary['p95']:.3f}s, p99 {summary['p99']:.3f}s, statuses {summary['statuses']}")
+        if self.first_chunk:
+            first_chunk = sorted(self.first_chunk)
+            summary["ttft_p50"] = percentile(first_chunk, 0.50)
+            summary["ttft_p99"] = percentile(first_chunk, 0.99)
+            print(f"{'':>11}time to first chunk p50 {summary['ttft_p50']:.3f}s, "
+                  f"p99 {summary['ttft_p99']:.3f}s")
+        return summary
+
+
+def split_requests(total: int, users: int) -> List[int]:
+    return [total // users + (1 if user < total % users else 0) for user in range(users)]
+
+
+def message_path(conversation_id: str, stream: bool) -> str:
+    suffix = "messages:stream" if stream else "messages"
+    return f"/conversations/{conversation_id}/{suffix}"
+
+
+# in-process worker models
+
+def run_threads(args) -> Dict:
+    install_fake_backend(args)
+    import app
+    test_client = app.app.test_client()
+    results = Results()
+
+    def user(count: int):
+        conversations = [test_client.post("/conversations").get_json()["conversation_id"]
+                         for _ in range(args.conversations_per_user)]
+        for i in range(count):
+            path = message_path(conversations[i % len(conversations)], args.stream)
+            started_at = time.perf_counter()
+            first_chunk = None
+            if args.stream:
+                response = test_client.post(path, json={"message": f"hello {i}"}, buffered=False)
+                for chunk in response.response:
+                    if first_chunk is None and chunk.startswith(b"data:"):
+                        first_chunk = time.perf_counter() - started_at
+                response.close()
+            else:
+                response = test_client.post(path, json={"message": f"hello {i}"})
+            results.record(response.status_code, time.perf_counter() - started_at, first_chunk)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        list(executor.map(user, split_requests(args.requests, args.users)))
+    return results.report("threads", time.perf_counter() - started_at)
+
+
+def run_asgi(args) -> Dict:
+    install_fake_backend(args)
+    import async_app
+    results = Results()
+
+    async def user(test_client, count: int):
+        conversations = []
+        for _ in range(args.conversations_per_user):
+            response = await test_client.post("/conversations")
+            conversations.append((await response.get_json())["conversation_id"])
+        for i in range(count):
+            path = message_path(conversations[i % len(conversations)], args.stream)
+            started_at = time.perf_counter()
+            first_chunk = None
+            response = await test_client.post(path, json={"message": f"hello {i}"})
+            if args.stream:
+                async for chunk in response.response:
+                    if first_chunk is None and chunk.startswith(b"data:"):
+                        first_chunk = time.perf_counter() - started_at
+            else:
+                await response.get_data()
+            results.record(response.status_code, time.perf_counter() - started_at, first_chunk)
+
+    async def main():
+        test_client = async_app.app.test_client()
+        await asyncio.gather(*(user(test_client, count)
+                               for count in split_requests(args.requests, args.users)))
+
+    started_at = time.perf_counter()
+    asyncio.run(main())
+    return results.report("asgi", time.perf_counter() - started_at)
+
+
+# gunicorn over HTTP
+
+def serve(args):
+    """Runs in the server subprocess: gunicorn with the fake backend in every worker."""
+    from gunicorn.app.base import BaseApplication
+
+    class BenchApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"127.0.0.1:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("worker_class", "gthread" if args.threads > 1 else "sync")
+            self.cfg.set("timeout", 300)
+            self.cfg.set("loglevel", "warning")
+
+        def load(self):
+            # each worker builds its own fake client and app
+            install_fake_backend(args)
+            import app
+            return app.app
+
+    BenchApplication().run()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"gunicorn did not start listening on port {port}.")
+
+
+def run_gunicorn(args) -> Dict:
+    import requests
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(os.environ, WARM_UP_CLIENTS="0",
+                   CONVERSATION_DB_PATH=os.path.join(work_dir, "conversations.db"))
+        server = subprocess.Popen(
+            [sys.executable, __file__] + sys.argv[1:] + ["--serve", "--port", str(port)], env=env)
+        try:
+            wait_for_port(port)
+            base_url = f"http://127.0.0.1:{port}"
+            results = Results()
+            sessions = threading.local()
+
+            def session() -> "requests.Session":
+                if not hasattr(sessions, "value"):
+                    sessions.value = requests.Session()
+                return sessions.value
+
+            def user(count: int):
+                conversations = [session().post(f"{base_url}/conversations", timeout=30).json()["conversation_id"]
+                                 for _ in range(args.conversations_per_user)]
+                for i in range(count):
+                    url = base_url + message_path(conversations[i % len(conversations)], args.stream)
+                    started_at = time.perf_counter()
+                    first_chunk = None
+                    with session().post(url, json={"message": f"hello {i}"},
+                                        stream=args.stream, timeout=300) as response:
+                        if args.stream:
+                            for line in response.iter_lines():
+                                if first_chunk is None and line.startswith(b"data:"):
+                                    first_chunk = time.perf_counter() - started_at
+                        else:
+                            response.content
+                    results.record(response.status_code, time.perf_counter() - started_at, first_chunk)
+
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.users) as executor:
+                list(executor.map(user, split_requests(args.requests, args.users)))
+            return results.report(
+                "gunicorn", time.perf_counter() - started_at)
+        finally:
+            server.terminate()
+            server.wait(30)
+
+
+# memory
+
+def run_memory(args, turn_store: str = "compact") -> List[Dict]:
+    """
+    Memory held by the conversation manager as conversations accumulate, measured
+    with tracemalloc. Every conversation gets --turns user/model exchanges.
+    """
+    from conversation import ConversationHistory, ConversationManager, SingletonBase
+    from fake_genai import FakeClient
+    from turn_store import TURN_STORES
+
+    checkpoints = sorted(int(count) for count in args.memory.split(","))
+    client = FakeClient()
+    ConversationHistory.turn_store_class = TURN_STORES[turn_store]
+    print(f"turn store: {turn_store}")
+    tracemalloc.start()
+    SingletonBase._instances.pop(ConversationManager, None)
+    manager = ConversationManager()
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    rows, previous_count, previous_bytes = [], 0, 0
+    for checkpoint in checkpoints:
+        for i in range(previous_count, checkpoint):
+            conversation_id = manager.create_conversation()
+            for turn in range(args.turns):
+                manager.send_message_to_conversation(
+                    conversation_id, "fake-model", client, f"message {turn} of conversation {i}")
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        history_bytes = manager.stats()["history_bytes"]
+        row = {
+            "turn_store": turn_store,
+            "conversations": checkpoint,
+            "bytes": used,
+            "bytes_per_conversation": used / checkpoint,
+            "bytes_per_turn": used / (checkpoint * args.turns * 2) if args.turns else 0.0,
+            "growth_per_conversation": (used - previous_bytes) / (checkpoint - previous_count),
+            "text_bytes": history_bytes,
+        }
+        print(f"{checkpoint:>8} conversations: {used / 2**20:8.1f} MiB, "
+              f"{row['bytes_per_conversation']:8.0f} B/conversation, {row['bytes_per_turn']:6.0f} B/turn, "
+              f"+{row['growth_per_conversation']:.0f} B/conversation since last, "
+              f"text {history_bytes / 2**20:.1f} MiB")
+        rows.append(row)
+        previous_count, previous_bytes = checkpoint, used
+    tracemalloc.stop()
+    return rows
+
+
+def compare_turn_stores(args) -> List[Dict]:
+    """
+    run_memory for every --turn-store, then bytes per turn side by side at
+    each checkpoint.
+    """
+    rows = []
+    for turn_store in args.turn_store.split(","):
+        rows.extend(run_memory(args, turn_store.strip()))
+    stores = list(dict.fromkeys(row["turn_store"] for row in rows))
+    if len(stores) > 1:
+        baseline = stores[0]
+        for checkpoint in sorted({row["conversations"] for row in rows}):
+            at = {row["turn_store"]: row for row in rows if row["conversations"] == checkpoint}
+            print(f"{checkpoint:>8} conversations: " + ", ".join(
+                f"{store} {at[store]['bytes_per_turn']:.0f} B/turn"
+                f" ({at[store]['bytes'] / at[baseline]['bytes']:.0%} of {baseline})"
+                for store in stores))
+    return rows
+
+
+WORKER_MODELS = {"threads": run_threads, "asgi": run_asgi, "gunicorn": run_gunicorn}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker-model", nargs="+", choices=list(WORKER_MODELS), default=["threads"])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=32, help="concurrent virtual users")
+    parser.add_argument("--conversations-per-user", type=int, default=1)
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per gunicorn worker")
+    # fake backend
+    parser.add_argument("--latency", default="lognormal:0.5,0.5",
+                        help='seconds per model call: "2", "uniform:0.5,3" or "lognormal:median,sigma"')
+    parser.add_argument("--chunks", type=int, default=8, help="chunks per streamed answer")
+    parser.add_argument("--chunk-interval", type=float, default=None,
+                        help="seconds between streamed chunks after the first one")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing model calls")
+    parser.add_argument("--error-codes", default="503", help="comma separated codes of injected errors")
+    parser.add_argument("--seed", type=int, default=0)
+    # memory
+    parser.add_argument("--memory", metavar="N,N,...",
+                        help="measure memory at these conversation counts instead of load")
+    parser.add_argument("--turns", type=int, default=4, help="exchanges per conversation for --memory")
+    parser.add_argument("--turn-store", default="compact",
+                        help="comma separated turn store representations to compare with --memory: compact, content")
+    # regression gates
+    parser.add_argument("--max-p99", type=float, help="fail if p99 latency exceeds this many seconds")
+    parser.add_argument("--min-throughput", type=float, help="fail if ok requests/s drop below this")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON as well")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    if args.memory:
+        rows = compare_turn_stores(args)
+        if args.json:
+            print(json.dumps(rows))
+        return
+
+    summaries = []
+    for worker_model in args.worker_model:
+        if len(args.worker_model) > 1 and worker_model != "gunicorn":
+            # the apps are imported per process, keep in-process runs apart
+            output = subprocess.run(
+                [sys.executable, __file__] + sys.argv[1:] + ["--json", "--worker-model", worker_model],
+                check=True, capture_output=True, text=True).stdout
+            print("\n".join(output.rstrip().splitlines()[:-1]))
+            summaries.append(json.loads(output.strip().splitlines()[-1]))
+        else:
+            summaries.append(WORKER_MODELS[worker_model](args))
+    if args.json:
+        print(json.dumps(summaries if len(summaries) > 1 else summaries[0]))
+
+    failed = []
+    for summary in summaries:
+        if args.max_p99 is not None and summary["p99"] > args.max_p99:
+            failed.append(f"{summary['worker_model']}: p99 {summary['p99']:.3f}s > {args.max_p99}s")
+        if args.min_throughput is not None and summary["throughput"] < args.min_throughput:
+            failed.append(f"{summary['worker_model']}: {summary['throughput']:.1f} ok/s < {args.min_throughput}")
+    if failed:
+        print("performance regression: " + "; ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
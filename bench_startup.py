@@ -0,0 +1,164 @@
+"""
+Cold-start benchmark with an import-time budget.
+
+Starts a fresh interpreter per sample and measures, for each app, how long
+importing it takes and how long until its first request is answered. The
+Google clients are replaced by fakes, so the numbers cover our own imports and
+setup, not authentication or the network. The slowest imports come from
+`python -X importtime`.
+
+Exits non-zero when the median time to the first answered request of any app
+exceeds its budget, so CI can catch an eager import that sneaks back in.
+
+    python bench_startup.py --samples 5 --top 10
+    python bench_startup.py --budget app=900 --budget bigquery_app=600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# milliseconds until the first answered request, with a margin over what a
+# warm disk cache gives on a laptop
+DEFAULT_BUDGETS = {"app": 1000, "async_app": 1200, "bigquery_app": 600}
+
+
+class FakeBigQueryClient:
+
+    def query(self, query):
+        return []
+
+
+def install_fake_clients(genai: bool = True):
+    import types as pytypes
+
+    fake_client_module = pytypes.ModuleType("google_client")
+    fake_client_module.client = None
+    if genai:
+        # fake_genai imports google.genai, which the chat apps pay for anyway
+        from fake_genai import FakeClient
+        fake_client_module.client = FakeClient()
+    fake_client_module.bigquery_client = FakeBigQueryClient()
+    sys.modules["google_client"] = fake_client_module
+
+
+def first_request(module):
+    if module.__name__ == "bigquery_app":
+        response = module.app.test_client().get("/documents")
+        assert response.status_code == 200, response.get_data()
+        return
+    if module.__name__ == "async_app":
+        import asyncio
+
+        async def send():
+            test_client = module.app.test_client()
+            response = await test_client.post("/conversations")
+            conversation_id = (await response.get_json())["conversation_id"]
+            response = await test_client.post(
+                f"/conversations/{conversation_id}/messages", json={"message": "hello"})
+            assert response.status_code == 200, await response.get_data()
+
+        asyncio.run(send())
+        return
+    test_client = module.app.test_client()
+    conversation_id = test_client.post("/conversations").get_json()["conversation_id"]
+    response = test_client.post(
+        f"/conversations/{conversation_id}/messages", json={"message": "hello"})
+    assert response.status_code == 200, response.get_data()
+
+
+def child(app_name: str):
+    """Runs in the fresh interpreter, prints one JSON sample."""
+    started_at = time.perf_counter()
+    install_fake_clients(genai=app_name != "bigquery_app")
+    import importlib
+    module = importlib.import_module(app_name)
+    imported_at = time.perf_counter()
+    first_request(module)
+    ready_at = time.perf_counter()
+    print(json.dumps({
+        "import_ms": (imported_at - started_at) * 1000,
+        "first_request_ms": (ready_at - started_at) * 1000,
+    }))
+
+
+def sample(app_name: str) -> dict:
+    env = dict(os.environ, WARM_UP_CLIENTS="0")
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", app_name],
+        check=True, capture_output=True, text=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(app_name: str, top: int):
+    """Cumulative import time of each module the app imports directly, slowest first."""
+    code = (f"import bench_startup; "
+            f"bench_startup.install_fake_clients(genai={app_name != 'bigquery_app'}); import {app_name}")
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        check=True, capture_output=True, text=True).stderr
+    # children are printed before their parent and indented two spaces per level
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, total, name = line.split("|")
+        if not total.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(total)))
+        elif depth == 0:
+            if name.strip() == app_name:
+                return sorted(children, key=lambda item: item[1], reverse=True)[:top]
+            children = []
+    return []
+
+
+def parse_budgets(values) -> dict:
+    budgets = dict(DEFAULT_BUDGETS)
+    for value in values or []:
+        name, _, ms = value.partition("=")
+        budgets[name] = float(ms)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apps", nargs="+", default=list(DEFAULT_BUDGETS))
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list per app")
+    parser.add_argument("--budget", action="append", metavar="APP=MS",
+                        help="time to the first answered request allowed for APP")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    budgets = parse_budgets(args.budget)
+    over_budget = []
+    for app_name in args.apps:
+        samples = [sample(app_name) for _ in range(args.samples)]
+        import_ms = statistics.median(s["import_ms"] for s in samples)
+        ready_ms = statistics.median(s["first_request_ms"] for s in samples)
+        budget = budgets.get(app_name)
+        verdict = "" if budget is None else ("ok" if ready_ms <= budget else "OVER BUDGET")
+        print(f"{app_name:>12}: import {import_ms:7.1f} ms, first request {ready_ms:7.1f} ms "
+              f"(budget {budget} ms) {verdict}")
+        for name, micros in slowest_imports(app_name, args.top):
+            print(f"{'':>14}{micros / 1000:7.1f} ms  {name}")
+        if verdict == "OVER BUDGET":
+            over_budget.append(app_name)
+
+    if over_budget:
+        print(f"startup budget exceeded: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,20 @@
-from typing import Any, Dict
+from typing import Any, Dict, List, Set
+import concurrent.futures
 import uuid
-from flask import Flask, abort, request, jsonify
+from flask import Flask, Response, abort, request, jsonify
 import os
 from google.cloud import bigquery
 from google.api_core.exceptions import NotFound
 
 from google_client import bigquery_client as client
+from config import document_writer_options
+from document_writer import DocumentWriter
+import metrics
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-print(f"--- SCRIPT TOP LEVEL ---")
-print(f"WERKZEUG_RUN_MAIN: {os.environ.get('WERKZEUG_RUN_MAIN')}")
-print(f"FLASK_DEBUG env: {os.environ.get('FLASK_DEBUG')}")
-print(f"FLASK_ENV env: {os.environ.get('FLASK_ENV')}")
-
 
 GOOGLE_PROJECT_NAME = os.environ.get("GOOGLE_PROJECT_NAME")
 BIGQUERY_DATASET_ID = os.environ.get("BIGQUERY_DATASET_ID")
@@ -23,7 +22,26 @@ BIGQUERY_TABLE_NAME = os.environ.get("BIGQUERY_TABLE_NAME")
 
 TABLE_ID = f"{GOOGLE_PROJECT_NAME}.{BIGQUERY_DATASET_ID}.{BIGQUERY_TABLE_NAME}"
 
+REQUIRED_FIELDS = ['title', 'type', 'text']
+FIELDS_ORDER = ['idx', 'title', 'type', 'publish_time', 'author', 'url', 'text']
+# 单个批量请求最多的文档数
+MAX_BATCH_DOCUMENTS = int(os.environ.get("MAX_BATCH_DOCUMENTS", "10000"))
+# 批量请求等待写入结果的秒数，超时的行返回 504
+DOCUMENT_BATCH_TIMEOUT = float(os.environ.get("DOCUMENT_BATCH_TIMEOUT", "60"))
+
 app = Flask(__name__)
+metrics.instrument_flask(app)
+
+# 批量写入：攒够行数或等够时间后用一个 load job / streaming insert 写入
+document_writer = DocumentWriter(client, TABLE_ID, **document_writer_options())
+metrics.registry.gauge(
+    "documents_buffered", "Documents waiting in the batch writer.").set_function(
+    lambda: document_writer.stats()["buffered"])
+
+# authenticate and open the first BigQuery connection before taking traffic
+if os.environ.get("WARM_UP_CLIENTS", "").lower() in ("1", "true"):
+    from google_client import warm_up
+    warm_up(genai=False, bigquery=True)
 
 
 @app.route('/documents', methods=['POST'])
@@ -38,6 +56,9 @@ def create_document():
     # 如果caller提供了idx就直接使用
     if 'idx' in data and data.get('idx'):
         user_provided_idx = data['idx']
+        # 还在批量写入缓冲区中的文档查不到
+        if user_provided_idx in document_writer:
+            return jsonify({"error": f"文档 idx '{user_provided_idx}' 已存在"}), 409
         check_query = f"SELECT COUNT(1) FROM `{TABLE_ID}` WHERE idx = @idx"
         job_config = bigquery.QueryJobConfig(
             query_parameters=[bigquery.ScalarQueryParameter(
@@ -54,24 +75,22 @@ def create_document():
         data['idx'] = str(uuid.uuid4())
 
     # TODO: 检查其他必需字段，后面调整为实际项目中需要的字段
-    required_fields = ['title', 'type', 'text']
-    if not all(field in data for field in required_fields):
+    if not all(field in data for field in REQUIRED_FIELDS):
         missing_fields = [
-            field for field in required_fields if field not in data]
+            field for field in REQUIRED_FIELDS if field not in data]
         return jsonify({"error": f"缺少必需字段: {', '.join(missing_fields)}"}), 400
 
     # 确保所有字段都存在，对于可选字段，如果不存在则设为 NULL
-    fields_order = ['idx', 'title', 'type',
-                    'publish_time', 'author', 'url', 'text']
-    values_tuple = tuple(data.get(field) for field in fields_order)
-
+    # 值作为查询参数传入，不拼接进 SQL
     query = f"""
         INSERT INTO `{TABLE_ID}` (idx, title, type, publish_time, author, url, text)
-        VALUES {values_tuple}
+        VALUES (@idx, @title, @type, @publish_time, @author, @url, @text)
     """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter(field, "STRING", data.get(field)) for field in FIELDS_ORDER])
 
     try:
-        query_job = client.query(query)
+        query_job = client.query(query, job_config=job_config)
         query_job.result()  # 等待作业完成
 
         if query_job.errors:
@@ -86,6 +105,107 @@ def create_document():
         return jsonify({"error": f"插入数据到 BigQuery 失败: {e}"}), 500
 
 
+def existing_ids(ids: List[str]) -> Set[str]:
+    """
+    The ids that are already in the table, with one parameterized query.
+    """
+    if not ids:
+        return set()
+    query = f"SELECT idx FROM `{TABLE_ID}` WHERE idx IN UNNEST(@ids)"
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("ids", "STRING", ids)]
+    )
+    return {row["idx"] for row in client.query(query, job_config=job_config).result()}
+
+
+@app.route('/documents:batch', methods=['POST'])
+def create_documents_batch():
+    """
+    Creates many documents at once through the buffered DocumentWriter.
+    JSON Body:
+        {"documents": [{"idx": (optional), "title", "type", "text", ...}, ...]}
+    Returns:
+        JSON: {"results": [{"index": 0, "idx": "...", "status": 201},
+                           {"index": 1, "status": 400|409|500|504, "error": "..."}],
+               "succeeded": n, "failed": m}
+              or 400 for a malformed body, 503 if the writer is backed up.
+    Existing ids are looked up with one query for the whole batch instead of a
+    COUNT job per document.
+    """
+    if not client:
+        return jsonify({"error": "BigQuery client 未初始化"}), 500
+
+    data = request.get_json(silent=True)
+    documents = data.get("documents") if isinstance(data, dict) else None
+    if not isinstance(documents, list) or not documents:
+        return jsonify({"error": "请求体中缺少 'documents' 列表"}), 400
+    if len(documents) > MAX_BATCH_DOCUMENTS:
+        return jsonify({"error": f"每个请求最多 {MAX_BATCH_DOCUMENTS} 个文档"}), 400
+
+    results: List[Dict[str, Any]] = [None] * len(documents)
+    rows, positions, provided, seen = [], [], [], set()
+    for index, document in enumerate(documents):
+        if not isinstance(document, dict):
+            results[index] = {"index": index, "status": 400, "error": "文档必须是 JSON 对象"}
+            continue
+        missing_fields = [field for field in REQUIRED_FIELDS if field not in document]
+        if missing_fields:
+            results[index] = {"index": index, "status": 400,
+                              "error": f"缺少必需字段: {', '.join(missing_fields)}"}
+            continue
+        # 无效行会让整个 load job 失败，写入器要拆分重试，提前拒绝省下这些 load job
+        invalid_fields = [field for field in FIELDS_ORDER
+                          if document.get(field) is not None and not isinstance(document[field], str)]
+        if invalid_fields:
+            results[index] = {"index": index, "status": 400,
+                              "error": f"字段必须是字符串: {', '.join(invalid_fields)}"}
+            continue
+        idx = document.get('idx')
+        if idx:
+            provided.append(idx)
+        else:
+            idx = str(uuid.uuid4())
+        if idx in seen:
+            results[index] = {"index": index, "idx": idx, "status": 409, "error": f"文档 idx '{idx}' 在请求中重复"}
+            continue
+        seen.add(idx)
+        rows.append(dict(document, idx=idx))
+        positions.append(index)
+
+    try:
+        existing = existing_ids(provided)
+    except Exception as e:
+        return jsonify({"error": f"检查 idx 时出错: {e}"}), 500
+    if existing:
+        kept = [(row, index) for row, index in zip(rows, positions) if row["idx"] not in existing]
+        for row, index in zip(rows, positions):
+            if row["idx"] in existing:
+                results[index] = {"index": index, "idx": row["idx"], "status": 409,
+                                  "error": f"文档 idx '{row['idx']}' 已存在"}
+        rows, positions = [row for row, _ in kept], [index for _, index in kept]
+
+    try:
+        futures = document_writer.submit(rows) if rows else []
+    except BufferError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    concurrent.futures.wait(futures, timeout=DOCUMENT_BATCH_TIMEOUT)
+    for row, index, future in zip(rows, positions, futures):
+        if not future.done():
+            # 仍在缓冲区中，稍后会写入
+            results[index] = {"index": index, "idx": row["idx"], "status": 504, "error": "写入尚未完成"}
+        elif future.result().ok:
+            results[index] = {"index": index, "idx": row["idx"], "status": 201}
+        elif future.result().conflict:
+            results[index] = {"index": index, "idx": row["idx"], "status": 409,
+                              "error": f"文档 idx '{row['idx']}' 已存在"}
+        else:
+            results[index] = {"index": index, "idx": row["idx"], "status": 500,
+                              "error": f"插入数据到 BigQuery 失败: {future.result().error}"}
+
+    succeeded = sum(result["status"] == 201 for result in results)
+    return jsonify({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}), 200
+
+
 @app.route('/documents', methods=['GET'])
 def get_all_documents():
     if not client:
@@ -194,6 +314,16 @@ def delete_document(idx):
         return jsonify({"error": f"删除失败: {e}"}), 500
 
 
+@app.route('/stats', methods=['GET'])
+def stats_api():
+    return jsonify({"document_writer": document_writer.stats()})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    return Response(metrics.registry.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.errorhandler(400)
 def bad_request(error):
     return jsonify(error=str(error.description)), 400
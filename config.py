@@ -1,70 +1,147 @@
+"""
+Generation configs and environment-driven settings.
+
+The genai SDK and the pydantic config objects are heavy to import and build,
+and bigquery_app needs neither. The static configs below are therefore built
+on first access through the module __getattr__, `from config import
+GOOGLE_SEARCH_CONFIG` keeps working and only then pays for google.genai.
+"""
 import json
-from google.genai import types
-
-
-COMMON_SAFETY_SETTINGS = [
-    types.SafetySetting(
-        category="HARM_CATEGORY_HATE_SPEECH",
-        threshold="OFF"
-    ),
-    types.SafetySetting(
-        category="HARM_CATEGORY_DANGEROUS_CONTENT",
-        threshold="OFF"
-    ),
-    types.SafetySetting(
-        category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-        threshold="OFF"
-    ),
-    types.SafetySetting(
-        category="HARM_CATEGORY_HARASSMENT",
-        threshold="OFF"
-    )
-]
-
-RAG_ASSISTANT_CONFIG = types.GenerateContentConfig(
-    temperature=1,
-    top_p=0.95,
-    seed=0,
-    max_output_tokens=8192,
-    response_modalities=["TEXT"],
-    safety_settings=COMMON_SAFETY_SETTINGS,
-    tools=[
-        types.Tool(
-            retrieval=types.Retrieval(
-                vertex_ai_search=types.VertexAISearch(
-                    datastore="projects/gemini-with-rag/locations/global/collections/default_collection/dataStores/test-data-stores_1746354976431_init-database")
-            )
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+
+def _frozen_config_class():
+    import pydantic
+    from google.genai import types
+
+    class FrozenGenerateContentConfig(types.GenerateContentConfig):
+        """
+        GenerateContentConfig that rejects attribute assignment, for configs shared
+        by many requests. Derive per-request variants with model_copy(update=...).
+        """
+        model_config = pydantic.ConfigDict(frozen=True)
+
+    FrozenGenerateContentConfig.__module__ = __name__
+    FrozenGenerateContentConfig.__qualname__ = "FrozenGenerateContentConfig"
+    return FrozenGenerateContentConfig
+
+
+def _common_safety_settings():
+    from google.genai import types
+
+    from config_registry import deep_freeze
+
+    # shared by every config, nobody may change it
+    return deep_freeze([
+        types.SafetySetting(
+            category="HARM_CATEGORY_HATE_SPEECH",
+            threshold="OFF"
         ),
-    ],
-    thinking_config=types.ThinkingConfig(
-        thinking_budget=1024,
-    ),
-    system_instruction=[types.Part.from_text(
-        text=f"""你是一个新闻总结助手，语气要像一个萝莉一样可爱可亲，时不时的会发emoji来辅助表达感情。""")],
-)
-
-GOOGLE_SEARCH_CONFIG = types.GenerateContentConfig(
-    temperature=1,
-    top_p=0.95,
-    seed=0,
-    max_output_tokens=8192,
-    response_modalities=["TEXT"],
-    safety_settings=COMMON_SAFETY_SETTINGS,
-    tools=[
-        types.Tool(google_search=types.GoogleSearch()),
-    ],
-    thinking_config=types.ThinkingConfig(
-        thinking_budget=1024,
-    ),
-    system_instruction=[types.Part.from_text(
-        text=f"""你是一个新闻总结助手，语气要像一个萝莉一样可爱可亲，时不时的会发emoji来辅助表达感情。""")],
-)
-
-
-def create_config_from_json_data(data: dict) -> types.GenerateContentConfig:
+        types.SafetySetting(
+            category="HARM_CATEGORY_DANGEROUS_CONTENT",
+            threshold="OFF"
+        ),
+        types.SafetySetting(
+            category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
+            threshold="OFF"
+        ),
+        types.SafetySetting(
+            category="HARM_CATEGORY_HARASSMENT",
+            threshold="OFF"
+        )
+    ])
+
+
+def _rag_assistant_config():
+    from google.genai import types
+
+    from config_registry import freeze
+
+    return freeze(types.GenerateContentConfig(
+        temperature=1,
+        top_p=0.95,
+        seed=0,
+        max_output_tokens=8192,
+        response_modalities=["TEXT"],
+        safety_settings=_lazy("COMMON_SAFETY_SETTINGS"),
+        tools=[
+            types.Tool(
+                retrieval=types.Retrieval(
+                    vertex_ai_search=types.VertexAISearch(
+                        datastore="projects/gemini-with-rag/locations/global/collections/default_collection/dataStores/test-data-stores_1746354976431_init-database")
+                )
+            ),
+        ],
+        thinking_config=types.ThinkingConfig(
+            thinking_budget=1024,
+        ),
+        system_instruction=[types.Part.from_text(
+            text=f"""你是一个新闻总结助手，语气要像一个萝莉一样可爱可亲，时不时的会发emoji来辅助表达感情。""")],
+    ))
+
+
+def _google_search_config():
+    from google.genai import types
+
+    from config_registry import freeze
+
+    return freeze(types.GenerateContentConfig(
+        temperature=1,
+        top_p=0.95,
+        seed=0,
+        max_output_tokens=8192,
+        response_modalities=["TEXT"],
+        safety_settings=_lazy("COMMON_SAFETY_SETTINGS"),
+        tools=[
+            types.Tool(google_search=types.GoogleSearch()),
+        ],
+        thinking_config=types.ThinkingConfig(
+            thinking_budget=1024,
+        ),
+        system_instruction=[types.Part.from_text(
+            text=f"""你是一个新闻总结助手，语气要像一个萝莉一样可爱可亲，时不时的会发emoji来辅助表达感情。""")],
+    ))
+
+
+_LAZY_ATTRIBUTES: Dict[str, Callable[[], Any]] = {
+    "FrozenGenerateContentConfig": _frozen_config_class,
+    "COMMON_SAFETY_SETTINGS": _common_safety_settings,
+    "RAG_ASSISTANT_CONFIG": _rag_assistant_config,
+    "GOOGLE_SEARCH_CONFIG": _google_search_config,
+}
+# reentrant, building a config needs FrozenGenerateContentConfig first
+_lazy_lock = threading.RLock()
+
+
+def _lazy(name: str) -> Any:
+    value = globals().get(name)
+    if value is None:
+        with _lazy_lock:
+            value = globals().get(name)
+            if value is None:
+                value = _LAZY_ATTRIBUTES[name]()
+                # later lookups find the global and never reach __getattr__ again
+                globals()[name] = value
+    return value
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_ATTRIBUTES:
+        return _lazy(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def create_config_from_json_data(data: dict) -> "types.GenerateContentConfig":
     """
     Generates a types.GenerateContentConfig object from a dictionary (parsed JSON).
     """
+    from google.genai import types
+
     config_args = {}
 
     if "temperature" in data:
@@ -126,11 +203,236 @@ def create_config_from_json_data(data: dict) -> types.GenerateContentConfig:
         if parsed_parts:
             config_args["system_instruction"] = parsed_parts
 
-    config_args["safety_settings"] = COMMON_SAFETY_SETTINGS
+    config_args["safety_settings"] = _lazy("COMMON_SAFETY_SETTINGS")
     return types.GenerateContentConfig(**config_args)
 
 
-def create_config_from_json_string(json_string: str) -> types.GenerateContentConfig:
+def conversation_manager_options(client=None) -> Dict[str, Any]:
+    """
+    Reads the ConversationManager settings shared by app.py and async_app.py
+    from the environment. Call it after load_dotenv().
+    """
+    from context_cache import ContextCacheManager
+    from context_policy import ModelSummarizer, SlidingWindowPolicy
+    from response_cache import ResponseCache
+    from single_flight import SingleFlight
+    from thinking_policy import THINKING_POLICIES
+    from conversation_store import SQLiteConversationStore
+
+    # seconds a message waits for the previous turn of the same conversation,
+    # 0 answers 409 right away, a negative value queues without limit
+    busy_timeout = float(os.environ.get("CONVERSATION_BUSY_TIMEOUT", "0"))
+    # SQLite file shared by all workers on this host, unset keeps conversations in-process
+    db_path = os.environ.get("CONVERSATION_DB_PATH")
+
+    # token budget per request, 0 sends the full history
+    context_max_tokens = int(os.environ.get("CONTEXT_MAX_TOKENS", "0"))
+    context_policy = None
+    if context_max_tokens > 0:
+        summary_model = os.environ.get("CONTEXT_SUMMARY_MODEL")
+        context_policy = SlidingWindowPolicy(
+            max_tokens=context_max_tokens,
+            pin_turns=int(os.environ.get("CONTEXT_PIN_TURNS", "0")),
+            summarizer=ModelSummarizer(
+                client, summary_model) if summary_model and client else None,
+        )
+
+    # lifetime of explicit context cache entries in seconds, 0 disables context caching
+    context_cache_ttl = float(os.environ.get("CONTEXT_CACHE_TTL", "0"))
+    context_cache = None
+    if context_cache_ttl > 0 and client is not None:
+        context_cache = ContextCacheManager(
+            client,
+            ttl=context_cache_ttl,
+            min_tokens=int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "1024")),
+            prefix_step=int(os.environ.get("CONTEXT_CACHE_PREFIX_STEP", "8")),
+        )
+
+    # number of cached responses for deterministic (seeded) requests, 0 disables the cache
+    response_cache_size = int(os.environ.get("RESPONSE_CACHE_SIZE", "0"))
+    response_cache = None
+    if response_cache_size > 0:
+        response_cache = ResponseCache(
+            max_entries=response_cache_size,
+            ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "600")),
+            search_ttl=float(os.environ.get(
+                "RESPONSE_CACHE_SEARCH_TTL", "60")),
+        )
+
+    # "adaptive" picks the thinking budget per request, "fixed" only reports, unset disables both
+    thinking_policy_name = os.environ.get("THINKING_POLICY", "").strip().lower()
+    thinking_policy = None
+    if thinking_policy_name == "adaptive":
+        thinking_policy = THINKING_POLICIES["adaptive"](
+            # share of requests kept on the configured budget as baseline
+            explore_rate=float(os.environ.get("THINKING_EXPLORE_RATE", "0.05")),
+            # floor for every model, per model floors (pro: 128) apply regardless
+            min_budget=int(os.environ.get("THINKING_MIN_BUDGET", "0")),
+        )
+    elif thinking_policy_name:
+        thinking_policy = THINKING_POLICIES[thinking_policy_name]()
+
+    return {
+        "num_shards": int(os.environ.get("CONVERSATION_SHARDS", "16")),
+        "busy_timeout": None if busy_timeout < 0 else busy_timeout,
+        # memory bounds for the conversation store, 0 disables the respective limit;
+        # both are split evenly over CONVERSATION_SHARDS and enforced per shard
+        "max_conversations": int(os.environ.get("MAX_CONVERSATIONS", "0")),
+        "max_history_bytes": int(os.environ.get("MAX_HISTORY_BYTES", "0")),
+        "idle_ttl": float(os.environ.get("CONVERSATION_IDLE_TTL", "0")),
+        "store": SQLiteConversationStore(db_path) if db_path else None,
+        "context_policy": context_policy,
+        "context_cache": context_cache,
+        "response_cache": response_cache,
+        "thinking_policy": thinking_policy,
+        # identical seeded requests in flight at the same time share one model call
+        "single_flight": SingleFlight() if os.environ.get("SINGLE_FLIGHT", "1") != "0" else None,
+        # in-process retrieval for Vertex AI Search requests, see build_retriever
+        "retriever": build_retriever(client),
+        # threads behind the bulk message endpoint
+        "fanout_workers": int(os.environ.get("FANOUT_WORKERS", "8")),
+    }
+
+
+def build_retriever(client=None):
+    """
+    The LocalRetriever over the bigquery_app documents table, None unless
+    LOCAL_RETRIEVAL names an embedder ("hashing" or "genai"). Not synced yet,
+    the app starts its background sync.
+    """
+    embedder_name = os.environ.get("LOCAL_RETRIEVAL", "").strip().lower()
+    if not embedder_name:
+        return None
+    # numpy and the index are only imported when retrieval is on
+    from google_client import bigquery_client
+    from retrieval import BigQueryDocumentSource, GenaiEmbedder, HashingEmbedder, LocalRetriever
+    from vector_index import INDEXES
+
+    if embedder_name == "genai":
+        embedder = GenaiEmbedder(
+            client,
+            model=os.environ.get("RETRIEVAL_EMBEDDING_MODEL", "text-multilingual-embedding-002"),
+            dim=int(os.environ.get("RETRIEVAL_EMBEDDING_DIM", "768")),
+        )
+    elif embedder_name == "hashing":
+        embedder = HashingEmbedder(dim=int(os.environ.get("RETRIEVAL_EMBEDDING_DIM", "256")))
+    else:
+        raise ValueError(f"Unknown LOCAL_RETRIEVAL '{embedder_name}', expected 'hashing' or 'genai'.")
+    table_id = "{}.{}.{}".format(os.environ.get("GOOGLE_PROJECT_NAME"), os.environ.get(
+        "BIGQUERY_DATASET_ID"), os.environ.get("BIGQUERY_TABLE_NAME"))
+    return LocalRetriever(
+        BigQueryDocumentSource(bigquery_client, table_id),
+        embedder,
+        # "flat" scores every chunk, "ivf" only the nearest clusters
+        index=INDEXES[os.environ.get("RETRIEVAL_INDEX", "flat")](embedder.dim),
+        top_k=int(os.environ.get("RETRIEVAL_TOP_K", "4")),
+        min_score=float(os.environ.get("RETRIEVAL_MIN_SCORE", "0")),
+        chunk_chars=int(os.environ.get("RETRIEVAL_CHUNK_CHARS", "800")),
+        sync_interval=float(os.environ.get("RETRIEVAL_SYNC_INTERVAL", "300")),
+    )
+
+
+def rate_limiter_options() -> Dict[str, Any]:
+    """
+    Reads the client-side RateLimiter settings for google_client from the environment.
+    """
+    return {
+        # Vertex AI quota of the project, 0 leaves the respective bucket out
+        "rpm": float(os.environ.get("GENAI_RPM_LIMIT", "0")),
+        "tpm": float(os.environ.get("GENAI_TPM_LIMIT", "0")),
+        # bounds of the adaptive concurrency limit
+        "max_concurrency": int(os.environ.get("GENAI_MAX_CONCURRENCY", "64")),
+        "min_concurrency": int(os.environ.get("GENAI_MIN_CONCURRENCY", "1")),
+        "max_retries": int(os.environ.get("GENAI_MAX_RETRIES", "3")),
+        # seconds a request may queue for quota before it is answered with 429
+        "max_wait": float(os.environ.get("GENAI_MAX_QUEUE_WAIT", "60")),
+    }
+
+
+def model_router_options() -> Dict[str, Any]:
+    """
+    Reads the ModelRouter settings (see model_router.py) from the environment.
+    """
+    return {
+        # "model[@region][:slo_seconds],..." in order of preference, empty disables routing
+        "routes": os.environ.get("MODEL_ROUTES", ""),
+        # model_name that asks for routing, also the default once routes are configured
+        "alias": os.environ.get("MODEL_ROUTER_ALIAS", "auto"),
+        "max_error_rate": float(os.environ.get("MODEL_ROUTER_MAX_ERROR_RATE", "0.2")),
+        # consecutive failures that take a route out of rotation, and for how many seconds
+        "failure_threshold": int(os.environ.get("MODEL_ROUTER_FAILURE_THRESHOLD", "3")),
+        "cooldown": float(os.environ.get("MODEL_ROUTER_COOLDOWN", "30")),
+        "probe_interval": float(os.environ.get("MODEL_ROUTER_PROBE_INTERVAL", "30")),
+    }
+
+
+def deadline_options() -> Dict[str, float]:
+    """
+    Reads the default request deadlines per route (see deadline.py) from the
+    environment, in seconds. 0 leaves the route without a default; clients can
+    still send X-Request-Timeout, capped at "max" if that is set.
+    """
+    return {
+        # blocking sends, the default matches what clients typically wait
+        "messages": float(os.environ.get("DEADLINE_MESSAGES", "30")),
+        # streams notice disconnects by themselves, only bound them on request
+        "stream": float(os.environ.get("DEADLINE_STREAM", "0")),
+        "bulk": float(os.environ.get("DEADLINE_BULK", "0")),
+        # background jobs (see jobs.py), counted from when a worker picks the job up
+        "jobs": float(os.environ.get("DEADLINE_JOBS", "600")),
+        "max": float(os.environ.get("DEADLINE_MAX", "0")),
+    }
+
+
+def job_queue_options() -> Dict[str, Any]:
+    """
+    Reads the JobQueue settings for asynchronous messages from the environment.
+    """
+    prefixes = os.environ.get("JOB_WEBHOOK_PREFIXES", "")
+    return {
+        "workers": int(os.environ.get("JOB_WORKERS", "4")),
+        # beyond this many waiting jobs submissions answer 503
+        "max_queued": int(os.environ.get("JOB_MAX_QUEUED", "1000")),
+        # seconds a finished job can still be polled
+        "retention": float(os.environ.get("JOB_RETENTION", "3600")),
+        "max_retained": int(os.environ.get("JOB_MAX_RETAINED", "10000")),
+        # comma separated URL prefixes webhooks may call, unset disables webhooks
+        "webhook_prefixes": tuple(prefix.strip() for prefix in prefixes.split(",") if prefix.strip()),
+        "webhook_timeout": float(os.environ.get("JOB_WEBHOOK_TIMEOUT", "5")),
+    }
+
+
+def document_writer_options() -> Dict[str, Any]:
+    """
+    Reads the DocumentWriter settings of bigquery_app from the environment.
+    """
+    # "load" (free, all-or-nothing, 1,500 jobs per table and day) or "stream" (insertAll)
+    mode = os.environ.get("DOCUMENT_WRITE_MODE", "load")
+    return {
+        "mode": mode,
+        "max_rows": int(os.environ.get("DOCUMENT_BATCH_MAX_ROWS", "10000")),
+        # load jobs are rationed, streaming inserts can go out almost right away
+        "max_delay": float(os.environ.get("DOCUMENT_BATCH_MAX_DELAY", "5" if mode == "load" else "0.5")),
+        "max_buffered": int(os.environ.get("DOCUMENT_MAX_BUFFERED", "100000")),
+    }
+
+
+def http_pool_options() -> Dict[str, Any]:
+    """
+    Reads the connection pool settings of the Google clients from the environment.
+    """
+    return {
+        # connections per process, shared by all requests of a worker
+        "pool_size": int(os.environ.get("GOOGLE_HTTP_POOL_SIZE", "100")),
+        "keepalive_connections": int(os.environ.get("GOOGLE_HTTP_KEEPALIVE", "20")),
+        # seconds an idle keep-alive connection stays open
+        "keepalive_expiry": float(os.environ.get("GOOGLE_HTTP_KEEPALIVE_EXPIRY", "60")),
+        # per-request timeout of genai calls in seconds, 0 for none
+        "timeout": float(os.environ.get("GOOGLE_HTTP_TIMEOUT", "0")),
+    }
+
+
+def create_config_from_json_string(json_string: str) -> "types.GenerateContentConfig":
     """
     Parses a JSON string and then generates a types.GenerateContentConfig object.
     """
@@ -0,0 +1,192 @@
+"""
+Shared, immutable GenerateContentConfig objects for request overrides.
+
+Clients tend to send one of a handful of identical `generation_config` blobs,
+yet create_config_from_json_data rebuilds the whole pydantic tree (config,
+tools, safety settings, parts) on every request. ConfigRegistry canonicalizes
+the blob, compiles it once and hands out the same frozen config from a bounded
+LRU. Named presets let clients skip the blob altogether and send an id.
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Union
+
+import pydantic
+from google.genai import types
+
+import config
+
+# preset id -> attribute of config.py, resolved on first use so that importing
+# this module does not build the configs
+DEFAULT_PRESETS = {
+    "google_search": "GOOGLE_SEARCH_CONFIG",
+    "rag_assistant": "RAG_ASSISTANT_CONFIG",
+}
+
+
+def canonical_json(data: Dict[str, Any]) -> str:
+    """
+    Key order and whitespace do not change the config, so they do not change the key either.
+    """
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+class FrozenList(list):
+    """
+    List that rejects changes, for the list fields of a frozen config. Copies
+    are plain lists again.
+    """
+    def _frozen(self, *args, **kwargs):
+        raise TypeError("FrozenList does not support item assignment, copy it first.")
+
+    append = extend = insert = pop = remove = clear = sort = reverse = _frozen
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _frozen
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+# model class -> its frozen subclass
+_frozen_classes: Dict[type, type] = {}
+_frozen_types: Set[type] = set()
+_frozen_classes_lock = threading.Lock()
+
+
+def _frozen_class(model_class: type) -> type:
+    if model_class in _frozen_types:
+        return model_class
+    frozen_class = _frozen_classes.get(model_class)
+    if frozen_class is None:
+        with _frozen_classes_lock:
+            frozen_class = _frozen_classes.get(model_class)
+            if frozen_class is None:
+                name = f"Frozen{model_class.__name__}"
+                frozen_class = type(name, (model_class,), {
+                    "model_config": pydantic.ConfigDict(**{**model_class.model_config, "frozen": True}),
+                    "__module__": __name__,
+                    "__qualname__": name,
+                })
+                # module level, so that pickle finds the class
+                globals()[name] = _frozen_classes[model_class] = frozen_class
+                _frozen_types.add(frozen_class)
+    return frozen_class
+
+
+def deep_freeze(value: Any) -> Any:
+    """
+    Frozen copy of a pydantic object or a list of them, nested ones included.
+    """
+    if isinstance(value, pydantic.BaseModel):
+        frozen_class = _frozen_class(type(value))
+        # already validated, model_construct only swaps the class
+        return frozen_class.model_construct(
+            _fields_set=value.model_fields_set, **{name: deep_freeze(field) for name, field in value})
+    if isinstance(value, list):
+        return FrozenList(deep_freeze(item) for item in value)
+    return value
+
+
+def freeze(generation_config: types.GenerateContentConfig) -> "config.FrozenGenerateContentConfig":
+    """
+    A copy of the config that can be shared: the config, its nested objects
+    (thinking_config, tools, ...) and its lists reject changes, and nothing is
+    shared with the original, e.g. the module level safety settings.
+    """
+    frozen_class = config.FrozenGenerateContentConfig
+    if isinstance(generation_config, frozen_class):
+        return generation_config
+    return frozen_class.model_construct(
+        _fields_set=generation_config.model_fields_set,
+        **{name: deep_freeze(field) for name, field in generation_config})
+
+
+class ConfigRegistry:
+    def __init__(self, presets: Optional[Dict[str, Union[str, types.GenerateContentConfig]]] = None,
+                 max_entries: int = 256, default_id: Optional[str] = None):
+        """
+        Args:
+            presets: configs addressable by id, defaults to the built-in configs.
+                A string value names a config.py attribute that is built on first use.
+            max_entries: least recently used compiled overrides beyond this are dropped.
+            default_id: preset used by resolve() when a request names no config.
+        """
+        self.max_entries = max_entries
+        self.default_id = default_id
+        self._presets: Dict[str, Union[str, "config.FrozenGenerateContentConfig"]] = {}
+        self._compiled: "OrderedDict[str, config.FrozenGenerateContentConfig]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(("hits", "misses", "evicted"), 0)
+        for config_id, generation_config in (DEFAULT_PRESETS if presets is None else presets).items():
+            self.register(config_id, generation_config)
+
+    def register(self, config_id: str, generation_config: Union[str, types.GenerateContentConfig]):
+        if not isinstance(generation_config, str):
+            generation_config = freeze(generation_config)
+        with self._lock:
+            self._presets[config_id] = generation_config
+
+    def preset(self, config_id: str) -> "config.FrozenGenerateContentConfig":
+        """
+        Raises:
+            ValueError: for an unknown id.
+        """
+        generation_config = self._presets.get(config_id)
+        if generation_config is None:
+            raise ValueError(
+                f"Unknown config_id '{config_id}', expected one of {sorted(self._presets)}.")
+        if isinstance(generation_config, str):
+            generation_config = freeze(getattr(config, generation_config))
+            with self._lock:
+                self._presets[config_id] = generation_config
+        return generation_config
+
+    def compile(self, data: Dict[str, Any]) -> "config.FrozenGenerateContentConfig":
+        """
+        Returns the shared config for a generation_config blob, compiling it on first use.
+        Raises:
+            ValueError, TypeError: for an invalid blob, which is never cached.
+        """
+        key = canonical_json(data)
+        with self._lock:
+            generation_config = self._compiled.get(key)
+            if generation_config is not None:
+                self._compiled.move_to_end(key)
+                self._stats["hits"] += 1
+                return generation_config
+            self._stats["misses"] += 1
+
+        # compile outside the lock, two threads racing on the same new blob
+        # both build it and the second one wins, which is harmless
+        generation_config = freeze(
+            config.create_config_from_json_data(json.loads(key)))
+        with self._lock:
+            self._compiled[key] = generation_config
+            self._compiled.move_to_end(key)
+            while len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+                self._stats["evicted"] += 1
+        return generation_config
+
+    def resolve(self, config_id: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                default: Optional[types.GenerateContentConfig] = None) -> Optional[types.GenerateContentConfig]:
+        """
+        Picks the config of a request: an explicit generation_config blob wins over
+        a preset id, and both win over the default (or the default_id preset).
+        """
+        if data:
+            return self.compile(data)
+        if config_id:
+            return self.preset(config_id)
+        if default is None and self.default_id:
+            return self.preset(self.default_id)
+        return default
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._compiled)
+            stats["presets"] = sorted(self._presets)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
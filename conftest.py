@@ -0,0 +1,15 @@
+"""
+Helpers shared by the test modules. pytest loads this file on its own, the
+unittest runner finds it as a plain module next to the tests.
+"""
+from conversation import ConversationManager, SingletonBase
+
+
+def reset_manager(manager_class=ConversationManager):
+    SingletonBase._instances.pop(manager_class, None)
+
+
+def fresh_manager(manager_class=ConversationManager, **kwargs) -> ConversationManager:
+    # ConversationManager is a process-wide singleton, start each test from scratch
+    reset_manager(manager_class)
+    return manager_class(**kwargs)
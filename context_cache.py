@@ -0,0 +1,241 @@
+"""
+Explicit Gemini context caching for stable prompt prefixes.
+
+The system instruction and tools of RAG_ASSISTANT_CONFIG / GOOGLE_SEARCH_CONFIG,
+plus the older turns of a long conversation, are identical from one request
+to the next. ContextCacheManager stores such a prefix once as a cached-content
+entry (client.caches) and rewrites the request to reference it, so only the
+delta is sent. Entries are reused by content hash, refreshed before they
+expire and evicted (and deleted upstream) beyond max_entries.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from google import genai
+from google.genai import types
+
+from context_policy import estimate_content_tokens, estimate_tokens
+from serialization import to_jsonable
+
+cache_logger = logging.getLogger(__name__)
+
+# config fields that move into the cached content and must not be sent alongside it
+CACHED_CONFIG_FIELDS = ("system_instruction", "tools", "tool_config")
+
+
+def _instruction_tokens(system_instruction: Any) -> int:
+    if system_instruction is None:
+        return 0
+    if isinstance(system_instruction, str):
+        return estimate_tokens(system_instruction)
+    if isinstance(system_instruction, types.Content):
+        return estimate_content_tokens(system_instruction)
+    if isinstance(system_instruction, types.Part):
+        return estimate_tokens(system_instruction.text or "")
+    if isinstance(system_instruction, list):
+        return sum(_instruction_tokens(item) for item in system_instruction)
+    return 0
+
+
+class _CacheEntry:
+    __slots__ = ("name", "expires_at", "token_count")
+
+    def __init__(self, name: str, expires_at: float, token_count: int):
+        self.name = name
+        self.expires_at = expires_at
+        self.token_count = token_count
+
+
+class ContextCacheManager:
+    def __init__(
+        self,
+        client: genai.Client,
+        ttl: float = 3600,
+        min_tokens: int = 1024,
+        prefix_step: int = 8,
+        refresh_margin: float = 300,
+        max_entries: int = 256,
+    ):
+        """
+        Args:
+            client: client whose `caches` API holds the entries.
+            ttl: lifetime requested for new entries and on refresh, in seconds.
+            min_tokens: the API rejects smaller caches, shorter prefixes are sent as is.
+            prefix_step: conversation prefixes are cut at multiples of this many
+                turns, so one entry serves several consecutive turns.
+            refresh_margin: entries closer than this to expiry get their ttl extended.
+            max_entries: least recently used entries beyond this are deleted.
+        """
+        self.client = client
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.prefix_step = max(1, prefix_step)
+        self.refresh_margin = refresh_margin
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ("requests", "hits", "misses", "skipped", "created", "refreshed",
+             "evicted", "errors", "cached_tokens"), 0)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _prefix_length(self, contents: List[types.Content]) -> int:
+        # the newest turn (the message being sent) is never part of the prefix
+        return (len(contents) - 1) // self.prefix_step * self.prefix_step
+
+    def _cache_key(self, model: str, config: types.GenerateContentConfig, prefix: List[types.Content]) -> str:
+        payload = json.dumps({
+            "model": model,
+            "config": {field: to_jsonable(getattr(config, field)) for field in CACHED_CONFIG_FIELDS},
+            "contents": to_jsonable(prefix),
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def prepare(
+        self,
+        model: str,
+        contents: List[types.Content],
+        config: Optional[types.GenerateContentConfig],
+    ) -> Tuple[List[types.Content], Optional[types.GenerateContentConfig]]:
+        """
+        Returns the (contents, config) to send: the delta after the cached
+        prefix and a config referencing the cache, or the inputs unchanged if
+        the prefix is too small to cache or caching failed.
+        """
+        self._count("requests")
+        if config is None or config.cached_content:
+            self._count("skipped")
+            return contents, config
+
+        prefix_length = self._prefix_length(contents)
+        prefix = contents[:prefix_length]
+        estimated_tokens = _instruction_tokens(config.system_instruction) + sum(
+            estimate_content_tokens(content) for content in prefix)
+        if estimated_tokens < self.min_tokens:
+            self._count("skipped")
+            return contents, config
+
+        key = self._cache_key(model, config, prefix)
+        try:
+            entry = self._get_or_create(key, model, config, prefix)
+        except Exception as e:
+            cache_logger.error(f"Context cache unavailable, sending the full prompt: {e}")
+            self._count("errors")
+            return contents, config
+
+        cached_config = config.model_copy(update={
+            "cached_content": entry.name,
+            **{field: None for field in CACHED_CONFIG_FIELDS},
+        })
+        return contents[prefix_length:], cached_config
+
+    def _get_or_create(self, key: str, model: str, config: types.GenerateContentConfig, prefix: List[types.Content]) -> _CacheEntry:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+        if entry:
+            if entry.expires_at - now < self.refresh_margin:
+                self._refresh(entry)
+            return entry
+
+        self._count("misses")
+        cached = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=prefix or None,
+                ttl=f"{int(self.ttl)}s",
+                **{field: getattr(config, field) for field in CACHED_CONFIG_FIELDS},
+            ),
+        )
+        token_count = 0
+        if cached.usage_metadata and cached.usage_metadata.total_token_count:
+            token_count = cached.usage_metadata.total_token_count
+        entry = _CacheEntry(cached.name, time.monotonic() + self.ttl, token_count)
+        cache_logger.info(
+            f"Created context cache {cached.name} ({len(prefix)} turns, {token_count} tokens).")
+
+        evicted = []
+        with self._lock:
+            self._stats["created"] += 1
+            existing = self._entries.get(key)
+            if existing:
+                # a concurrent request created the same prefix first, keep theirs
+                evicted.append(entry)
+                entry = existing
+            else:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[1])
+                    self._stats["evicted"] += 1
+        for stale in evicted:
+            self._delete(stale)
+        return entry
+
+    def _refresh(self, entry: _CacheEntry):
+        try:
+            self.client.caches.update(
+                name=entry.name,
+                config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl)}s"),
+            )
+            entry.expires_at = time.monotonic() + self.ttl
+            self._count("refreshed")
+        except Exception as e:
+            # still valid until it expires, try again next time
+            cache_logger.warning(f"Refreshing context cache {entry.name} failed: {e}")
+            self._count("errors")
+
+    def _delete(self, entry: _CacheEntry):
+        try:
+            self.client.caches.delete(name=entry.name)
+        except Exception as e:
+            cache_logger.warning(f"Deleting context cache {entry.name} failed: {e}")
+
+    def invalidate(self, name: str):
+        """
+        Forgets an entry the API no longer accepts, e.g. after an error referencing it.
+        """
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.name == name:
+                    del self._entries[key]
+
+    def expire(self) -> int:
+        """
+        Drops entries past their expiry, the API has already discarded them.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items()
+                       if entry.expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def record_usage(self, response: types.GenerateContentResponse):
+        usage = getattr(response, "usage_metadata", None)
+        if usage and usage.cached_content_token_count:
+            self._count("cached_tokens", usage.cached_content_token_count)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        # cached tokens are billed at a discount instead of being sent again
+        stats["tokens_saved"] = stats.pop("cached_tokens")
+        return stats
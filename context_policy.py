@@ -0,0 +1,165 @@
+"""
+Context policies decide which part of a conversation is sent to the model.
+
+The default FullHistoryPolicy sends everything, like before. SlidingWindowPolicy
+keeps the request under a token budget: the first N turns stay pinned, the
+newest turns fill the rest of the budget, and the turns that fell out of the
+window can be folded into a rolling summary.
+
+Token counts per turn are estimated once when the turn is added to the
+ConversationHistory (see ConversationHistory.token_counts), never per request.
+"""
+import abc
+import logging
+from typing import Callable, List, Optional
+
+from google import genai
+from google.genai import types
+
+policy_logger = logging.getLogger(__name__)
+
+# (previous summary or None, newly evicted turns) -> new summary
+Summarizer = Callable[[Optional[str], List[types.Content]], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate: roughly 4 ASCII characters per token, while
+    CJK and other non-ASCII characters count as about one token each.
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+# a few tokens of per-turn framing on top of the text
+TURN_FRAMING_TOKENS = 4
+
+
+def estimate_content_tokens(content: types.Content) -> int:
+    return TURN_FRAMING_TOKENS + sum(estimate_tokens(part.text) for part in (content.parts or []) if part.text)
+
+
+class ContextPolicy(abc.ABC):
+    # True if select() may block on I/O, e.g. a summarization call
+    may_block = False
+
+    @abc.abstractmethod
+    def select(self, history) -> List[types.Content]:
+        pass
+
+
+class FullHistoryPolicy(ContextPolicy):
+    def select(self, history) -> List[types.Content]:
+        return history.contents[:]
+
+
+# model turn between the summary (or a pinned user turn) and the window, which starts on a user turn
+WINDOW_BRIDGE_TEXT = "Understood."
+
+
+class SlidingWindowPolicy(ContextPolicy):
+    def __init__(
+        self,
+        max_tokens: int,
+        pin_turns: int = 0,
+        summarizer: Optional[Summarizer] = None,
+        low_watermark: float = 0.75,
+    ):
+        """
+        Args:
+            max_tokens: token budget for the contents of one request.
+            pin_turns: number of leading turns that are always sent.
+            summarizer: optional callable folding evicted turns into a rolling summary.
+            low_watermark: once over budget the window shrinks to this fraction of
+                it, so the window start (and the summary) only moves every few turns.
+        """
+        self.max_tokens = max_tokens
+        self.pin_turns = pin_turns
+        self.summarizer = summarizer
+        self.low_watermark = low_watermark
+        self.may_block = summarizer is not None
+
+    def select(self, history) -> List[types.Content]:
+        contents = history.contents
+        counts = history.token_counts
+        pinned = min(self.pin_turns, len(contents))
+        state = history.context_state
+        start = max(state.get("window_start", 0), pinned)
+
+        summary_tokens = estimate_tokens(
+            state["summary"]) if state.get("summary") else 0
+        fixed = sum(counts[:pinned]) + summary_tokens
+        window = sum(counts[start:])
+
+        if fixed + window > self.max_tokens:
+            target = int(self.max_tokens * self.low_watermark)
+            new_start = start
+            # never evict the last turn, the model needs the current message
+            while new_start < len(contents) - 1 and fixed + window > target:
+                window -= counts[new_start]
+                new_start += 1
+            # start the window on a user turn
+            while new_start < len(contents) - 1 and contents[new_start].role != "user":
+                window -= counts[new_start]
+                new_start += 1
+            if self.summarizer is not None:
+                evicted = contents[start:new_start]
+                try:
+                    state["summary"] = self.summarizer(
+                        state.get("summary"), evicted)
+                except Exception as e:
+                    policy_logger.error(
+                        f"Summarizing {len(evicted)} evicted turns failed, dropping them: {e}")
+            policy_logger.info(
+                f"Context window moved from turn {start} to {new_start} of {len(contents)}.")
+            start = new_start
+            state["window_start"] = start
+
+        # roles have to keep alternating around the summary and the window
+        selected = list(contents[:pinned])
+        if state.get("summary"):
+            summary = types.Part.from_text(
+                text=f"[Summary of the earlier conversation]\n{state['summary']}")
+            if selected and selected[-1].role == "user":
+                # an odd pin_turns ends on a user turn, the summary joins it
+                selected[-1] = types.Content(role="user", parts=[*(selected[-1].parts or []), summary])
+            else:
+                selected.append(types.Content(role="user", parts=[summary]))
+        if selected and selected[-1].role == "user" and start < len(contents) and contents[start].role == "user":
+            selected.append(types.Content(role="model", parts=[types.Part.from_text(text=WINDOW_BRIDGE_TEXT)]))
+        selected.extend(contents[start:])
+        return selected
+
+
+class ModelSummarizer:
+    """
+    Summarizer backed by a (cheap) Gemini model, extends the previous summary
+    with the newly evicted turns instead of re-reading the whole conversation.
+    """
+
+    def __init__(self, client: genai.Client, model_name: str, max_output_tokens: int = 512):
+        self.client = client
+        self.model_name = model_name
+        self.config = types.GenerateContentConfig(
+            temperature=0,
+            max_output_tokens=max_output_tokens,
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
+        )
+
+    def __call__(self, previous_summary: Optional[str], evicted: List[types.Content]) -> str:
+        transcript = "\n".join(
+            f"{content.role}: {' '.join(part.text for part in (content.parts or []) if part.text)}"
+            for content in evicted
+        )
+        prompt = (
+            "Update the running summary of a conversation with the new turns below. "
+            "Keep names, facts, decisions and open questions, answer in the conversation's language.\n\n"
+            f"Current summary:\n{previous_summary or '(empty)'}\n\nNew turns:\n{transcript}"
+        )
+        response = self.client.models.generate_content(
+            model=self.model_name,
+            contents=[types.Content(
+                role="user", parts=[types.Part.from_text(text=prompt)])],
+            config=self.config,
+        )
+        return response.text or previous_summary or ""
@@ -1,41 +1,479 @@
+import contextvars
+import itertools
+import json
+import queue
 import threading
+import time
 import uuid
+import zlib
 import logging
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from google import genai
 from google.genai import types
-from typing import List, Optional, Dict
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Dict, Sequence, Tuple
+import deadline as deadlines
+from context_policy import TURN_FRAMING_TOKENS, ContextPolicy, FullHistoryPolicy, estimate_tokens
+from model_router import RoutingDecision
+from rate_limiter import RateLimitError
+from response_cache import is_cacheable, request_key
+from single_flight import is_coalescable
+from turn_store import CompactTurnStore, ContentsView
 
 manager_logger = logging.getLogger(__name__ + ".ConversationManager")
 
 
+def extract_response_text(response: types.GenerateContentResponse) -> str:
+    """
+    Picks the text to record as the model turn out of a full response.
+    """
+    if hasattr(response, 'text'):
+        return response.text
+    elif response.candidates and response.candidates[0].content.parts:
+        return response.candidates[0].content.parts[0].text
+    else:
+        print("Warning: Received response with no usable text content.")
+        block_reason = getattr(
+            getattr(response, 'prompt_feedback', None), 'block_reason', None)
+        if block_reason:
+            return f"[Blocked by Safety Setting: {block_reason}]"
+        else:
+            return "[No response text found]"
+
+
+def assemble_stream_response(text: str, last_chunk: Optional[types.GenerateContentResponse]) -> Optional[types.GenerateContentResponse]:
+    """
+    Rebuilds one response out of a finished stream, usage metadata is cumulative
+    so the last chunk carries the totals. None if nothing usable was streamed.
+    """
+    if not text or last_chunk is None:
+        return None
+    finish_reason = None
+    if last_chunk.candidates:
+        finish_reason = last_chunk.candidates[0].finish_reason
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=types.Content(
+                role="model", parts=[types.Part.from_text(text=text)]),
+            finish_reason=finish_reason,
+        )],
+        usage_metadata=last_chunk.usage_metadata,
+        model_version=last_chunk.model_version,
+    )
+
+
+class ModelCall:
+    """
+    What ConversationHistory is about to send for one turn.
+    """
+    __slots__ = ("model_name", "generation_config", "contents", "config",
+                 "cache_key", "cached_response", "thinking", "started_at",
+                 "flight_key", "flight", "leads")
+
+    def __init__(self, model_name: str, generation_config: Optional[types.GenerateContentConfig], contents: List[types.Content]):
+        self.model_name = model_name
+        # as requested, before any rewrite
+        self.generation_config = generation_config
+        # what actually goes out, possibly rewritten by the thinking policy and context cache
+        self.contents = contents
+        self.config = generation_config
+        self.cache_key: Optional[str] = None
+        self.cached_response: Optional[types.GenerateContentResponse] = None
+        # ThinkingChoice of the thinking policy, reported back in finish_call
+        self.thinking = None
+        self.started_at = time.perf_counter()
+        # SingleFlight flight this call leads or follows, see single_flight.py
+        self.flight_key: Optional[str] = None
+        self.flight = None
+        self.leads = False
+
+    @property
+    def follows(self) -> bool:
+        return self.flight is not None and not self.leads
+
+
+class ConversationBusyError(RuntimeError):
+    """
+    Raised when a conversation is still busy with another turn.
+    """
+
+
+class ConversationNotFoundError(ValueError):
+    """
+    Raised when a message targets a conversation that does not exist (any more).
+    """
+
+
+class BulkMessage(NamedTuple):
+    conversation_id: str
+    message: str
+    generation_config: Optional[types.GenerateContentConfig] = None
+
+
+class BulkResult(NamedTuple):
+    """
+    Outcome of one BulkMessage, `index` is its position in the request.
+    """
+    index: int
+    conversation_id: str
+    response: Optional[str] = None
+    error: Optional[Exception] = None
+    # RoutingDecision.to_dict() of items sent through a ModelRouter
+    routing: Optional[Dict[str, Any]] = None
+
+
+def group_bulk_messages(items: Iterable[Tuple]) -> "OrderedDict[str, List[Tuple[int, BulkMessage]]]":
+    """
+    Messages to the same conversation have to run one after another, so the
+    fan-out unit is a conversation with its messages in request order.
+    """
+    groups: "OrderedDict[str, List[Tuple[int, BulkMessage]]]" = OrderedDict()
+    for index, item in enumerate(items):
+        item = BulkMessage(*item)
+        groups.setdefault(item.conversation_id, []).append((index, item))
+    return groups
+
+
 class ConversationHistory:
-    def __init__(self):
-        self._history: List[types.Content] = []
+    # see turn_store.py, ContentTurnStore keeps full Content objects
+    turn_store_class = CompactTurnStore
 
-    def add_user_message(self, text: str):
-        self._history.append(
-            types.Content(role="user", parts=[types.Part.from_text(text=text)])
-        )
+    def __init__(self, busy_timeout: Optional[float] = 0, context_policy: Optional[ContextPolicy] = None):
+        """
+        Args:
+            busy_timeout: how long a new turn waits for the one in flight.
+                0 rejects immediately, None queues without limit.
+            context_policy: picks the contents sent per request, full history by default.
+        """
+        self._turns = self.turn_store_class()
+        # estimated tokens per turn, parallel to _turns and counted once on append
+        self._token_counts: List[int] = []
+        self.context_policy = context_policy or FullHistoryPolicy()
+        # per-conversation state owned by the context policy (window start, summary)
+        self.context_state: Dict[str, Any] = {}
+        # optional ContextCacheManager (see context_cache.py), set by the manager
+        self.context_cache = None
+        # optional ResponseCache (see response_cache.py), set by the manager
+        self.response_cache = None
+        # optional ThinkingPolicy (see thinking_policy.py), set by the manager
+        self.thinking_policy = None
+        # optional SingleFlight (see single_flight.py), set by the manager
+        self.single_flight = None
+        # optional LocalRetriever (see retrieval.py), set by the manager
+        self.retriever = None
+        self.busy_timeout = busy_timeout
+        self._turn_lock = threading.Lock()
+        self.size_bytes = 0
+        self.last_access = time.monotonic()
+        # set by the owning ConversationManager to keep its footprint in sync
+        self._on_resize: Optional[Callable[[int], None]] = None
+        # JSON of the turns, encoded once on first read and kept comma separated
+        # so any page is one slice, plus a running crc32 that identifies the
+        # history content for ETags
+        self._turn_json = bytearray()
+        self._turn_json_ends = array("Q")
+        self._turn_digests = array("Q")
+        self._serialized_lock = threading.Lock()
+        # shared backend (see conversation_store.py) the turns are persisted to
+        self._store = None
+        self.conversation_id: Optional[str] = None
+
+    def attach_store(self, store, conversation_id: str):
+        self._store = store
+        self.conversation_id = conversation_id
+
+    def sync(self) -> bool:
+        """
+        Pulls the turns other workers appended to the shared store, only the
+        ones this process has not seen yet. Returns False if the conversation
+        no longer exists there. Callers hold the turn lock.
+        """
+        if self._store is None:
+            return True
+        turns = self._store.load_turns(
+            self.conversation_id, since=len(self._turns))
+        if turns is None:
+            return False
+        for role, text in turns:
+            self._append(role, text)
+        return True
+
+    def refresh(self) -> bool:
+        """
+        sync() unless a turn is in flight, that turn will bring the history up to date.
+        """
+        if self._store is None or not self._turn_lock.acquire(blocking=False):
+            return True
+        try:
+            return self.sync()
+        finally:
+            self._turn_lock.release()
+
+    def _start_turn(self, message: str) -> int:
+        if not self.sync():
+            # deleted from the shared store by another worker
+            raise ConversationNotFoundError(
+                f"Conversation with ID '{self.conversation_id}' not found.")
+        return self.add_user_message(message)
+
+    def _commit_turn(self, user_turn: int, model_response_text: str) -> int:
+        """
+        Records the model turn and persists the user/model pair to the shared
+        store if there is one. The model turn is rolled back if that fails.
+        """
+        model_turn = self.add_model_response(model_response_text)
+        if self._store is not None:
+            try:
+                self._store.append_turns(
+                    self.conversation_id,
+                    user_turn,
+                    [self.turn_at(user_turn), self.turn_at(model_turn)],
+                )
+            except Exception:
+                self._rollback(model_turn)
+                raise
+        return model_turn
+
+    def _append(self, role: str, text: str) -> int:
+        index = self._turns.append(role, text)
+        self._token_counts.append(TURN_FRAMING_TOKENS + estimate_tokens(text))
+        self._resized(self._turns.size(index))
+        return index
+
+    def _resized(self, delta: int):
+        self.size_bytes += delta
+        if self._on_resize and delta:
+            self._on_resize(delta)
+
+    @property
+    def is_busy(self) -> bool:
+        return self._turn_lock.locked()
+
+    @contextmanager
+    def turn(self):
+        """
+        Serializes turns of this conversation (user message -> model call -> reply).
+        Queued turns wait no longer than the request deadline.
+        """
+        timeout = self._turn_wait()
+        if timeout is None:
+            acquired = self._turn_lock.acquire()
+        elif timeout <= 0:
+            acquired = self._turn_lock.acquire(blocking=False)
+        else:
+            acquired = self._turn_lock.acquire(timeout=timeout)
+        if not acquired:
+            deadline = deadlines.current()
+            if deadline is not None:
+                deadline.check()
+            raise ConversationBusyError(
+                "Conversation is busy with another message, retry later.")
+        try:
+            yield
+        finally:
+            self._turn_lock.release()
 
-    def add_model_response(self, text: str):
-        if not self._history:
+    def _turn_wait(self) -> Optional[float]:
+        remaining = deadlines.remaining()
+        if self.busy_timeout is None:
+            return remaining
+        if self.busy_timeout <= 0 or remaining is None:
+            return self.busy_timeout
+        return max(0.001, min(self.busy_timeout, remaining))
+
+    def _turn_failed(self, call: Optional["ModelCall"], user_turn: int, error: BaseException, started_at: float) -> Optional[BaseException]:
+        """
+        Rolls back a failed turn and books it if it was given up on. Returns
+        DeadlineExceeded to raise instead of the error if the deadline passed.
+        """
+        if call is not None:
+            self.finish_call(call, error=error)
+        self._rollback(user_turn)
+        reason = deadlines.record_cancelled(error, started_at)
+        if reason == "deadline" and isinstance(error, Exception) and not isinstance(error, deadlines.DeadlineExceeded):
+            return deadlines.DeadlineExceeded(
+                f"Request deadline exceeded during the model call: {error!r}")
+        return None
+
+    def add_user_message(self, text: str) -> int:
+        """
+        Returns the index of the new turn.
+        """
+        return self._append("user", text)
+
+    def _rollback(self, turn: int):
+        """
+        Removes the turn we added, and anything appended after it. Turns only
+        change under the turn lock, so that is the tail of our own turn.
+        """
+        if turn >= len(self._turns):
+            return
+        size = sum(self._turns.size(i) for i in range(turn, len(self._turns)))
+        with self._serialized_lock:
+            self._turns.truncate(turn)
+            del self._token_counts[turn:]
+            if turn < len(self._turn_json_ends):
+                del self._turn_json[self._turn_json_ends[turn - 1] if turn else 0:]
+                del self._turn_json_ends[turn:]
+                del self._turn_digests[turn:]
+        self._resized(-size)
+
+    def add_model_response(self, text: str) -> int:
+        if not self._turns:
             raise ValueError(
                 "Cannot add model response before any user message.")
-        if self._history[-1].role == "model":
+        if self._turns.role(-1) == "model":
             print(
                 "Warning: Adding model response immediately after another model response.")
-        self._history.append(
-            types.Content(role="model", parts=[
-                types.Part.from_text(text=text)
-            ])
-        )
+        return self._append("model", text)
+
+    def turn_at(self, index: int) -> Tuple[str, str]:
+        """
+        (role, text) of a turn, without building a Content.
+        """
+        return self._turns.role(index), self._turns.text(index)
 
     @property
-    def contents(self) -> List[types.Content]:
+    def contents(self) -> Sequence[types.Content]:
         """
         获取当前完整的对话历史记录列表，供 API 调用。
+        The Content objects are built on access, slice the view for a list.
+        """
+        return ContentsView(self._turns)
+
+    @property
+    def token_counts(self) -> List[int]:
+        return self._token_counts
+
+    def serialized_turns(self, since: int = 0, limit: Optional[int] = None) -> Tuple[bytes, int, int, str]:
+        """
+        JSON of the turns [since, since + limit) as one comma separated chunk,
+        how many turns it holds, the total number of turns and a version that
+        changes whenever the history does. Each turn is encoded once, later
+        calls only encode turns appended since.
+        """
+        with self._serialized_lock:
+            total = len(self._turns)
+            for i in range(len(self._turn_json_ends), total):
+                data = json.dumps({"role": self._turns.role(i), "text": self._turns.text(i)},
+                                  ensure_ascii=False).encode("utf-8")
+                if i:
+                    self._turn_json += b","
+                self._turn_json += data
+                self._turn_json_ends.append(len(self._turn_json))
+                self._turn_digests.append(zlib.crc32(
+                    data, self._turn_digests[-1] if i else 0))
+            end = total if limit is None else min(total, since + limit)
+            if since < end:
+                # skip the comma in front of the first turn of the page
+                start = self._turn_json_ends[since - 1] + 1 if since else 0
+                chunk = bytes(self._turn_json[start:self._turn_json_ends[end - 1]])
+            else:
+                chunk = b""
+            digest = self._turn_digests[total - 1] if total else 0
+        return chunk, max(0, end - since), total, f"{total}-{digest:08x}"
+
+    def request_contents(self) -> List[types.Content]:
         """
-        return self._history
+        The part of the history sent to the model, as chosen by the context policy.
+        """
+        return self.context_policy.select(self)
+
+    def prepare_call(
+        self,
+        model_name: str,
+        generation_config: Optional[types.GenerateContentConfig],
+        use_cache: bool = True,
+    ) -> "ModelCall":
+        """
+        Works out the next model call: the context policy's selection, a
+        response cache lookup and, on a miss, joining an identical call in
+        flight or the thinking budget, local retrieval and the rewrite
+        against the context cache. May block on summarization, embedding or
+        cache creation.
+        """
+        call = ModelCall(model_name, generation_config,
+                         self.request_contents())
+        if self.response_cache is not None:
+            if use_cache and is_cacheable(generation_config):
+                call.cache_key = self.response_cache.key(
+                    model_name, generation_config, call.contents)
+                call.cached_response = self.response_cache.get(call.cache_key)
+            else:
+                self.response_cache.bypass()
+        if call.cached_response is not None:
+            return call
+        if self.single_flight is not None and use_cache and is_coalescable(generation_config):
+            call.flight_key = call.cache_key or request_key(
+                model_name, generation_config, call.contents)
+            call.flight, call.leads = self.single_flight.join(call.flight_key)
+            if not call.leads:
+                # the leader's response will do, whatever budget or cache it went out with
+                return call
+        try:
+            if self.thinking_policy is not None:
+                # after the lookup, a cached answer is valid whatever budget it was made with
+                call.config, call.thinking = self.thinking_policy.choose(
+                    self, model_name, call.config)
+            if self.retriever is not None:
+                # passages go into the last message, the cacheable prefix stays as is
+                call.contents, call.config = self.retriever.augment(call.contents, call.config)
+            if self.context_cache is not None:
+                call.contents, call.config = self.context_cache.prepare(
+                    model_name, call.contents, call.config)
+        except BaseException as e:
+            if call.leads:
+                self.single_flight.finish(call.flight_key, call.flight, error=e)
+            raise
+        return call
+
+    def _prepare_call_coalesced(
+        self,
+        model_name: str,
+        generation_config: Optional[types.GenerateContentConfig],
+        use_cache: bool = True,
+    ) -> "ModelCall":
+        """
+        prepare_call, then waits out the identical call in flight that this
+        one follows and takes its response like a cache hit. Prepares again
+        if that call was given up on.
+        """
+        call = self.prepare_call(model_name, generation_config, use_cache)
+        while call.follows:
+            response = self.single_flight.wait(call.flight, deadlines.remaining())
+            if response is not None:
+                call.cached_response = response
+                break
+            call = self.prepare_call(model_name, generation_config, use_cache)
+        return call
+
+    def finish_call(self, call: "ModelCall", response: Optional[types.GenerateContentResponse] = None, error: Optional[BaseException] = None):
+        if call.cached_response is not None or call.follows:
+            return
+        try:
+            self._record_call(call, response, error)
+        finally:
+            if call.leads:
+                # after the response cache put, late arrivals find the answer there
+                self.single_flight.finish(call.flight_key, call.flight, response, error)
+
+    def _record_call(self, call: "ModelCall", response: Optional[types.GenerateContentResponse], error: Optional[BaseException]):
+        if self.context_cache is not None:
+            if response is not None:
+                self.context_cache.record_usage(response)
+            # GeneratorExit/CancelledError only mean the caller went away
+            if isinstance(error, Exception) and call.config is not None and call.config.cached_content:
+                # the entry may have expired or been deleted upstream, recreate it next time
+                self.context_cache.invalidate(call.config.cached_content)
+        if response is not None and call.thinking is not None:
+            self.thinking_policy.observe(
+                call.thinking, response, time.perf_counter() - call.started_at)
+        if response is not None and call.cache_key is not None:
+            self.response_cache.put(
+                call.cache_key, response, self.response_cache.ttl_for(call.generation_config))
 
     def send_message(
         self,
@@ -43,40 +481,106 @@ class ConversationHistory:
         client: genai.Client,
         message: str,
         generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
     ) -> types.GenerateContentResponse:
-        self.add_user_message(message)
-        try:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=self.contents,
-                config=generation_config,
-            )
-            if hasattr(response, 'text'):
-                model_response_text = response.text
-            elif response.candidates and response.candidates[0].content.parts:
-                model_response_text = response.candidates[0].content.parts[0].text
-            else:
-                print("Warning: Received response with no usable text content.")
-                block_reason = getattr(
-                    getattr(response, 'prompt_feedback', None), 'block_reason', None)
-                if block_reason:
-                    model_response_text = f"[Blocked by Safety Setting: {
-                        block_reason}]"
+        with self.turn():
+            user_turn = self._start_turn(message)
+            started_at = time.perf_counter()
+            deadline = deadlines.current()
+            call = None
+            try:
+                call = self._prepare_call_coalesced(
+                    model_name, generation_config, use_cache)
+                response = call.cached_response
+                if response is None:
+                    response = client.models.generate_content(
+                        model=model_name,
+                        contents=call.contents,
+                        config=deadlines.with_timeout(call.config, deadline),
+                    )
+                self.finish_call(call, response=response)
+                model_response_text = extract_response_text(response)
+                self._commit_turn(user_turn, model_response_text)
+                return response
+            except Exception as e:
+                print(f"Error during API call: {e}")
+                exceeded = self._turn_failed(call, user_turn, e, started_at)
+                if exceeded is not None:
+                    raise exceeded from e
+                raise
+
+    def send_message_stream(
+        self,
+        model_name: str,
+        client: genai.Client,
+        message: str,
+        generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
+    ) -> Iterator[types.GenerateContentResponse]:
+        """
+        Streams the model's answer chunk by chunk.
+        The assembled model turn is only committed once the stream is exhausted;
+        if the stream fails or is closed early the user turn is rolled back.
+        A response cache hit arrives as a single chunk. Past the request
+        deadline the upstream stream is closed and DeadlineExceeded raised.
+        """
+        with self.turn():
+            user_turn = self._start_turn(message)
+            started_at = time.perf_counter()
+            deadline = deadlines.current()
+            text_chunks: List[str] = []
+            call = None
+            stream = None
+            try:
+                call = self._prepare_call_coalesced(
+                    model_name, generation_config, use_cache)
+                if call.cached_response is not None:
+                    stream = iter([call.cached_response])
                 else:
-                    model_response_text = "[No response text found]"
+                    stream = client.models.generate_content_stream(
+                        model=model_name,
+                        contents=call.contents,
+                        config=deadlines.with_timeout(call.config, deadline),
+                    )
+                last_chunk = None
+                for chunk in stream:
+                    if deadline is not None:
+                        deadline.check()
+                    if chunk.text:
+                        text_chunks.append(chunk.text)
+                    last_chunk = chunk
+                    yield chunk
 
-            self.add_model_response(model_response_text)
-            return response
-        except Exception as e:
-            print(f"Error during API call: {e}")
-            self._history.pop()  # rollback
-            raise
+                model_response_text = "".join(text_chunks)
+                self.finish_call(call, response=assemble_stream_response(
+                    model_response_text, last_chunk))
+                if not model_response_text:
+                    print("Warning: Stream finished with no usable text content.")
+                    model_response_text = "[No response text found]"
+                self._commit_turn(user_turn, model_response_text)
+            except BaseException as e:
+                # GeneratorExit included: the consumer went away before the end
+                print(f"Error during streaming API call: {e!r}")
+                if hasattr(stream, "close"):
+                    # cancels the upstream request instead of leaving it to the GC
+                    stream.close()
+                exceeded = self._turn_failed(call, user_turn, e, started_at)
+                if exceeded is not None:
+                    raise exceeded from e
+                raise
 
     def clear(self):
-        self._history = []
+        with self._serialized_lock:
+            self._turns = self.turn_store_class()
+            self._token_counts = []
+            self._turn_json = bytearray()
+            self._turn_json_ends = array("Q")
+            self._turn_digests = array("Q")
+        self.context_state = {}
+        self._resized(-self.size_bytes)
 
     def __len__(self) -> int:
-        return len(self._history)
+        return len(self._turns)
 
     def __bool__(self) -> bool:
         return True
@@ -93,26 +597,183 @@ class SingletonBase(type):
         return cls._instances[cls]
 
 
-class ConversationManager(metaclass=SingletonBase):
+EVICTION_REASONS = ("max_conversations", "max_history_bytes", "idle_ttl")
+
+
+class _Shard:
+    __slots__ = ("conversations", "lock", "history_bytes", "evictions")
+
     def __init__(self):
+        # kept in LRU order, least recently used first
+        self.conversations: "OrderedDict[str, ConversationHistory]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.history_bytes = 0
+        self.evictions: Dict[str, int] = dict.fromkeys(EVICTION_REASONS, 0)
+
+    def resize(self, conversation_id: str, conversation: ConversationHistory, delta: int):
+        with self.lock:
+            # a conversation evicted mid-turn no longer counts towards the shard
+            if self.conversations.get(conversation_id) is conversation:
+                self.history_bytes += delta
+
+    def add(self, conversation_id: str, conversation: ConversationHistory):
+        # caller holds self.lock
+        self.conversations[conversation_id] = conversation
+        self.history_bytes += conversation.size_bytes
+        conversation._on_resize = partial(
+            self.resize, conversation_id, conversation)
+
+    def remove(self, conversation_id: str) -> ConversationHistory:
+        # caller holds self.lock
+        conversation = self.conversations.pop(conversation_id)
+        conversation._on_resize = None
+        self.history_bytes -= conversation.size_bytes
+        return conversation
+
+
+class ConversationManager(metaclass=SingletonBase):
+    history_class = ConversationHistory
+
+    def __init__(
+        self,
+        num_shards: int = 16,
+        busy_timeout: Optional[float] = 0,
+        max_conversations: int = 0,
+        max_history_bytes: int = 0,
+        idle_ttl: float = 0,
+        reap_interval: float = 60,
+        store=None,
+        context_policy: Optional[ContextPolicy] = None,
+        context_cache=None,
+        response_cache=None,
+        thinking_policy=None,
+        single_flight=None,
+        retriever=None,
+        fanout_workers: int = 8,
+    ):
+        """
+        Args:
+            num_shards: conversations are striped over this many dict+lock pairs,
+                so lookups in unrelated conversations don't contend.
+            busy_timeout: see ConversationHistory, applied to new conversations.
+            max_conversations: keep at most about this many conversations, 0 for no
+                limit. Enforced per shard as ceil(max_conversations / num_shards).
+            max_history_bytes: budget for the text held by all histories, 0 for no
+                limit. Enforced per shard like max_conversations.
+            idle_ttl: drop conversations untouched for this many seconds, 0 to keep them.
+            reap_interval: how often the background reaper looks for idle conversations
+                and expired context cache entries.
+            store: optional ConversationStore shared by several worker processes.
+                The shards then act as a per-process cache in front of it.
+            context_policy: shared by all conversations, see context_policy.py.
+            context_cache: optional ContextCacheManager for stable prompt prefixes.
+            response_cache: optional ResponseCache for deterministic requests.
+            thinking_policy: optional ThinkingPolicy picking the thinking budget per request.
+            single_flight: optional SingleFlight sharing one model call among identical
+                concurrent requests.
+            retriever: optional LocalRetriever serving Vertex AI Search requests in-process.
+            fanout_workers: threads shared by all send_messages calls.
+        Limits are split evenly over the shards and enforced least recently used
+        first within a shard whenever a conversation is created or a turn is
+        committed. The totals therefore stay within the configured maximum,
+        rounded up to a multiple of num_shards. A shard that gets more than its
+        share of ids evicts before the total is reached, so a small maximum
+        wants few shards. With a
+        store, LRU eviction only drops the local copy, idle_ttl also purges the store.
+        """
         if hasattr(self, '_initialized_flag') and self._initialized_flag:
             return
-        self.conversations: Dict[str, ConversationHistory] = {}
-        self._lock = threading.Lock()
+        self._shards = [_Shard() for _ in range(max(1, num_shards))]
+        self.busy_timeout = busy_timeout
+        self.store = store
+        self.context_policy = context_policy
+        self.context_cache = context_cache
+        self.response_cache = response_cache
+        self.thinking_policy = thinking_policy
+        self.single_flight = single_flight
+        self.retriever = retriever
+        self.fanout_workers = max(1, fanout_workers)
+        self._fanout_executor: Optional[ThreadPoolExecutor] = None
+        self._fanout_lock = threading.Lock()
+        self.max_conversations = max_conversations
+        self.max_history_bytes = max_history_bytes
+        self.idle_ttl = idle_ttl
+        self._shard_max_conversations = -(-max_conversations //
+                                          len(self._shards))
+        self._shard_max_bytes = -(-max_history_bytes // len(self._shards))
+        if idle_ttl > 0 or context_cache is not None:
+            reaper = threading.Thread(
+                target=self._reap_forever, args=(reap_interval,),
+                name="conversation-reaper", daemon=True)
+            reaper.start()
         manager_logger.info(
-            f"ConversationManager Singleton initialized (id: {id(self)}).")
+            f"ConversationManager Singleton initialized (id: {id(self)}, shards: {len(self._shards)}).")
         self._initialized_flag = True
 
+    def _shard(self, conversation_id: str) -> _Shard:
+        return self._shards[hash(conversation_id) % len(self._shards)]
+
+    def __len__(self) -> int:
+        return sum(len(shard.conversations) for shard in self._shards)
+
+    def _new_history(self, conversation_id: str) -> ConversationHistory:
+        conversation = self.history_class(
+            busy_timeout=self.busy_timeout, context_policy=self.context_policy)
+        conversation.context_cache = self.context_cache
+        conversation.response_cache = self.response_cache
+        conversation.thinking_policy = self.thinking_policy
+        conversation.single_flight = self.single_flight
+        conversation.retriever = self.retriever
+        if self.store is not None:
+            conversation.attach_store(self.store, conversation_id)
+        return conversation
+
     def create_conversation(self) -> str:
         conversation_id = str(uuid.uuid4())
-        with self._lock:
-            self.conversations[conversation_id] = ConversationHistory()
+        if self.store is not None:
+            self.store.create(conversation_id)
+        shard = self._shard(conversation_id)
+        conversation = self._new_history(conversation_id)
+        with shard.lock:
+            shard.add(conversation_id, conversation)
+            self._evict_locked(shard, keep=conversation_id)
         manager_logger.info(f"Created conversation: {conversation_id}")
         return conversation_id
 
+    def _load_from_store(self, conversation_id: str) -> Optional[ConversationHistory]:
+        # created by another worker, or evicted from this one's cache
+        conversation = self._new_history(conversation_id)
+        if not conversation.sync():
+            return None
+        shard = self._shard(conversation_id)
+        with shard.lock:
+            existing = shard.conversations.get(conversation_id)
+            if existing:
+                return existing
+            shard.add(conversation_id, conversation)
+            self._evict_locked(shard, keep=conversation_id)
+        return conversation
+
+    def _forget(self, conversation_id: str, conversation: ConversationHistory):
+        shard = self._shard(conversation_id)
+        with shard.lock:
+            if shard.conversations.get(conversation_id) is conversation:
+                shard.remove(conversation_id)
+
     def get_conversation(self, conversation_id: str) -> Optional[ConversationHistory]:
-        with self._lock:
-            conversation = self.conversations.get(conversation_id)
+        shard = self._shard(conversation_id)
+        with shard.lock:
+            conversation = shard.conversations.get(conversation_id)
+            if conversation:
+                shard.conversations.move_to_end(conversation_id)
+                conversation.last_access = time.monotonic()
+        if self.store is not None:
+            if conversation is None:
+                conversation = self._load_from_store(conversation_id)
+            elif not conversation.refresh():
+                # deleted through another worker
+                self._forget(conversation_id, conversation)
+                conversation = None
         if conversation:
             manager_logger.debug(f"Retrieved conversation: {conversation_id}")
         else:
@@ -121,15 +782,121 @@ class ConversationManager(metaclass=SingletonBase):
         return conversation
 
     def delete_conversation(self, conversation_id: str) -> bool:
-        with self._lock:
-            if conversation_id in self.conversations:
-                del self.conversations[conversation_id]
-                manager_logger.info(f"Deleted conversation: {conversation_id}")
-                return True
+        deleted = self.store is not None and self.store.delete(conversation_id)
+        shard = self._shard(conversation_id)
+        with shard.lock:
+            if conversation_id in shard.conversations:
+                shard.remove(conversation_id)
+                deleted = True
+        if deleted:
+            manager_logger.info(f"Deleted conversation: {conversation_id}")
+            return True
         manager_logger.warning(
             f"Attempted to delete non-existent conversation: {conversation_id}")
         return False
 
+    def _evict_locked(self, shard: _Shard, keep: Optional[str] = None):
+        """
+        Evicts least recently used conversations until the shard is within its
+        share of the limits. Conversations with a turn in flight are skipped.
+        """
+        def over_budget() -> Optional[str]:
+            if self._shard_max_conversations and len(shard.conversations) > self._shard_max_conversations:
+                return "max_conversations"
+            if self._shard_max_bytes and shard.history_bytes > self._shard_max_bytes:
+                return "max_history_bytes"
+            return None
+
+        reason = over_budget()
+        if not reason:
+            return
+        for conversation_id in list(shard.conversations):
+            conversation = shard.conversations[conversation_id]
+            if conversation_id == keep or conversation.is_busy:
+                continue
+            shard.remove(conversation_id)
+            shard.evictions[reason] += 1
+            manager_logger.info(
+                f"Evicted conversation {conversation_id} ({reason}).")
+            reason = over_budget()
+            if not reason:
+                return
+
+    def evict_idle(self) -> int:
+        """
+        Drops conversations idle for longer than idle_ttl, returns how many.
+        Expired context cache entries go as well, their prefixes may never be
+        looked up again.
+        """
+        if self.context_cache is not None:
+            expired = self.context_cache.expire()
+            if expired:
+                manager_logger.info(f"Dropped {expired} expired context cache entries.")
+        if self.idle_ttl <= 0:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        evicted = 0
+        for shard in self._shards:
+            with shard.lock:
+                for conversation_id in list(shard.conversations):
+                    conversation = shard.conversations[conversation_id]
+                    if conversation.last_access > deadline:
+                        break  # LRU order, everything after is fresher
+                    if conversation.is_busy:
+                        continue
+                    shard.remove(conversation_id)
+                    shard.evictions["idle_ttl"] += 1
+                    evicted += 1
+        if evicted:
+            manager_logger.info(f"Evicted {evicted} idle conversations.")
+        if self.store is not None:
+            purged = self.store.delete_idle(self.idle_ttl)
+            if purged:
+                manager_logger.info(
+                    f"Purged {purged} idle conversations from the store.")
+        return evicted
+
+    def _reap_forever(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                manager_logger.error(
+                    f"Conversation reaper failed: {e}", exc_info=True)
+
+    def _after_turn(self, conversation_id: str):
+        shard = self._shard(conversation_id)
+        with shard.lock:
+            self._evict_locked(shard, keep=conversation_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Current footprint and eviction counters, summed over all shards.
+        """
+        evictions = dict.fromkeys(EVICTION_REASONS, 0)
+        conversations = 0
+        history_bytes = 0
+        for shard in self._shards:
+            with shard.lock:
+                conversations += len(shard.conversations)
+                history_bytes += shard.history_bytes
+                for reason, count in shard.evictions.items():
+                    evictions[reason] += count
+        return {
+            "store": type(self.store).__name__ if self.store is not None else None,
+            "conversations": conversations,
+            "history_bytes": history_bytes,
+            "evictions": evictions,
+            "limits": {
+                "max_conversations": self.max_conversations,
+                "max_history_bytes": self.max_history_bytes,
+                "per_shard_conversations": self._shard_max_conversations,
+                "per_shard_history_bytes": self._shard_max_bytes,
+                "idle_ttl": self.idle_ttl,
+            },
+        }
+
     def send_message_to_conversation(
         self,
         conversation_id: str,
@@ -137,6 +904,7 @@ class ConversationManager(metaclass=SingletonBase):
         client: genai.Client,
         message: str,
         generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
     ) -> Optional[str]:
         manager_logger.info(
             f"Attempting to send message to conversation '{conversation_id}' using model '{model_name}'.")
@@ -145,7 +913,7 @@ class ConversationManager(metaclass=SingletonBase):
         if not conversation:
             manager_logger.error(
                 f"Conversation with ID '{conversation_id}' not found for sending message.")
-            raise ValueError(
+            raise ConversationNotFoundError(
                 f"Conversation with ID '{conversation_id}' not found.")
 
         try:
@@ -154,18 +922,174 @@ class ConversationManager(metaclass=SingletonBase):
                 client=client,
                 message=message,
                 generation_config=generation_config,
+                use_cache=use_cache,
             )
             manager_logger.info(
                 f"Successfully sent message and received response for conversation '{conversation_id}'.")
+            self._after_turn(conversation_id)
             return response.text
+        except ConversationBusyError as be:
+            manager_logger.warning(
+                f"Conversation '{conversation_id}' is busy: {be}")
+            raise
+        except RateLimitError as rl:
+            manager_logger.warning(
+                f"Model call for conversation '{conversation_id}' throttled: {rl}")
+            raise
         except ValueError as ve:
             manager_logger.error(
                 f"ValueError during message sending for conversation '{conversation_id}': {ve}", exc_info=False)
             raise
         except Exception as e:
             manager_logger.error(
-                f"An unexpected error occurred while sending message to conversation '{
-                    conversation_id}': {e}",
+                f"An unexpected error occurred while sending message to conversation '{conversation_id}': {e}",
+                exc_info=True
+            )
+            raise
+
+    def send_message_stream_to_conversation(
+        self,
+        conversation_id: str,
+        model_name: str,
+        client: genai.Client,
+        message: str,
+        generation_config: Optional[types.GenerateContentConfig] = None,
+        use_cache: bool = True,
+    ) -> Iterator[str]:
+        """
+        Streaming counterpart of send_message_to_conversation, yields text chunks.
+        """
+        manager_logger.info(
+            f"Attempting to stream message to conversation '{conversation_id}' using model '{model_name}'.")
+
+        conversation = self.get_conversation(conversation_id)
+        if not conversation:
+            manager_logger.error(
+                f"Conversation with ID '{conversation_id}' not found for streaming message.")
+            raise ConversationNotFoundError(
+                f"Conversation with ID '{conversation_id}' not found.")
+
+        started_at = time.perf_counter()
+        first_token_at = None
+        stream = conversation.send_message_stream(
+            model_name=model_name,
+            client=client,
+            message=message,
+            generation_config=generation_config,
+            use_cache=use_cache,
+        )
+        try:
+            for chunk in stream:
+                if not chunk.text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    manager_logger.info(
+                        f"Time to first token for conversation '{conversation_id}': {first_token_at - started_at:.3f}s")
+                yield chunk.text
+            manager_logger.info(
+                f"Successfully streamed response for conversation '{conversation_id}' in {time.perf_counter() - started_at:.3f}s.")
+            self._after_turn(conversation_id)
+        except ConversationBusyError as be:
+            manager_logger.warning(
+                f"Conversation '{conversation_id}' is busy: {be}")
+            raise
+        except RateLimitError as rl:
+            manager_logger.warning(
+                f"Model call for conversation '{conversation_id}' throttled: {rl}")
+            raise
+        except GeneratorExit:
+            manager_logger.warning(
+                f"Stream for conversation '{conversation_id}' closed before completion, turn rolled back.")
+            raise
+        except Exception as e:
+            manager_logger.error(
+                f"An unexpected error occurred while streaming message to conversation '{conversation_id}': {e}",
                 exc_info=True
             )
             raise
+        finally:
+            # make sure an abandoned stream rolls back its user turn right away
+            stream.close()
+
+    def _fanout(self) -> ThreadPoolExecutor:
+        with self._fanout_lock:
+            if self._fanout_executor is None:
+                self._fanout_executor = ThreadPoolExecutor(
+                    max_workers=self.fanout_workers, thread_name_prefix="conversation-fanout")
+            return self._fanout_executor
+
+    def send_messages(
+        self,
+        items: Iterable[Tuple],
+        model_name: str,
+        client: genai.Client,
+        max_concurrency: Optional[int] = None,
+        use_cache: bool = True,
+        router=None,
+    ) -> Iterator[BulkResult]:
+        """
+        Sends many (conversation_id, message[, generation_config]) items concurrently
+        on the shared fan-out executor and yields a BulkResult per item as it completes.
+        A failing item is reported in its result and never aborts the others.
+        Args:
+            max_concurrency: conversations in flight for this call, at most fanout_workers.
+            router: optional ModelRouter, every item then goes through router.call()
+                like a single message, with its own failover and latency report,
+                and model_name and client are ignored.
+        Closing the iterator early stops items that have not started yet.
+        """
+        groups = group_bulk_messages(items)
+        limit = min(max_concurrency or self.fanout_workers, self.fanout_workers)
+        remaining = sum(len(group) for group in groups.values())
+        results: "queue.Queue[Optional[BulkResult]]" = queue.Queue()
+        stopped = threading.Event()
+        group_done = None  # marks that a conversation finished and a slot is free
+
+        def run_group(group: List[Tuple[int, BulkMessage]]):
+            try:
+                for index, item in group:
+                    if stopped.is_set():
+                        return
+                    send = partial(
+                        self.send_message_to_conversation,
+                        conversation_id=item.conversation_id,
+                        message=item.message,
+                        generation_config=item.generation_config,
+                        use_cache=use_cache,
+                    )
+                    routing = RoutingDecision() if router is not None else None
+                    try:
+                        if router is not None:
+                            response = router.call(
+                                lambda route: send(model_name=route.model, client=route.client), routing)
+                        else:
+                            response = send(model_name=model_name, client=client)
+                        results.put(BulkResult(
+                            index, item.conversation_id, response=response,
+                            routing=routing.to_dict() if routing else None))
+                    except Exception as e:
+                        results.put(BulkResult(
+                            index, item.conversation_id, error=e,
+                            routing=routing.to_dict() if routing else None))
+            finally:
+                results.put(group_done)
+
+        executor = self._fanout()
+        pending_groups = iter(groups.values())
+        # the workers see the caller's request deadline
+        context = contextvars.copy_context()
+        for group in itertools.islice(pending_groups, limit):
+            executor.submit(context.copy().run, run_group, group)
+        try:
+            while remaining:
+                result = results.get()
+                if result is group_done:
+                    group = next(pending_groups, None)
+                    if group is not None:
+                        executor.submit(context.copy().run, run_group, group)
+                    continue
+                remaining -= 1
+                yield result
+        finally:
+            stopped.set()
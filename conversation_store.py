@@ -0,0 +1,150 @@
+"""
+Conversation backends that several worker processes on one host can share.
+
+ConversationManager keeps a per-process cache of ConversationHistory objects;
+a store makes the turns durable and visible to every worker, so a conversation
+created on one gunicorn worker can be continued on another.
+"""
+import abc
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from conversation import ConversationBusyError
+
+Turn = Tuple[str, str]  # (role, text)
+
+
+class ConversationStore(abc.ABC):
+    """
+    Interface of a shared conversation backend. Turns are addressed by their
+    position (seq) in the conversation, appends and loads only touch the
+    turns involved, never the whole history.
+    """
+
+    @abc.abstractmethod
+    def create(self, conversation_id: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, conversation_id: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def load_turns(self, conversation_id: str, since: int = 0) -> Optional[List[Turn]]:
+        """
+        Returns the turns from position `since` on, or None if the conversation does not exist.
+        """
+
+    @abc.abstractmethod
+    def append_turns(self, conversation_id: str, seq: int, turns: List[Turn]) -> None:
+        """
+        Appends turns starting at position `seq`. Raises ConversationBusyError if
+        another worker already wrote that position.
+        """
+
+    @abc.abstractmethod
+    def delete_idle(self, idle_ttl: float) -> int:
+        """
+        Deletes conversations without new turns for `idle_ttl` seconds, returns how many.
+        """
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    ConversationStore on a local SQLite file in WAL mode. Every thread (and
+    every forked worker) opens its own connection.
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS turns (
+                    conversation_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (conversation_id, seq)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS conversations_updated_at
+                    ON conversations (updated_at);
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # connections must not cross a fork, reopen in the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, conversation_id: str) -> None:
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO conversations (id, created_at, updated_at) VALUES (?, ?, ?)",
+            (conversation_id, now, now))
+
+    def delete(self, conversation_id: str) -> bool:
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            conn.execute(
+                "DELETE FROM turns WHERE conversation_id = ?", (conversation_id,))
+        return cursor.rowcount > 0
+
+    def load_turns(self, conversation_id: str, since: int = 0) -> Optional[List[Turn]]:
+        conn = self._connection()
+        exists = conn.execute(
+            "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if not exists:
+            return None
+        return conn.execute(
+            "SELECT role, text FROM turns WHERE conversation_id = ? AND seq >= ? ORDER BY seq",
+            (conversation_id, since)).fetchall()
+
+    def append_turns(self, conversation_id: str, seq: int, turns: List[Turn]) -> None:
+        conn = self._connection()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                updated = conn.execute(
+                    "UPDATE conversations SET updated_at = ? WHERE id = ?",
+                    (time.time(), conversation_id))
+                if updated.rowcount == 0:
+                    raise ValueError(
+                        f"Conversation with ID '{conversation_id}' not found.")
+                conn.executemany(
+                    "INSERT INTO turns (conversation_id, seq, role, text) VALUES (?, ?, ?, ?)",
+                    [(conversation_id, seq + i, role, text)
+                     for i, (role, text) in enumerate(turns)])
+        except sqlite3.IntegrityError:
+            raise ConversationBusyError(
+                "Conversation was updated by another worker, retry later.") from None
+
+    def delete_idle(self, idle_ttl: float) -> int:
+        conn = self._connection()
+        deadline = time.time() - idle_ttl
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM turns WHERE conversation_id IN "
+                "(SELECT id FROM conversations WHERE updated_at < ?)", (deadline,))
+            cursor = conn.execute(
+                "DELETE FROM conversations WHERE updated_at < ?", (deadline,))
+        return cursor.rowcount
@@ -0,0 +1,136 @@
+"""
+End-to-end request deadlines.
+
+The HTTP layer opens a deadline per request, from the X-Request-Timeout header
+or the route's default (see config.deadline_options), with deadline_scope().
+Everything below reads it from a context variable instead of an extra argument
+on every call:
+  * ConversationHistory sends the remaining time as the genai call's
+    http_options timeout, checks it between streamed chunks and turns
+    failures past the deadline into DeadlineExceeded,
+  * RateLimiter never queues or backs off past it and does not retry,
+  * the asyncio path cancels the upstream call when it expires.
+A turn that runs out of time or whose client went away is rolled back like
+any failed turn, and counted in model_calls_cancelled_total.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from google.genai import types
+
+import metrics
+
+cancelled_calls = metrics.registry.counter(
+    "model_calls_cancelled_total",
+    "Turns given up on, by reason: deadline exceeded or client disconnected.", ("reason",))
+cancelled_seconds = metrics.registry.counter(
+    "model_calls_cancelled_seconds_total",
+    "Time spent on turns that were given up on before they could finish.", ("reason",))
+
+
+class DeadlineExceeded(RuntimeError):
+    """
+    Raised when a request runs out of time. Not a TimeoutError on purpose,
+    retrying or failing over cannot help once the deadline has passed.
+    """
+
+
+class Deadline:
+    __slots__ = ("timeout", "expires_at")
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded(f"Request deadline of {self.timeout:g}s exceeded.")
+
+
+_current: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Makes `deadline` the current one for the block. Always reset afterwards,
+    worker threads are reused across requests.
+    """
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def parse_timeout(header: Optional[str], default: float, maximum: float = 0) -> Optional[Deadline]:
+    """
+    Deadline for a request: the header's seconds if given, the route default
+    otherwise, capped at `maximum`. None if neither sets one. Raises
+    ValueError on a malformed header.
+    """
+    timeout = default
+    if header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            raise ValueError("X-Request-Timeout must be a number of seconds.")
+        if timeout <= 0:
+            raise ValueError("X-Request-Timeout must be positive.")
+    if maximum > 0:
+        timeout = min(timeout, maximum) if timeout > 0 else maximum
+    return Deadline(timeout) if timeout > 0 else None
+
+
+def with_timeout(config: Optional[types.GenerateContentConfig], deadline: Optional[Deadline]) -> Optional[types.GenerateContentConfig]:
+    """
+    The config to send with the deadline's remaining time as genai timeout.
+    """
+    if deadline is None:
+        return config
+    deadline.check()
+    # genai takes milliseconds, anything below one second would be all overhead
+    timeout = max(1000, int(deadline.remaining() * 1000))
+    if config is None:
+        return types.GenerateContentConfig(http_options=types.HttpOptions(timeout=timeout))
+    http_options = config.http_options.model_copy(update={"timeout": timeout}) \
+        if config.http_options is not None else types.HttpOptions(timeout=timeout)
+    return config.model_copy(update={"http_options": http_options})
+
+
+def record_cancelled(error: BaseException, started_at: float) -> Optional[str]:
+    """
+    Counts a turn that was given up on, returns the reason or None for
+    ordinary failures. GeneratorExit and CancelledError mean the client went
+    away, unless the deadline had passed by then.
+    """
+    import asyncio
+
+    deadline = _current.get()
+    if isinstance(error, DeadlineExceeded) or (deadline is not None and deadline.expired):
+        reason = "deadline"
+    elif isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+        reason = "disconnect"
+    else:
+        return None
+    cancelled_calls.labels(reason).inc()
+    cancelled_seconds.labels(reason).inc(time.perf_counter() - started_at)
+    return reason
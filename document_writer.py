@@ -0,0 +1,211 @@
+"""
+Buffered writes of documents into the BigQuery documents table.
+
+POST /documents runs a DML INSERT job per document, a few documents per
+second at best and subject to DML quotas. DocumentWriter collects rows from
+any number of requests and writes them in one go once `max_rows` are
+buffered or the oldest row waited `max_delay` seconds, so a single job or
+API call carries thousands of rows. Every row gets a Future that resolves
+to its own outcome. The ids of buffered and in-flight rows are not in the
+table yet, so the writer refuses a second row with one of them itself.
+
+Two ways to write a batch:
+  * "load": a load job from JSON, free and all-or-nothing, but limited to
+    1,500 jobs per table and day, so keep max_delay in seconds, not less.
+    A job failed by invalid rows is split in halves and retried, so only
+    the invalid rows fail, not those of other requests in the same batch.
+  * "stream": streaming inserts (insertAll), rows are queryable within
+    seconds and fail one by one. Streamed rows sit in the streaming buffer
+    for up to ~90 minutes, during which UPDATE and DELETE (PUT and DELETE
+    /documents/<idx>) cannot touch them.
+"""
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set
+
+import metrics
+
+writer_logger = logging.getLogger(__name__)
+
+written_rows = metrics.registry.counter(
+    "documents_written_total", "Documents written by the batch writer, by outcome.", ("outcome",))
+flush_seconds = metrics.registry.histogram(
+    "document_flush_duration_seconds", "Time to write one batch of documents.", ("mode",))
+flush_rows = metrics.registry.histogram(
+    "document_flush_rows", "Documents per written batch.", ("mode",),
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000))
+
+DOCUMENT_FIELDS = ("idx", "title", "type", "publish_time", "author", "url", "text")
+WRITE_MODES = ("load", "stream")
+
+
+class RowResult(NamedTuple):
+    ok: bool
+    error: Optional[str] = None
+    # the idx is already waiting to be written
+    conflict: bool = False
+
+
+class DocumentWriter:
+    def __init__(self, client, table_id: str, mode: str = "load", max_rows: int = 10000,
+                 max_delay: float = 5.0, max_buffered: int = 100000):
+        """
+        Args:
+            client: google.cloud.bigquery.Client, or fake_bigquery.FakeBigQueryClient.
+            table_id: project.dataset.table of the documents table.
+            mode: "load" or "stream", see the module docstring.
+            max_rows: rows per write, a full buffer is written right away.
+            max_delay: seconds the oldest buffered row waits for more rows.
+            max_buffered: rows waiting to be written before submit() raises BufferError.
+        """
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode '{mode}', expected one of {WRITE_MODES}.")
+        self.client = client
+        self.table_id = table_id
+        self.mode = mode
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_buffered = max_buffered
+        self._rows: List[Dict[str, Any]] = []
+        self._futures: List[concurrent.futures.Future] = []
+        # idx of every buffered or in-flight row
+        self._pending: Set[str] = set()
+        self._oldest: Optional[float] = None
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = dict.fromkeys(("flushes", "written", "failed", "rejected", "conflicts", "splits"), 0)
+
+    def __contains__(self, idx: str) -> bool:
+        with self._condition:
+            return idx in self._pending
+
+    def submit(self, rows: Sequence[Dict[str, Any]]) -> List[concurrent.futures.Future]:
+        """
+        Buffers validated rows, returns a Future of a RowResult per row. Rows
+        whose idx is already buffered or in flight are resolved right away
+        with a conflict.
+        """
+        futures = [concurrent.futures.Future() for _ in rows]
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("DocumentWriter is closed.")
+            if len(self._rows) + len(rows) > self.max_buffered:
+                self._stats["rejected"] += len(rows)
+                raise BufferError(f"{len(self._rows)} documents are waiting to be written, retry later.")
+            buffered = len(self._rows)
+            for row, future in zip(rows, futures):
+                idx = row.get("idx")
+                if idx in self._pending:
+                    self._stats["conflicts"] += 1
+                    future.set_result(RowResult(False, f"Document '{idx}' is already being written.", True))
+                    continue
+                if idx:
+                    self._pending.add(idx)
+                self._rows.append({field: row.get(field) for field in DOCUMENT_FIELDS})
+                self._futures.append(future)
+            if len(self._rows) == buffered:
+                return futures
+            if not buffered:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="document-writer", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return futures
+
+    def _take(self):
+        # caller holds self._condition
+        rows, futures = self._rows[:self.max_rows], self._futures[:self.max_rows]
+        del self._rows[:self.max_rows], self._futures[:self.max_rows]
+        self._oldest = time.monotonic() if self._rows else None
+        return rows, futures
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._rows and (self._closed or len(self._rows) >= self.max_rows or
+                                       time.monotonic() - self._oldest >= self.max_delay):
+                        break
+                    if self._closed:
+                        return
+                    timeout = None if not self._rows else self.max_delay - (time.monotonic() - self._oldest)
+                    self._condition.wait(timeout)
+                rows, futures = self._take()
+            self._flush(rows, futures)
+
+    def _flush(self, rows: List[Dict[str, Any]], futures: List[concurrent.futures.Future]):
+        started_at = time.perf_counter()
+        try:
+            results = self._load(rows) if self.mode == "load" else self._stream(rows)
+        except Exception as e:
+            writer_logger.error(f"Writing {len(rows)} documents failed: {e}")
+            results = [RowResult(False, str(e))] * len(rows)
+        flush_seconds.labels(self.mode).observe(time.perf_counter() - started_at)
+        flush_rows.labels(self.mode).observe(len(rows))
+        failed = sum(not result.ok for result in results)
+        with self._condition:
+            # written rows are in the table now, failed ones may be sent again
+            self._pending.difference_update(row["idx"] for row in rows)
+            self._stats["flushes"] += 1
+            self._stats["written"] += len(rows) - failed
+            self._stats["failed"] += failed
+        written_rows.labels("written").inc(len(rows) - failed)
+        written_rows.labels("failed").inc(failed)
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def _load(self, rows: List[Dict[str, Any]]) -> List[RowResult]:
+        from google.cloud import bigquery
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+        job = None
+        try:
+            job = self.client.load_table_from_json(rows, self.table_id, job_config=job_config)
+            job.result()
+        except Exception as e:
+            invalid = job is not None and any(
+                error.get("reason") == "invalid" for error in job.errors or ())
+            if not invalid or len(rows) == 1:
+                writer_logger.error(f"Loading {len(rows)} documents failed: {e}")
+                return [RowResult(False, str(e))] * len(rows)
+            # the batch holds rows of many requests, halve it until only the
+            # invalid rows fail, a few more jobs instead of one per row
+            with self._condition:
+                self._stats["splits"] += 1
+            middle = len(rows) // 2
+            return self._load(rows[:middle]) + self._load(rows[middle:])
+        return [RowResult(True)] * len(rows)
+
+    def _stream(self, rows: List[Dict[str, Any]]) -> List[RowResult]:
+        # idx doubles as insertId, a retried batch is deduplicated on a best effort basis
+        errors = self.client.insert_rows_json(
+            self.table_id, rows, row_ids=[row["idx"] for row in rows], skip_invalid_rows=True)
+        results = [RowResult(True)] * len(rows)
+        for error in errors:
+            results[error["index"]] = RowResult(False, json.dumps(error["errors"], ensure_ascii=False))
+        return results
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Writes what is buffered and stops the writer thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update(mode=self.mode, buffered=len(self._rows))
+        return stats
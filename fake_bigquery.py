@@ -0,0 +1,108 @@
+"""
+In-memory stand-in for the parts of google.cloud.bigquery.Client the
+retriever uses, for tests and local runs without a project.
+
+FakeBigQueryClient holds one documents table as a dict keyed by idx and
+understands the queries of retrieval.BigQueryDocumentSource (the fingerprint
+scan and the fetch of rows by id), which bigquery_app also uses to look up
+existing ids. It takes streaming inserts and JSON load jobs the way
+document_writer.DocumentWriter sends them. Anything else raises
+NotImplementedError.
+"""
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+class FakeLoadError(Exception):
+    pass
+
+
+class FakeQueryJob:
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self._rows = rows
+        self.errors = None
+
+    def result(self) -> List[Dict[str, Any]]:
+        return self._rows
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._rows)
+
+
+class FakeLoadJob:
+    def __init__(self, errors: Optional[List[Dict[str, Any]]] = None):
+        self.errors = errors or None
+
+    def result(self) -> "FakeLoadJob":
+        if self.errors:
+            raise FakeLoadError(f"Load job failed: {self.errors}")
+        return self
+
+
+def fingerprint(row: Dict[str, Any]) -> int:
+    """
+    Stands in for FARM_FINGERPRINT over title, url and text.
+    """
+    return zlib.crc32("\x1f".join(str(row.get(column) or "") for column in ("title", "url", "text")).encode("utf-8"))
+
+
+class FakeBigQueryClient:
+    def __init__(self, rows: Iterable[Dict[str, Any]] = (), columns: Iterable[str] = (
+            "idx", "title", "type", "publish_time", "author", "url", "text")):
+        self.rows: Dict[str, Dict[str, Any]] = {row["idx"]: dict(row) for row in rows}
+        self.columns = set(columns)
+        self.queries: List[str] = []
+        self.load_jobs = 0
+        self.insert_calls = 0
+
+    def _row_error(self, row: Dict[str, Any]) -> Optional[str]:
+        unknown = set(row) - self.columns
+        if unknown:
+            return f"no such field: {sorted(unknown)[0]}"
+        if not row.get("idx"):
+            return "missing required field: idx"
+        return None
+
+    def insert_rows_json(self, table, json_rows: List[Dict[str, Any]], row_ids=None,
+                         skip_invalid_rows: Optional[bool] = None, **kwargs) -> List[Dict[str, Any]]:
+        self.insert_calls += 1
+        errors = [{"index": i, "errors": [{"reason": "invalid", "message": message}]}
+                  for i, message in enumerate(map(self._row_error, json_rows)) if message]
+        if errors and not skip_invalid_rows:
+            return errors
+        invalid = {error["index"] for error in errors}
+        for i, row in enumerate(json_rows):
+            if i not in invalid:
+                self.rows[row["idx"]] = dict(row)
+        return errors
+
+    def load_table_from_json(self, json_rows: List[Dict[str, Any]], destination, job_config=None) -> FakeLoadJob:
+        self.load_jobs += 1
+        errors = [{"reason": "invalid", "message": message}
+                  for message in map(self._row_error, json_rows) if message]
+        if not errors:
+            for row in json_rows:
+                self.rows[row["idx"]] = dict(row)
+        return FakeLoadJob(errors)
+
+    def upsert(self, **row):
+        self.rows[row["idx"]] = row
+
+    def delete(self, idx: str):
+        self.rows.pop(idx, None)
+
+    def query(self, query: str, job_config=None) -> FakeQueryJob:
+        self.queries.append(query)
+        if "FARM_FINGERPRINT" in query:
+            return FakeQueryJob([{"idx": idx, "fingerprint": fingerprint(row)} for idx, row in self.rows.items()])
+        if "IN UNNEST(@ids)" in query:
+            ids = _parameter(job_config, "ids")
+            return FakeQueryJob([dict(self.rows[idx]) for idx in ids if idx in self.rows])
+        raise NotImplementedError(f"FakeBigQueryClient does not understand: {query}")
+
+
+def _parameter(job_config, name: str) -> Optional[Any]:
+    for parameter in getattr(job_config, "query_parameters", None) or ():
+        if parameter.name == name:
+            return getattr(parameter, "values", None) if hasattr(parameter, "values") else parameter.value
+    return None
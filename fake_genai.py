@@ -0,0 +1,391 @@
+"""
+Local stand-in for the parts of genai.Client this repo uses, so the apps,
+tests and benchmarks can run without network access or credentials.
+
+FakeModels can simulate a realistic backend for load tests: latency drawn
+from a distribution, streamed chunks at a fixed cadence and injected
+APIErrors (429/503/...) at a given rate. A config's http_options timeout is
+honoured like the SDK's read timeout, and calls abandoned midway (stream
+closed, task cancelled) are counted as cancelled.
+"""
+import asyncio
+import datetime
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+import httpx
+from google.genai import errors, types
+
+from context_policy import estimate_content_tokens, estimate_tokens
+
+
+def make_response(text: str, usage_metadata=None) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse(
+        usage_metadata=usage_metadata,
+        candidates=[
+            types.Candidate(
+                content=types.Content(
+                    role="model", parts=[types.Part.from_text(text=text)]),
+                finish_reason=types.FinishReason.STOP,
+            )
+        ],
+    )
+
+
+def _last_user_text(contents) -> str:
+    if not contents:
+        return ""
+    last = contents[-1]
+    if isinstance(last, str):
+        return last
+    return " ".join(part.text for part in (last.parts or []) if part.text)
+
+
+class FakeCaches:
+    """
+    In-memory stand-in for client.caches (explicit context caching).
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, types.CachedContent] = {}
+        self.token_counts: Dict[str, int] = {}
+        self.call_counts = dict.fromkeys(("create", "update", "delete"), 0)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _expire_time(ttl: str) -> datetime.datetime:
+        seconds = float(ttl.rstrip("s"))
+        return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=seconds)
+
+    def create(self, model: str, config: types.CreateCachedContentConfig) -> types.CachedContent:
+        token_count = sum(estimate_content_tokens(content)
+                          for content in (config.contents or []))
+        for part in (config.system_instruction or []):
+            token_count += estimate_tokens(part.text or "")
+        with self._lock:
+            self.call_counts["create"] += 1
+            name = f"cachedContents/{next(self._ids)}"
+            cached = types.CachedContent(
+                name=name,
+                model=model,
+                expire_time=self._expire_time(config.ttl or "3600s"),
+                usage_metadata=types.CachedContentUsageMetadata(
+                    total_token_count=token_count),
+            )
+            self.entries[name] = cached
+            self.token_counts[name] = token_count
+        return cached
+
+    def get(self, name: str) -> types.CachedContent:
+        cached = self.entries.get(name)
+        if cached is None or cached.expire_time <= datetime.datetime.now(datetime.timezone.utc):
+            raise ValueError(f"Cached content {name} not found or expired.")
+        return cached
+
+    def update(self, name: str, config: types.UpdateCachedContentConfig) -> types.CachedContent:
+        with self._lock:
+            self.call_counts["update"] += 1
+            cached = self.get(name)
+            cached.expire_time = self._expire_time(config.ttl)
+        return cached
+
+    def delete(self, name: str):
+        with self._lock:
+            self.call_counts["delete"] += 1
+            self.entries.pop(name, None)
+
+
+def fixed(seconds: float) -> Callable[[random.Random], float]:
+    return lambda rng: seconds
+
+
+def uniform(low: float, high: float) -> Callable[[random.Random], float]:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median: float, sigma: float = 0.5) -> Callable[[random.Random], float]:
+    """
+    Long-tailed like real model latency, `median` seconds at the 50th percentile.
+    """
+    mu = math.log(median) if median > 0 else 0.0
+    return lambda rng: rng.lognormvariate(mu, sigma) if median > 0 else 0.0
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    "2" or "fixed:2", "uniform:0.5,3", "lognormal:1.5,0.6" (median, sigma).
+    """
+    kind, _, args = spec.partition(":")
+    if not args:
+        kind, args = "fixed", kind
+    values = [float(value) for value in args.split(",")]
+    distributions = {"fixed": fixed, "uniform": uniform, "lognormal": lognormal}
+    if kind not in distributions:
+        raise ValueError(f"Unknown latency distribution '{kind}'.")
+    return distributions[kind](*values)
+
+
+def simulated_error(code: int) -> errors.APIError:
+    cls = errors.ClientError if code < 500 else errors.ServerError
+    return cls(code, {"error": {"code": code, "message": "Simulated failure.", "status": "SIMULATED"}})
+
+
+class FakeModels:
+    def __init__(self, latency: Union[float, Callable[[random.Random], float]] = 0.0, chunk_count: int = 3,
+                 caches: FakeCaches = None, chunk_interval: Optional[float] = None,
+                 error_rate: float = 0.0, error_codes: Sequence[int] = (503,), seed: Optional[int] = None):
+        """
+        Args:
+            latency: seconds per call, or a distribution such as lognormal(1.5)
+                that is sampled per call.
+            chunk_count: chunks a streamed answer is split into.
+            chunk_interval: seconds between streamed chunks after the first one.
+                None spreads the sampled latency evenly over the chunks.
+            error_rate: share of calls that fail with an APIError instead of answering.
+            error_codes: HTTP codes of the injected errors, picked at random.
+            seed: makes latency samples and injected errors reproducible.
+        """
+        self.latency = latency
+        self.chunk_count = chunk_count
+        self.chunk_interval = chunk_interval
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.caches = caches
+        self.call_count = 0
+        self.error_count = 0
+        self.cancelled_count = 0
+        self.last_request = None
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _sample_latency(self) -> float:
+        if not callable(self.latency):
+            return self.latency
+        with self._rng_lock:
+            return max(0.0, self.latency(self._rng))
+
+    def _injected_error(self) -> Optional[errors.APIError]:
+        if self.error_rate <= 0:
+            return None
+        with self._rng_lock:
+            if self._rng.random() >= self.error_rate:
+                return None
+            code = self._rng.choice(self.error_codes)
+        self.error_count += 1
+        return simulated_error(code)
+
+    @staticmethod
+    def _read_timeout(config) -> Optional[float]:
+        http_options = getattr(config, "http_options", None)
+        if http_options is None or not http_options.timeout:
+            return None
+        return http_options.timeout / 1000
+
+    def _wait(self, seconds: float, config):
+        timeout = self._read_timeout(config)
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise httpx.ReadTimeout("Simulated read timeout.")
+        time.sleep(seconds)
+
+    async def _async_wait(self, seconds: float, config):
+        timeout = self._read_timeout(config)
+        try:
+            if timeout is not None and seconds > timeout:
+                await asyncio.sleep(timeout)
+                raise httpx.ReadTimeout("Simulated read timeout.")
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            self.cancelled_count += 1
+            raise
+
+    def _chunk_delays(self, count: int) -> List[float]:
+        latency = self._sample_latency()
+        if self.chunk_interval is None:
+            return [latency / count] * count
+        # time to first token, then a steady cadence
+        return [latency] + [self.chunk_interval] * (count - 1)
+
+    def _answer(self, contents, config=None) -> str:
+        self.call_count += 1
+        self.last_request = (list(contents), config)
+        if config is not None and config.cached_content:
+            # the real API rejects requests that repeat what the cache holds
+            if config.system_instruction or config.tools or config.tool_config:
+                raise ValueError(
+                    "system_instruction, tools and tool_config must be part of the cached content.")
+            if self.caches is not None:
+                self.caches.get(config.cached_content)
+        return f"echo: {_last_user_text(contents)}"
+
+    def _usage(self, contents, config=None) -> types.GenerateContentResponseUsageMetadata:
+        cached_tokens = 0
+        if config is not None and config.cached_content and self.caches is not None:
+            cached_tokens = self.caches.token_counts.get(config.cached_content, 0)
+        prompt_tokens = sum(estimate_content_tokens(content) for content in contents
+                            if isinstance(content, types.Content))
+        return types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens + cached_tokens,
+            cached_content_token_count=cached_tokens or None,
+        )
+
+    def _chunks(self, text: str) -> List[str]:
+        size = max(1, -(-len(text) // self.chunk_count))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def generate_content(self, model: str, contents: list, config=None) -> types.GenerateContentResponse:
+        self._wait(self._sample_latency(), config)
+        error = self._injected_error()
+        if error is not None:
+            raise error
+        return make_response(self._answer(contents, config), self._usage(contents, config))
+
+    def generate_content_stream(self, model: str, contents: list, config=None) -> Iterator[types.GenerateContentResponse]:
+        chunks = self._chunks(self._answer(contents, config))
+        usage = self._usage(contents, config)
+        delays = self._chunk_delays(len(chunks))
+        error = self._injected_error()
+        try:
+            for chunk, delay in zip(chunks, delays):
+                self._wait(delay, config)
+                if error is not None:
+                    # fails before the first chunk, like a rejected request
+                    raise error
+                yield make_response(chunk, usage)
+        except GeneratorExit:
+            self.cancelled_count += 1
+            raise
+
+
+def _local_path(uri: str) -> str:
+    return uri[len("file://"):] if uri.startswith("file://") else uri
+
+
+class FakeBatches:
+    """
+    In-memory stand-in for client.batches reading and writing JSONL on the
+    local filesystem instead of Cloud Storage. A job finishes on the
+    `polls_to_finish`-th get() and writes its predictions next to `dest`.
+    """
+
+    def __init__(self, models: FakeModels, polls_to_finish: int = 1):
+        self.models = models
+        self.polls_to_finish = polls_to_finish
+        # key -> number of times its line still fails before it succeeds
+        self.fail_keys: Dict[str, int] = {}
+        # number of upcoming jobs that fail as a whole
+        self.fail_jobs = 0
+        self.jobs: Dict[str, types.BatchJob] = {}
+        self._polls: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, model: str, src: str, config: Optional[types.CreateBatchJobConfig] = None) -> types.BatchJob:
+        with self._lock:
+            name = f"batchPredictionJobs/{next(self._ids)}"
+            job = types.BatchJob(
+                name=name,
+                display_name=config.display_name if config else None,
+                model=model,
+                state=types.JobState.JOB_STATE_PENDING,
+                src=types.BatchJobSource(format="jsonl", gcs_uri=[src]),
+                dest=types.BatchJobDestination(
+                    format="jsonl", gcs_uri=config.dest if config else None),
+            )
+            self.jobs[name] = job
+            self._polls[name] = 0
+        return job
+
+    def list(self, config: Optional[types.ListBatchJobsConfig] = None) -> List[types.BatchJob]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def get(self, name: str) -> types.BatchJob:
+        with self._lock:
+            job = self.jobs[name]
+            if job.state == types.JobState.JOB_STATE_PENDING:
+                self._polls[name] += 1
+                if self._polls[name] >= self.polls_to_finish:
+                    self._run(job)
+        return job
+
+    def _run(self, job: types.BatchJob):
+        if self.fail_jobs > 0:
+            self.fail_jobs -= 1
+            job.state = types.JobState.JOB_STATE_FAILED
+            job.error = types.JobError(code=13, message="Simulated job failure.")
+            return
+
+        output_dir = _local_path(job.dest.gcs_uri)
+        os.makedirs(output_dir, exist_ok=True)
+        with open(_local_path(job.src.gcs_uri[0]), encoding="utf-8") as src, \
+                open(os.path.join(output_dir, "predictions.jsonl"), "w", encoding="utf-8") as out:
+            for line in src:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                key = record.get("key")
+                if self.fail_keys.get(key, 0) > 0:
+                    self.fail_keys[key] -= 1
+                    record["status"] = "Simulated line failure."
+                else:
+                    contents = [types.Content.model_validate(content)
+                                for content in record["request"]["contents"]]
+                    record["status"] = ""
+                    record["response"] = make_response(
+                        self.models._answer(contents)).model_dump(mode="json", by_alias=True, exclude_none=True)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        job.state = types.JobState.JOB_STATE_SUCCEEDED
+        job.output_info = types.BatchJobOutputInfo(gcs_output_directory=job.dest.gcs_uri)
+
+
+class FakeAsyncModels(FakeModels):
+    async def generate_content(self, model: str, contents: list, config=None) -> types.GenerateContentResponse:
+        await self._async_wait(self._sample_latency(), config)
+        error = self._injected_error()
+        if error is not None:
+            raise error
+        return make_response(self._answer(contents, config), self._usage(contents, config))
+
+    async def generate_content_stream(self, model: str, contents: list, config=None) -> AsyncIterator[types.GenerateContentResponse]:
+        chunks = self._chunks(self._answer(contents, config))
+        usage = self._usage(contents, config)
+        delays = self._chunk_delays(len(chunks))
+        error = self._injected_error()
+
+        async def iterate():
+            try:
+                for chunk, delay in zip(chunks, delays):
+                    await self._async_wait(delay, config)
+                    if error is not None:
+                        raise error
+                    yield make_response(chunk, usage)
+            except GeneratorExit:
+                self.cancelled_count += 1
+                raise
+
+        return iterate()
+
+
+class FakeAsyncClient:
+    def __init__(self, latency: float = 0.0, caches: FakeCaches = None, **model_options):
+        self.models = FakeAsyncModels(latency=latency, caches=caches, **model_options)
+
+
+class FakeClient:
+    """
+    Keyword arguments beyond `latency` (chunk_interval, error_rate, ...) go to FakeModels.
+    """
+
+    def __init__(self, latency: Union[float, Callable[[random.Random], float]] = 0.0, **model_options):
+        self.caches = FakeCaches()
+        self.models = FakeModels(latency=latency, caches=self.caches, **model_options)
+        self.batches = FakeBatches(self.models)
+        self.aio = FakeAsyncClient(latency=latency, caches=self.caches, **model_options)
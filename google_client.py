@@ -1,49 +1,185 @@
+"""
+Process-wide Google clients, built on first use instead of at import time.
+
+`client` and `bigquery_client` are stand-ins that build the real client the
+first time an attribute is used, so the chat app never loads or authenticates
+BigQuery and vice versa. Each process builds its own clients: after a fork the
+child drops what it inherited and builds fresh ones with their own
+connection pool. warm_up() builds the clients and opens the first connection
+before a worker takes traffic.
+"""
+import functools
+import logging
 import os
+import threading
+from typing import Any, Callable, Dict, Optional
 
-from google import genai
-from google.cloud import bigquery
-from google.genai import types
+from config import http_pool_options, rate_limiter_options
 
 GOOGLE_PROJECT_NAME = os.getenv("GOOGLE_PROJECT_NAME")
 GOOGLE_REGION = os.getenv("GOOGLE_REGION")
 
-print(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
+client_logger = logging.getLogger(__name__)
 
-client = genai.Client(
-    vertexai=True,
-    project=GOOGLE_PROJECT_NAME,
-    location=GOOGLE_REGION,
-)
 
-bigquery_client = bigquery.Client(project=GOOGLE_PROJECT_NAME)
+class _PerProcess:
+    """
+    Holds a value built by `factory` on first use, once per process.
+    """
 
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
 
-# class Rensponse():
-#     text = "hello world"
+    def _after_fork(self):
+        # the inherited sockets belong to the parent, closing them here would
+        # shut down the parent's TLS sessions, so just let go of them
+        self._value = None
+        self._lock = threading.Lock()
 
-#     def __init__(self):
-#         pass
+    def get(self) -> Any:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
 
+    @property
+    def built(self) -> bool:
+        return self._value is not None
 
-# class Model:
-#     def __init__(self):
-#         pass
 
-#     def generate_content(self, model: str, contents: list, config):
-#         return Rensponse()
+class LazyClient:
+    """
+    Forwards attribute access to the client of the current process.
+    """
 
+    def __init__(self, holder: _PerProcess):
+        self._holder = holder
 
-# class Client:
-#     models = Model()
+    def __getattr__(self, name: str):
+        return getattr(self._holder.get(), name)
 
-#     def __init__(self):
-#         pass
 
+def _build_genai_client(location: Optional[str] = None):
+    import httpx
+    from google import genai
+    from google.genai import types
+    from metrics import InstrumentedClient
+    from rate_limiter import RateLimitedClient, RateLimiter
 
-# client = Client()
+    pool = http_pool_options()
+    limits = httpx.Limits(
+        max_connections=pool["pool_size"],
+        max_keepalive_connections=pool["keepalive_connections"],
+        keepalive_expiry=pool["keepalive_expiry"],
+    )
+    http_options = types.HttpOptions(
+        timeout=int(pool["timeout"] * 1000) if pool["timeout"] > 0 else None,
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+    )
+    location = location or os.getenv("GOOGLE_REGION")
+    client_logger.info(f"Building genai client for {location} (pid {os.getpid()}).")
+    # metrics outermost, so model latency includes time queued for quota
+    return InstrumentedClient(RateLimitedClient(
+        genai.Client(
+            vertexai=True,
+            project=os.getenv("GOOGLE_PROJECT_NAME"),
+            location=location,
+            http_options=http_options,
+        ),
+        RateLimiter(**rate_limiter_options()),
+    ))
+
+
+def _build_bigquery_client():
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import bigquery
+    from requests.adapters import HTTPAdapter
+
+    pool = http_pool_options()
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    session.mount("https://", HTTPAdapter(
+        pool_connections=pool["keepalive_connections"], pool_maxsize=pool["pool_size"]))
+    client_logger.info(f"Building BigQuery client (pid {os.getpid()}).")
+    return bigquery.Client(
+        project=os.getenv("GOOGLE_PROJECT_NAME"), credentials=credentials, _http=session)
+
+
+_genai_client = _PerProcess(_build_genai_client)
+_bigquery_client = _PerProcess(_build_bigquery_client)
+
+client = LazyClient(_genai_client)
+bigquery_client = LazyClient(_bigquery_client)
+
+
+def get_genai_client():
+    return _genai_client.get()
+
+
+_regional_clients: Dict[str, LazyClient] = {}
+_regional_lock = threading.Lock()
+
+
+def regional_client(region: Optional[str] = None) -> LazyClient:
+    """
+    Lazy genai client for another Vertex AI location, `client` for the default one.
+    Each region has its own connection pool and rate limiter.
+    """
+    if not region or region == GOOGLE_REGION:
+        return client
+    with _regional_lock:
+        if region not in _regional_clients:
+            _regional_clients[region] = LazyClient(
+                _PerProcess(functools.partial(_build_genai_client, region)))
+        return _regional_clients[region]
+
+
+def get_bigquery_client():
+    return _bigquery_client.get()
+
+
+def warm_up(genai: bool = True, bigquery: bool = False, model_name: Optional[str] = None):
+    """
+    Builds the requested clients and makes one cheap call each, so credentials
+    are fetched and a pooled TLS connection is open before the first request.
+    Failures are logged, a cold worker still works.
+    With gunicorn --preload call it from a post_fork hook, not in the master.
+    """
+    if genai:
+        try:
+            get_genai_client().models.get(
+                model=model_name or os.getenv("DEFAULT_CHAT_MODEL_NAME") or "gemini-2.5-flash")
+            client_logger.info("genai client warmed up.")
+        except Exception as e:
+            client_logger.warning(f"genai warm-up failed: {e}")
+    if bigquery:
+        try:
+            list(get_bigquery_client().list_datasets(max_results=1))
+            client_logger.info("BigQuery client warmed up.")
+        except Exception as e:
+            client_logger.warning(f"BigQuery warm-up failed: {e}")
+
+
+async def async_warm_up(model_name: Optional[str] = None):
+    """
+    warm_up() for client.aio, whose connection pool is separate and bound to the running loop.
+    """
+    try:
+        await get_genai_client().aio.models.get(
+            model=model_name or os.getenv("DEFAULT_CHAT_MODEL_NAME") or "gemini-2.5-flash")
+        client_logger.info("genai async client warmed up.")
+    except Exception as e:
+        client_logger.warning(f"genai async warm-up failed: {e}")
 
 
 def test_genai_client():
+    from google.genai import types
     from config import RAG_ASSISTANT_CONFIG
     model_name = "gemini-2.5-flash-preview-05-20"
     contents = [
@@ -0,0 +1,311 @@
+"""
+Background jobs for messages whose answers take too long to hold a connection open.
+
+POST /conversations/<id>/messages with "async": true (or Prefer: respond-async)
+answers 202 with a job id right away. JobQueue runs the turn on a bounded pool
+of worker threads, highest priority first, and keeps the outcome for polling
+with GET /jobs/<id> and for an optional webhook.
+
+Turns of one conversation run in submission order: only the oldest queued job
+of a conversation is eligible for a worker, the next one becomes eligible when
+it finishes. A low priority job therefore also holds back later jobs of its
+own conversation, but never those of others.
+
+Jobs live in the process that accepted them, like conversations without a
+shared store.
+"""
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+from serialization import error_status
+
+jobs_logger = logging.getLogger(__name__)
+
+queue_wait = metrics.registry.histogram(
+    "job_queue_wait_seconds", "Time a job waited for a worker.", buckets=metrics.MODEL_BUCKETS)
+run_time = metrics.registry.histogram(
+    "job_run_seconds", "Time a worker spent on a job.", buckets=metrics.MODEL_BUCKETS)
+finished_jobs = metrics.registry.counter(
+    "jobs_finished_total", "Finished jobs by outcome.", ("status",))
+webhook_deliveries = metrics.registry.counter(
+    "job_webhooks_total", "Webhook deliveries by outcome.", ("outcome",))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class QueueFullError(RuntimeError):
+    """
+    Raised when a job is submitted to a queue that holds max_queued jobs already.
+    """
+
+
+class Job:
+    __slots__ = ("id", "conversation_id", "priority", "run", "webhook", "status",
+                 "submitted_at", "queued_at", "started_at", "finished_at", "result", "error")
+
+    def __init__(self, conversation_id: str, run: Callable[[], Dict[str, Any]], priority: int, webhook: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.conversation_id = conversation_id
+        self.priority = priority
+        self.run = run
+        self.webhook = webhook
+        self.status = QUEUED
+        # wall clock for clients, monotonic for durations
+        self.submitted_at = time.time()
+        self.queued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "conversation_id": self.conversation_id,
+            "status": self.status,
+            "priority": self.priority,
+            "submitted_at": self.submitted_at,
+        }
+        if self.started_at is not None:
+            data["queue_seconds"] = round(self.started_at - self.queued_at, 3)
+        if self.finished_at is not None:
+            data["run_seconds"] = round(self.finished_at - self.started_at, 3)
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+def _webhook_target(url: str) -> Tuple[str, str, int, str]:
+    """
+    (scheme, host, port, path) of a webhook URL or prefix. Raises ValueError
+    for anything but plain http(s) URLs, credentials included, so that
+    "https://hooks.example.com@evil.test/" cannot pass as hooks.example.com.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("https", "http") or not parts.hostname or \
+            parts.username is not None or parts.password is not None:
+        raise ValueError(f"Not a webhook URL: {url}")
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return parts.scheme, parts.hostname.lower(), port, parts.path or "/"
+
+
+class JobQueue:
+    def __init__(self, workers: int = 4, max_queued: int = 1000, retention: float = 3600,
+                 max_retained: int = 10000, webhook_prefixes: Sequence[str] = (),
+                 webhook_timeout: float = 5, webhook_retries: int = 3,
+                 post: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        """
+        Args:
+            workers: jobs running at the same time.
+            max_queued: jobs waiting for a worker before submit() raises QueueFullError.
+            retention: seconds a finished job stays available for polling.
+            max_retained: finished jobs kept at most, the oldest go first.
+            webhook_prefixes: URL prefixes webhooks may point to, none disables webhooks.
+            webhook_timeout: seconds per delivery attempt.
+            webhook_retries: extra attempts for a failed delivery, with exponential backoff.
+            post: delivers a webhook, an HTTP POST of the job as JSON by default.
+        """
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.retention = retention
+        self.max_retained = max_retained
+        self.webhook_prefixes = tuple(webhook_prefixes)
+        self._webhook_targets = [_webhook_target(prefix) for prefix in self.webhook_prefixes]
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self._post = post or self._http_post
+        # (-priority, sequence, job) of the jobs eligible for a worker
+        self._ready: List[Tuple[int, int, Job]] = []
+        self._sequence = itertools.count()
+        # conversations with a job queued or running, mapped to the jobs behind it
+        self._waiting: Dict[str, Deque[Job]] = {}
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._stats = dict.fromkeys(("submitted", "rejected", SUCCEEDED, FAILED), 0)
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._webhooks: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._closed = False
+
+    def check_webhook(self, url: str):
+        """
+        Raises ValueError unless webhooks may be sent to `url`.
+        """
+        if not self.webhook_prefixes:
+            raise ValueError("Webhooks are not enabled on this server.")
+        try:
+            scheme, host, port, path = _webhook_target(url)
+        except ValueError:
+            raise ValueError("'webhook' is not an allowed callback URL.") from None
+        for prefix_scheme, prefix_host, prefix_port, prefix_path in self._webhook_targets:
+            # the path matches whole segments, /hooks allows /hooks/x but not /hooksx
+            if (scheme, host, port) == (prefix_scheme, prefix_host, prefix_port) and (
+                    path == prefix_path or path.startswith(prefix_path.rstrip("/") + "/")):
+                return
+        raise ValueError("'webhook' is not an allowed callback URL.")
+
+    def submit(self, conversation_id: str, run: Callable[[], Dict[str, Any]], priority: int = 0,
+               webhook: Optional[str] = None) -> Job:
+        """
+        Queues run() as a job of the conversation, higher priorities first.
+        run() returns the job's result, exceptions become its error.
+        """
+        if webhook is not None:
+            self.check_webhook(webhook)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("JobQueue is closed.")
+            if self._queued >= self.max_queued:
+                self._stats["rejected"] += 1
+                raise QueueFullError(f"{self._queued} jobs are queued already, retry later.")
+            job = Job(conversation_id, run, priority, webhook)
+            self._jobs[job.id] = job
+            self._queued += 1
+            self._stats["submitted"] += 1
+            waiting = self._waiting.get(conversation_id)
+            if waiting is None:
+                self._waiting[conversation_id] = deque()
+                self._push(job)
+            else:
+                waiting.append(job)
+            self._trim()
+            self._start_workers()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def _push(self, job: Job):
+        # caller holds self._condition
+        heapq.heappush(self._ready, (-job.priority, next(self._sequence), job))
+        self._condition.notify()
+
+    def _trim(self):
+        # caller holds self._condition; _jobs is in submission order
+        expired = time.monotonic() - self.retention
+        finished = len(self._jobs) - self._queued - self._running
+        for job_id, job in list(self._jobs.items()):
+            if not job.done:
+                continue
+            if finished <= self.max_retained and job.finished_at > expired:
+                break
+            del self._jobs[job_id]
+            finished -= 1
+
+    def _start_workers(self):
+        # caller holds self._condition
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._deliver, name="job-webhooks", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self._closed:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+                _, _, job = heapq.heappop(self._ready)
+                self._queued -= 1
+                self._running += 1
+                job.status = RUNNING
+                job.started_at = time.monotonic()
+            queue_wait.observe(job.started_at - job.queued_at)
+            try:
+                job.result = job.run()
+                status = SUCCEEDED
+            except Exception as e:
+                code, message = error_status(e)
+                if code >= 500:
+                    jobs_logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+                job.error = {"status": code, "message": message}
+                status = FAILED
+            job.run = None
+            with self._condition:
+                job.finished_at = time.monotonic()
+                job.status = status
+                self._running -= 1
+                self._stats[status] += 1
+                waiting = self._waiting[job.conversation_id]
+                if waiting:
+                    self._push(waiting.popleft())
+                else:
+                    del self._waiting[job.conversation_id]
+            run_time.observe(job.finished_at - job.started_at)
+            finished_jobs.labels(status).inc()
+            if job.webhook is not None:
+                self._webhooks.put(job)
+
+    def _http_post(self, url: str, payload: Dict[str, Any]):
+        httpx.post(url, json=payload, timeout=self.webhook_timeout).raise_for_status()
+
+    def _deliver(self):
+        # one thread, slow receivers delay other webhooks but never the workers
+        while True:
+            job = self._webhooks.get()
+            if job is None:
+                return
+            payload = job.to_dict()
+            for attempt in range(self.webhook_retries + 1):
+                try:
+                    self._post(job.webhook, payload)
+                    webhook_deliveries.labels("delivered").inc()
+                    break
+                except Exception as e:
+                    if attempt == self.webhook_retries:
+                        jobs_logger.warning(f"Webhook for job {job.id} failed: {e}")
+                        webhook_deliveries.labels("failed").inc()
+                    else:
+                        time.sleep(min(30, 2 ** attempt))
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Lets the workers finish the queued jobs and stops them.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads[:-1]:
+            thread.join(timeout)
+        if threads:
+            self._webhooks.put(None)
+            threads[-1].join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update(
+                queued=self._queued,
+                running=self._running,
+                workers=self.workers,
+                oldest_queued_seconds=round(max(
+                    (time.monotonic() - job.queued_at for job in self._jobs.values() if job.status == QUEUED),
+                    default=0.0), 3),
+            )
+        return stats
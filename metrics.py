@@ -0,0 +1,468 @@
+"""
+Prometheus-style metrics, rendered in the text exposition format by /metrics.
+
+Counters, gauges and histograms keep one array of floats per thread. A thread
+only ever writes its own array, so recording a sample takes no lock and
+allocates nothing once the label combination has been seen. The arrays are
+summed when /metrics is scraped. When a thread exits its array is folded into
+a retired total, so short-lived threads do not pile up arrays.
+
+Numbers are per process, every gunicorn worker reports its own.
+"""
+import abc
+import bisect
+import math
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, HTTP handlers answer fast unless they wait for the model
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MODEL_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+
+class _ThreadExit:
+    """
+    Held in a thread's locals only, collected when the thread exits.
+    """
+    __slots__ = ("__weakref__",)
+
+
+class _ShardedValues:
+    """
+    Fixed-size float arrays, one per live thread, summed on read.
+    """
+    __slots__ = ("size", "_local", "_shards", "_retired", "_lock")
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._shards: Dict[int, List[float]] = {}
+        self._retired = [0.0] * size
+        self._lock = threading.Lock()
+
+    def local(self) -> List[float]:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = [0.0] * self.size
+            self._local.exit = exit_marker = _ThreadExit()
+            with self._lock:
+                self._shards[id(values)] = values
+            # thread-per-request servers start a thread for every request,
+            # fold the array away as soon as its thread is gone
+            weakref.finalize(exit_marker, self._retire, values).atexit = False
+            return values
+
+    def _retire(self, values: List[float]):
+        with self._lock:
+            if self._shards.pop(id(values), None) is not None:
+                for i, value in enumerate(values):
+                    self._retired[i] += value
+
+    def snapshot(self) -> List[float]:
+        with self._lock:
+            totals = list(self._retired)
+            for values in self._shards.values():
+                for i, value in enumerate(values):
+                    totals[i] += value
+        return totals
+
+
+class CounterChild:
+    __slots__ = ("_values",)
+
+    def __init__(self):
+        self._values = _ShardedValues(1)
+
+    def inc(self, amount: float = 1):
+        self._values.local()[0] += amount
+
+    def value(self) -> float:
+        return self._values.snapshot()[0]
+
+
+class GaugeChild(CounterChild):
+    __slots__ = ("_function",)
+
+    def __init__(self):
+        super().__init__()
+        self._function: Optional[Callable[[], float]] = None
+
+    def dec(self, amount: float = 1):
+        self._values.local()[0] -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Reports function() at scrape time instead of the tracked value.
+        """
+        self._function = function
+
+    def value(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return super().value()
+
+
+class HistogramChild:
+    __slots__ = ("upper_bounds", "_values")
+
+    def __init__(self, upper_bounds: Sequence[float]):
+        self.upper_bounds = tuple(upper_bounds)
+        # one slot per bucket, one for +Inf, then the sum of observations
+        self._values = _ShardedValues(len(self.upper_bounds) + 2)
+
+    def observe(self, value: float):
+        values = self._values.local()
+        values[bisect.bisect_left(self.upper_bounds, value)] += 1
+        values[-1] += value
+
+    def snapshot(self) -> Tuple[List[float], float]:
+        """
+        Cumulative bucket counts (the last one is +Inf, i.e. the count) and the sum.
+        """
+        values = self._values.snapshot()
+        cumulative, total = [], 0.0
+        for count in values[:-1]:
+            total += count
+            cumulative.append(total)
+        return cumulative, values[-1]
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_child(self):
+        pass
+
+    def labels(self, *values) -> Any:
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} expects labels {self.labelnames}, got {key}.")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, child in list(self._children.items()):
+            yield self.name, dict(zip(self.labelnames, key)), child.value()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            counts, total = child.snapshot()
+            for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+                yield f"{self.name}_bucket", dict(labels, le=_format_value(upper_bound)), count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            # modules may be imported twice (app and __main__), hand out the first
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = HTTP_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def exposition(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "Time from request start to the last byte of the response.",
+    ("route", "method", "status"))
+http_in_flight = registry.gauge(
+    "http_requests_in_flight", "Requests being handled, streams included until they end.", ("route",))
+model_request_seconds = registry.histogram(
+    "model_request_duration_seconds", "Duration of genai calls including client-side queueing.",
+    ("model", "method"), buckets=MODEL_BUCKETS)
+model_first_token_seconds = registry.histogram(
+    "model_time_to_first_token_seconds", "Time until a streamed genai call yields its first chunk.",
+    ("model",), buckets=MODEL_BUCKETS)
+model_in_flight = registry.gauge(
+    "model_requests_in_flight", "genai calls waiting for their response or stream end.", ("model",))
+model_tokens = registry.counter(
+    "model_tokens_total", "Tokens reported by usage_metadata.", ("model", "type"))
+errors = registry.counter(
+    "errors_total", "Failed HTTP requests by status and failed genai calls by exception type.",
+    ("source", "type"))
+
+# usage_metadata field -> "type" label of model_tokens_total
+USAGE_FIELDS = (
+    ("prompt_token_count", "input"),
+    ("candidates_token_count", "output"),
+    ("thoughts_token_count", "thinking"),
+    ("cached_content_token_count", "cached"),
+)
+
+
+def record_usage(model: str, usage_metadata) -> None:
+    if usage_metadata is None:
+        return
+    for field, token_type in USAGE_FIELDS:
+        count = getattr(usage_metadata, field, None)
+        if count:
+            model_tokens.labels(model, token_type).inc(count)
+
+
+def record_error(source: str, error_type: str) -> None:
+    errors.labels(source, error_type).inc()
+
+
+class _ModelCallTimer:
+    """
+    Books one genai call: in-flight gauge, latency, time to first chunk, usage and errors.
+    """
+    __slots__ = ("model", "method", "started_at", "first_chunk", "_in_flight")
+
+    def __init__(self, model: Optional[str], method: str):
+        self.model = model or ""
+        self.method = method
+        self.started_at = time.perf_counter()
+        self.first_chunk = True
+        self._in_flight = model_in_flight.labels(self.model)
+        self._in_flight.inc()
+
+    def chunk(self):
+        if self.first_chunk:
+            self.first_chunk = False
+            model_first_token_seconds.labels(self.model).observe(
+                time.perf_counter() - self.started_at)
+
+    def finish(self, usage_metadata=None, error: Optional[BaseException] = None):
+        self._in_flight.dec()
+        model_request_seconds.labels(self.model, self.method).observe(
+            time.perf_counter() - self.started_at)
+        if error is not None:
+            record_error("model", type(error).__name__)
+        record_usage(self.model, usage_metadata)
+
+
+class InstrumentedModels:
+    def __init__(self, models):
+        self._models = models
+
+    def generate_content(self, model: str, contents: Any, config=None, **kwargs):
+        timer = _ModelCallTimer(model, "generate_content")
+        try:
+            response = self._models.generate_content(
+                model=model, contents=contents, config=config, **kwargs)
+        except Exception as e:
+            timer.finish(error=e)
+            raise
+        timer.finish(response.usage_metadata)
+        return response
+
+    def generate_content_stream(self, model: str, contents: Any, config=None, **kwargs):
+        timer = _ModelCallTimer(model, "generate_content_stream")
+        last_chunk = None
+        try:
+            for chunk in self._models.generate_content_stream(
+                    model=model, contents=contents, config=config, **kwargs):
+                timer.chunk()
+                last_chunk = chunk
+                yield chunk
+        except BaseException as e:
+            # GeneratorExit included, the consumer went away before the end
+            timer.finish(last_chunk.usage_metadata if last_chunk else None, error=e)
+            raise
+        timer.finish(last_chunk.usage_metadata if last_chunk else None)
+
+    def __getattr__(self, name: str):
+        return getattr(self._models, name)
+
+
+class AsyncInstrumentedModels(InstrumentedModels):
+    async def generate_content(self, model: str, contents: Any, config=None, **kwargs):
+        timer = _ModelCallTimer(model, "generate_content")
+        try:
+            response = await self._models.generate_content(
+                model=model, contents=contents, config=config, **kwargs)
+        except Exception as e:
+            timer.finish(error=e)
+            raise
+        timer.finish(response.usage_metadata)
+        return response
+
+    async def generate_content_stream(self, model: str, contents: Any, config=None, **kwargs):
+        timer = _ModelCallTimer(model, "generate_content_stream")
+        try:
+            stream = await self._models.generate_content_stream(
+                model=model, contents=contents, config=config, **kwargs)
+        except Exception as e:
+            timer.finish(error=e)
+            raise
+
+        async def iterate():
+            last_chunk = None
+            try:
+                async for chunk in stream:
+                    timer.chunk()
+                    last_chunk = chunk
+                    yield chunk
+            except BaseException as e:
+                timer.finish(last_chunk.usage_metadata if last_chunk else None, error=e)
+                raise
+            timer.finish(last_chunk.usage_metadata if last_chunk else None)
+
+        return iterate()
+
+
+class _AsyncClient:
+    def __init__(self, aio):
+        self._aio = aio
+        self.models = AsyncInstrumentedModels(aio.models)
+
+    def __getattr__(self, name: str):
+        return getattr(self._aio, name)
+
+
+class InstrumentedClient:
+    """
+    Drop-in wrapper for genai.Client (or RateLimitedClient) that records model metrics.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.models = InstrumentedModels(client.models)
+        self.aio = _AsyncClient(client.aio)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+
+def instrument_flask(app) -> None:
+    """
+    Times every request of a Flask app per route template. The timer stops
+    when the response is closed, so a streamed response counts until its end.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started_at = time.perf_counter()
+        g.metrics_route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        http_in_flight.labels(g.metrics_route).inc()
+
+    @app.after_request
+    def _stop_timer_on_close(response):
+        started_at = g.pop("metrics_started_at", None)
+        if started_at is None:
+            return response
+        route, method, status = g.metrics_route, request.method, response.status_code
+
+        def stop():
+            http_in_flight.labels(route).dec()
+            http_request_seconds.labels(route, method, status).observe(
+                time.perf_counter() - started_at)
+            if status >= 400:
+                record_error("http", str(status))
+
+        response.call_on_close(stop)
+        return response
+
+    @app.teardown_request
+    def _drop_timer(error):
+        # after_request did not run, e.g. an exception escaped in debug mode
+        if g.pop("metrics_started_at", None) is not None:
+            http_in_flight.labels(g.metrics_route).dec()
@@ -0,0 +1,336 @@
+"""
+Latency-aware routing over a pool of models and regions.
+
+A request for the router alias ("auto" by default) is served by one of the
+configured routes, e.g. gemini-2.5-flash in two regions plus gemini-2.5-pro
+as a last resort. Every route keeps a rolling latency and error rate. The
+first route in pool order that meets its latency SLO and is healthy wins,
+otherwise the one with the lowest expected latency. Retryable failures
+(throttling, 5xx, timeouts, RateLimitError) fail over to the next route; a
+route failing several times in a row is skipped for a cooldown. Estimates of
+routes without recent traffic are considered stale and get probed again.
+
+Routing happens before the turn, so the context and response caches see the
+concrete model name, and failing over simply retries the turn, which
+ConversationHistory rolls back on failure.
+"""
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence
+
+import metrics
+from rate_limiter import RateLimitError, is_retryable
+
+router_logger = logging.getLogger(__name__)
+
+route_requests = metrics.registry.counter(
+    "model_route_requests_total", "Routing decisions by chosen route and reason.", ("route", "reason"))
+route_failovers = metrics.registry.counter(
+    "model_route_failovers_total", "Attempts that failed over to another route.", ("route", "error"))
+route_latency = metrics.registry.gauge(
+    "model_route_latency_estimate_seconds", "Rolling latency estimate per route.", ("route",))
+
+
+class Route:
+    __slots__ = ("model", "region", "slo", "client", "latency", "error_rate", "samples",
+                 "consecutive_failures", "open_until", "last_used")
+
+    def __init__(self, model: str, region: Optional[str] = None, slo: float = 10.0, client=None):
+        """
+        Args:
+            model: model name sent to the API.
+            region: Vertex AI location, None for the default client's.
+            slo: latency target in seconds, time to first chunk for streams.
+            client: genai client for the region.
+        """
+        self.model = model
+        self.region = region
+        self.slo = slo
+        self.client = client
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.last_used = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}@{self.region}" if self.region else self.model
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "region": self.region,
+            "slo_seconds": self.slo,
+            "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "samples": self.samples,
+            "open": self.open_until > time.monotonic(),
+        }
+
+
+def parse_routes(spec: str) -> List[Route]:
+    """
+    "model[@region][:slo],..." e.g. "gemini-2.5-flash@us-central1:4,gemini-2.5-pro:15".
+    """
+    routes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        target, _, slo = item.partition(":")
+        model, _, region = target.partition("@")
+        routes.append(Route(model, region or None, float(slo) if slo else 10.0))
+    return routes
+
+
+class RoutingDecision:
+    """
+    What the router did for one request, returned to the client and logged.
+    """
+    __slots__ = ("route", "reason", "attempts")
+
+    def __init__(self):
+        self.route: Optional[Route] = None
+        self.reason: Optional[str] = None
+        # (route name, error type) of the attempts that failed over
+        self.attempts: List[tuple] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "route": self.route.name if self.route else None,
+            "model": self.route.model if self.route else None,
+            "region": self.route.region if self.route else None,
+            "reason": self.reason,
+            "failovers": [{"route": name, "error": error} for name, error in self.attempts],
+        }
+
+
+class ModelRouter:
+    def __init__(self, routes: Sequence[Route], alias: str = "auto", alpha: float = 0.2,
+                 max_error_rate: float = 0.2, failure_threshold: int = 3, cooldown: float = 30.0,
+                 probe_interval: float = 30.0, max_attempts: int = 0):
+        """
+        Args:
+            routes: the pool in order of preference.
+            alias: model name that requests routing.
+            alpha: weight of the newest sample in the rolling latency and error rate.
+            max_error_rate: routes above it only serve when nothing healthier is left.
+            failure_threshold, cooldown: consecutive failures that take a route out
+                of rotation and for how many seconds.
+            probe_interval: latency estimates older than this are considered stale,
+                so a route that was slow gets another chance.
+            max_attempts: routes tried per request, 0 for all of them.
+        """
+        if not routes:
+            raise ValueError("ModelRouter needs at least one route.")
+        self.routes = list(routes)
+        self.alias = alias
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.max_attempts = max_attempts or len(self.routes)
+        self._lock = threading.Lock()
+        for route in self.routes:
+            route_latency.labels(route.name).set_function(
+                lambda route=route: route.latency or 0.0)
+
+    def handles(self, model_name: Optional[str]) -> bool:
+        return model_name == self.alias
+
+    # selection
+
+    def _meets_slo(self, route: Route, now: float) -> bool:
+        if route.latency is None or now - route.last_used > self.probe_interval:
+            return True  # unknown or stale, worth a try
+        return route.latency <= route.slo and route.error_rate <= self.max_error_rate
+
+    def choose(self, exclude: Sequence[Route] = ()) -> Optional[tuple]:
+        """
+        Returns (route, reason) for the next attempt, None when every route was tried.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [route for route in self.routes if route not in exclude]
+            if not candidates:
+                return None
+            closed = [route for route in candidates if route.open_until <= now]
+            for route in closed:
+                if self._meets_slo(route, now):
+                    reason = "preferred" if route is self.routes[0] else "slo"
+                    break
+            else:
+                # nobody meets the SLO, or every route is cooling down
+                pool = closed or candidates
+                route = min(pool, key=lambda r: (r.latency or 0.0) * (1 + r.error_rate))
+                reason = "fastest" if closed else "all_open"
+            if exclude:
+                reason = "failover"
+            route.last_used = now
+        route_requests.labels(route.name, reason).inc()
+        return route, reason
+
+    # feedback
+
+    def record_success(self, route: Route, latency: float):
+        with self._lock:
+            route.latency = latency if route.latency is None else \
+                (1 - self.alpha) * route.latency + self.alpha * latency
+            route.error_rate *= 1 - self.alpha
+            route.samples += 1
+            route.consecutive_failures = 0
+            route.open_until = 0.0
+
+    def record_failure(self, route: Route, error: BaseException, latency: float):
+        with self._lock:
+            route.error_rate = (1 - self.alpha) * route.error_rate + self.alpha
+            route.samples += 1
+            route.consecutive_failures += 1
+            if latency > 0:
+                # a timeout says as much about latency as a slow success
+                route.latency = latency if route.latency is None else \
+                    max(route.latency, (1 - self.alpha) * route.latency + self.alpha * latency)
+            if route.consecutive_failures >= self.failure_threshold:
+                route.open_until = time.monotonic() + self.cooldown
+                router_logger.warning(
+                    f"Route {route.name} failed {route.consecutive_failures} times in a row, "
+                    f"skipped for {self.cooldown:.0f}s.")
+        route_failovers.labels(route.name, type(error).__name__).inc()
+
+    @staticmethod
+    def should_fail_over(error: BaseException) -> bool:
+        return isinstance(error, RateLimitError) or is_retryable(error)
+
+    def _attempts(self, decision: RoutingDecision) -> Iterator[Route]:
+        tried: List[Route] = []
+        while len(tried) < self.max_attempts:
+            choice = self.choose(exclude=tried)
+            if choice is None:
+                return
+            route, reason = choice
+            if decision.reason is None:
+                decision.reason = reason
+            decision.route = route
+            tried.append(route)
+            yield route
+
+    def _failed(self, decision: RoutingDecision, route: Route, error: Exception, started_at: float):
+        if not self.should_fail_over(error):
+            raise error
+        self.record_failure(route, error, time.perf_counter() - started_at)
+        decision.attempts.append((route.name, type(error).__name__))
+        router_logger.warning(f"Route {route.name} failed ({error!r}), failing over.")
+
+    # calls
+
+    def call(self, fn: Callable[[Route], Any], decision: Optional[RoutingDecision] = None) -> Any:
+        """
+        Runs fn(route) on the chosen route, failing over on retryable errors.
+        The last error is raised once the routes are exhausted.
+        """
+        decision = decision if decision is not None else RoutingDecision()
+        error: Optional[Exception] = None
+        for route in self._attempts(decision):
+            started_at = time.perf_counter()
+            try:
+                result = fn(route)
+            except Exception as e:
+                self._failed(decision, route, e, started_at)
+                error = e
+                continue
+            self.record_success(route, time.perf_counter() - started_at)
+            return result
+        raise error
+
+    def stream(self, fn: Callable[[Route], Iterator[Any]], decision: Optional[RoutingDecision] = None) -> Iterator[Any]:
+        """
+        Like call() for streams, latency is the time to the first chunk. Only
+        failures before the first chunk fail over.
+        """
+        decision = decision if decision is not None else RoutingDecision()
+        error: Optional[Exception] = None
+        for route in self._attempts(decision):
+            started_at = time.perf_counter()
+            stream = fn(route)
+            try:
+                first = next(stream)
+            except StopIteration:
+                self.record_success(route, time.perf_counter() - started_at)
+                return
+            except Exception as e:
+                self._failed(decision, route, e, started_at)
+                error = e
+                continue
+            self.record_success(route, time.perf_counter() - started_at)
+            try:
+                yield first
+                yield from stream
+            finally:
+                stream.close()
+            return
+        raise error
+
+    async def async_call(self, fn: Callable[[Route], Awaitable[Any]], decision: Optional[RoutingDecision] = None) -> Any:
+        decision = decision if decision is not None else RoutingDecision()
+        error: Optional[Exception] = None
+        for route in self._attempts(decision):
+            started_at = time.perf_counter()
+            try:
+                result = await fn(route)
+            except Exception as e:
+                self._failed(decision, route, e, started_at)
+                error = e
+                continue
+            self.record_success(route, time.perf_counter() - started_at)
+            return result
+        raise error
+
+    async def async_stream(self, fn, decision: Optional[RoutingDecision] = None):
+        decision = decision if decision is not None else RoutingDecision()
+        error: Optional[Exception] = None
+        for route in self._attempts(decision):
+            started_at = time.perf_counter()
+            stream = fn(route)
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                self.record_success(route, time.perf_counter() - started_at)
+                return
+            except Exception as e:
+                self._failed(decision, route, e, started_at)
+                error = e
+                continue
+            self.record_success(route, time.perf_counter() - started_at)
+            try:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+            return
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "alias": self.alias,
+                "routes": {route.name: route.stats() for route in self.routes},
+            }
+
+
+def build_model_router(client_for_region: Callable[[Optional[str]], Any], routes: str = "",
+                       **options) -> Optional[ModelRouter]:
+    """
+    ModelRouter for the route spec (see parse_routes), None if there are no routes.
+    """
+    parsed = parse_routes(routes)
+    if not parsed:
+        return None
+    for route in parsed:
+        route.client = client_for_region(route.region)
+    router_logger.info(f"Routing '{options.get('alias', 'auto')}' over {[r.name for r in parsed]}.")
+    return ModelRouter(parsed, **options)
@@ -0,0 +1,524 @@
+"""
+Client-side throttling for the genai client.
+
+RateLimitedClient wraps client.models and client.aio.models so every
+generate_content(_stream) call first passes
+  * two token buckets, requests/min and tokens/min, the latter charged with an
+    estimate up front and settled against usage_metadata afterwards,
+  * an AIMD concurrency limit that grows by one slot per window of successful
+    calls and halves whenever Vertex answers 429/503,
+and retries retryable failures with jittered exponential backoff. Requests
+that still cannot go out raise RateLimitError, which the apps turn into 429
+instead of a 500. None of this waits past the request deadline (see
+deadline.py), and every attempt is sent with the time that is left.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from google.genai import errors, types
+
+import deadline as deadlines
+from context_policy import estimate_content_tokens, estimate_tokens
+
+# HTTP codes worth another attempt, and the ones that mean "slow down"
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+THROTTLE_CODES = {429, 503}
+
+
+class RateLimitError(RuntimeError):
+    """
+    Raised when a request would queue longer than allowed or stays throttled after all retries.
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def error_code(error: BaseException) -> Optional[int]:
+    if isinstance(error, errors.APIError):
+        return error.code
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    code = error_code(error)
+    if code is not None:
+        return code in RETRYABLE_CODES
+    # connection resets and timeouts below the SDK
+    import httpx
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def is_throttled(error: BaseException) -> bool:
+    return error_code(error) in THROTTLE_CODES
+
+
+def estimate_request_tokens(contents: Any) -> int:
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    if isinstance(contents, types.Content):
+        return estimate_content_tokens(contents)
+    return sum(estimate_request_tokens(content) for content in contents)
+
+
+class TokenBucket:
+    """
+    Reservation-style token bucket: reserve() always succeeds and tells the
+    caller how long to wait, so the same bucket serves threads and coroutines.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Takes `amount` tokens, possibly going into debt, and returns the seconds
+        until the debt is paid off.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float):
+        """
+        Gives tokens back, or charges more for a negative amount.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase / multiplicative decrease.
+    Waiters are plain callbacks, so threads (Event.set) and coroutines
+    (future.set_result via their loop) wait on the same limiter.
+    """
+
+    def __init__(self, max_limit: int = 64, min_limit: int = 1, backoff: float = 0.5, cooldown: float = 1.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.backoff = backoff
+        # several in-flight calls get throttled at once, count that as one signal
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._decreased_at = 0.0
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def _wait_with(self, wake: Callable[[], None]) -> bool:
+        """
+        Registers `wake` unless a slot frees up meanwhile, returns True when registered.
+        """
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                return False
+            self._waiters.append(wake)
+            return True
+
+    def _discard(self, wake: Callable[[], None]):
+        with self._lock:
+            try:
+                self._waiters.remove(wake)
+            except ValueError:
+                pass
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire():
+            woken = threading.Event()
+            if not self._wait_with(woken.set):
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if not woken.wait(remaining):
+                self._discard(woken.set)
+                return self.try_acquire()
+        return True
+
+    async def async_acquire(self, timeout: Optional[float] = None) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not self.try_acquire():
+            woken = loop.create_future()
+
+            def wake(future=woken):
+                loop.call_soon_threadsafe(
+                    lambda: future.done() or future.set_result(None))
+
+            if not self._wait_with(wake):
+                continue
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                await asyncio.wait_for(woken, remaining)
+            except asyncio.TimeoutError:
+                self._discard(wake)
+                return self.try_acquire()
+            except BaseException:
+                # cancelled, a wake-up meant for it would otherwise be lost
+                self._discard(wake)
+                raise
+        return True
+
+    def release(self, outcome: str = "success"):
+        """
+        Args:
+            outcome: "success" grows the limit by 1/limit, "throttled" multiplies
+                it by `backoff`, anything else leaves it alone.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if outcome == "success":
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif outcome == "throttled":
+                now = time.monotonic()
+                if now - self._decreased_at >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._decreased_at = now
+            free = int(self.limit) - self.in_flight
+            wake = [self._waiters.popleft()
+                    for _ in range(min(max(free, 0), len(self._waiters)))]
+        for callback in wake:
+            callback()
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_concurrency: int = 64,
+                 min_concurrency: int = 1, max_retries: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 30.0, max_wait: float = 60.0, burst_seconds: float = 10):
+        """
+        Args:
+            rpm, tpm: requests and tokens per minute, 0 for no limit.
+            max_concurrency, min_concurrency: bounds of the AIMD concurrency limit.
+            max_retries: extra attempts for retryable errors.
+            base_delay, max_delay: exponential backoff range, full jitter in between.
+            max_wait: longest a request may queue for a bucket or a slot before
+                RateLimitError, 0 to wait as long as it takes.
+            burst_seconds: how many seconds of the per-minute rates may go out at once.
+        """
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm > 0 else None
+        self.concurrency = AIMDLimiter(max_concurrency, min_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        # expected completion tokens, learned from usage_metadata
+        self._output_tokens = 0.0
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ("calls", "retries", "throttled", "rejected", "failed"), 0)
+        self._waits = dict.fromkeys(("count", "total", "max"), 0.0)
+
+    # bookkeeping
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _record_wait(self, seconds: float):
+        with self._lock:
+            self._waits["count"] += 1
+            self._waits["total"] += seconds
+            self._waits["max"] = max(self._waits["max"], seconds)
+
+    def estimate(self, contents: Any) -> int:
+        return estimate_request_tokens(contents) + int(self._output_tokens)
+
+    def settle(self, estimate: int, usage: Optional[types.GenerateContentResponseUsageMetadata]):
+        """
+        Charges the token bucket with the difference between estimate and actual usage.
+        """
+        if usage is None or not usage.total_token_count:
+            return
+        if usage.candidates_token_count is not None:
+            with self._lock:
+                self._output_tokens = 0.9 * self._output_tokens + \
+                    0.1 * usage.candidates_token_count
+        if self.tokens is not None:
+            self.tokens.refund(estimate - usage.total_token_count)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _reserve(self, estimate: int) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.reserve(1)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimate))
+        if self.max_wait and wait > self.max_wait:
+            self._unreserve(estimate, requests=True)
+            self._count("rejected")
+            raise RateLimitError(
+                f"Request would queue {wait:.1f}s for quota.", retry_after=wait)
+        remaining = deadlines.remaining()
+        if remaining is not None and wait >= remaining:
+            self._unreserve(estimate, requests=True)
+            self._count("rejected")
+            raise deadlines.DeadlineExceeded(
+                f"Request would queue {wait:.1f}s for quota, past its deadline.")
+        return wait
+
+    def _unreserve(self, estimate: int, requests: bool = False):
+        if requests and self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None:
+            self.tokens.refund(estimate)
+
+    def _slot_timeout(self, queued_at: float) -> Optional[float]:
+        timeout = None
+        if self.max_wait:
+            timeout = max(0.0, self.max_wait - (time.monotonic() - queued_at))
+        remaining = deadlines.remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    def _give_up(self, estimate: int, queued_at: float):
+        self._unreserve(estimate)
+        self._count("rejected")
+        deadline = deadlines.current()
+        if deadline is not None:
+            deadline.check()
+        raise RateLimitError(
+            f"Request queued {time.monotonic() - queued_at:.1f}s for a concurrency slot.",
+            retry_after=self.base_delay)
+
+    def _failed(self, error: Exception, estimate: int, attempt: int) -> float:
+        """
+        Books a failed attempt, returns the backoff before the next one or re-raises.
+        """
+        throttled = is_throttled(error)
+        self.concurrency.release("throttled" if throttled else "error")
+        # quota is not charged for rejected requests
+        self._unreserve(estimate)
+        if throttled:
+            self._count("throttled")
+        backoff = self.backoff(attempt)
+        remaining = deadlines.remaining()
+        out_of_time = remaining is not None and backoff >= remaining
+        if not is_retryable(error) or attempt >= self.max_retries or out_of_time:
+            self._count("failed")
+            if throttled and not out_of_time:
+                raise RateLimitError(
+                    f"Still throttled after {attempt + 1} attempts: {error}",
+                    retry_after=self.backoff(attempt + 1)) from error
+            raise error
+        self._count("retries")
+        return backoff
+
+    # blocking calls
+
+    def _admit(self, estimate: int):
+        queued_at = time.monotonic()
+        wait = self._reserve(estimate)
+        if wait:
+            time.sleep(wait)
+        if not self.concurrency.acquire(self._slot_timeout(queued_at)):
+            self._give_up(estimate, queued_at)
+        self._record_wait(time.monotonic() - queued_at)
+
+    def call(self, fn: Callable[[], types.GenerateContentResponse], contents: Any) -> types.GenerateContentResponse:
+        self._count("calls")
+        estimate = self.estimate(contents)
+        for attempt in range(self.max_retries + 1):
+            self._admit(estimate)
+            try:
+                response = fn()
+            except Exception as e:
+                time.sleep(self._failed(e, estimate, attempt))
+                continue
+            self.concurrency.release("success")
+            self.settle(estimate, response.usage_metadata)
+            return response
+
+    def stream(self, fn: Callable[[], Iterator[types.GenerateContentResponse]], contents: Any) -> Iterator[types.GenerateContentResponse]:
+        """
+        Like call() for streams. Only failures before the first chunk are
+        retried, the slot is held until the stream ends or is closed.
+        """
+        self._count("calls")
+        estimate = self.estimate(contents)
+        for attempt in range(self.max_retries + 1):
+            self._admit(estimate)
+            started = False
+            last_chunk = None
+            try:
+                for chunk in fn():
+                    started = True
+                    last_chunk = chunk
+                    yield chunk
+            except Exception as e:
+                if started:
+                    self.concurrency.release("throttled" if is_throttled(e) else "error")
+                    raise
+                time.sleep(self._failed(e, estimate, attempt))
+                continue
+            except BaseException:
+                # closed by the consumer
+                self.concurrency.release("error")
+                raise
+            self.concurrency.release("success")
+            self.settle(estimate, last_chunk.usage_metadata if last_chunk else None)
+            return
+
+    # asyncio calls
+
+    async def _async_admit(self, estimate: int):
+        queued_at = time.monotonic()
+        wait = self._reserve(estimate)
+        if wait:
+            await asyncio.sleep(wait)
+        if not await self.concurrency.async_acquire(self._slot_timeout(queued_at)):
+            self._give_up(estimate, queued_at)
+        self._record_wait(time.monotonic() - queued_at)
+
+    async def async_call(self, fn, contents: Any) -> types.GenerateContentResponse:
+        self._count("calls")
+        estimate = self.estimate(contents)
+        for attempt in range(self.max_retries + 1):
+            await self._async_admit(estimate)
+            try:
+                response = await fn()
+            except Exception as e:
+                await asyncio.sleep(self._failed(e, estimate, attempt))
+                continue
+            self.concurrency.release("success")
+            self.settle(estimate, response.usage_metadata)
+            return response
+
+    async def async_stream(self, fn, contents: Any):
+        self._count("calls")
+        estimate = self.estimate(contents)
+        for attempt in range(self.max_retries + 1):
+            await self._async_admit(estimate)
+            started = False
+            last_chunk = None
+            try:
+                async for chunk in await fn():
+                    started = True
+                    last_chunk = chunk
+                    yield chunk
+            except Exception as e:
+                if started:
+                    self.concurrency.release("throttled" if is_throttled(e) else "error")
+                    raise
+                await asyncio.sleep(self._failed(e, estimate, attempt))
+                continue
+            except BaseException:
+                self.concurrency.release("error")
+                raise
+            self.concurrency.release("success")
+            self.settle(estimate, last_chunk.usage_metadata if last_chunk else None)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            waits = dict(self._waits)
+        stats["queue_wait"] = {
+            "count": int(waits["count"]),
+            "avg_seconds": waits["total"] / waits["count"] if waits["count"] else 0.0,
+            "max_seconds": waits["max"],
+        }
+        stats["concurrency"] = {
+            "limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "waiting": len(self.concurrency._waiters),
+        }
+        if self.requests is not None:
+            stats["requests_available"] = round(self.requests.tokens, 1)
+        if self.tokens is not None:
+            stats["tokens_available"] = round(self.tokens.tokens, 1)
+        return stats
+
+
+class RateLimitedModels:
+    def __init__(self, models, limiter: RateLimiter):
+        self._models = models
+        self.limiter = limiter
+
+    # attempts after queueing or a backoff get the time left by then
+
+    def generate_content(self, model: str, contents: Any, config=None, **kwargs) -> types.GenerateContentResponse:
+        return self.limiter.call(
+            lambda: self._models.generate_content(
+                model=model, contents=contents,
+                config=deadlines.with_timeout(config, deadlines.current()), **kwargs),
+            contents)
+
+    def generate_content_stream(self, model: str, contents: Any, config=None, **kwargs) -> Iterator[types.GenerateContentResponse]:
+        return self.limiter.stream(
+            lambda: self._models.generate_content_stream(
+                model=model, contents=contents,
+                config=deadlines.with_timeout(config, deadlines.current()), **kwargs),
+            contents)
+
+    def __getattr__(self, name: str):
+        # count_tokens, embed_content, ... pass through unthrottled
+        return getattr(self._models, name)
+
+
+class AsyncRateLimitedModels(RateLimitedModels):
+    async def generate_content(self, model: str, contents: Any, config=None, **kwargs) -> types.GenerateContentResponse:
+        return await self.limiter.async_call(
+            lambda: self._models.generate_content(
+                model=model, contents=contents,
+                config=deadlines.with_timeout(config, deadlines.current()), **kwargs),
+            contents)
+
+    async def generate_content_stream(self, model: str, contents: Any, config=None, **kwargs):
+        return self.limiter.async_stream(
+            lambda: self._models.generate_content_stream(
+                model=model, contents=contents,
+                config=deadlines.with_timeout(config, deadlines.current()), **kwargs),
+            contents)
+
+
+class _AsyncClient:
+    def __init__(self, aio, limiter: RateLimiter):
+        self._aio = aio
+        self.models = AsyncRateLimitedModels(aio.models, limiter)
+
+    def __getattr__(self, name: str):
+        return getattr(self._aio, name)
+
+
+class RateLimitedClient:
+    """
+    Drop-in wrapper for genai.Client, sync and client.aio calls share one RateLimiter.
+    """
+
+    def __init__(self, client, limiter: Optional[RateLimiter] = None):
+        self._client = client
+        self.limiter = limiter or RateLimiter()
+        self.models = RateLimitedModels(client.models, self.limiter)
+        self.aio = _AsyncClient(client.aio, self.limiter)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
@@ -0,0 +1,369 @@
+"""
+In-process retrieval over the documents table of bigquery_app.py.
+
+RAG_ASSISTANT_CONFIG retrieves through a Vertex AI Search datastore, a
+separate copy of the documents behind one more network round trip per turn.
+LocalRetriever keeps the `text` column chunked and embedded in a vector index
+(see vector_index.py) and syncs it from BigQuery incrementally: a scan of
+(idx, fingerprint) pairs finds new, changed and deleted rows, and only those
+are fetched and embedded again.
+
+Requests whose config carries the Vertex AI Search tool are served locally
+when a retriever is configured: ConversationHistory.prepare_call drops the
+tool and puts the best passages in front of the user's message in the
+request, the stored history keeps the message alone. If the index is empty
+or the search fails, the request goes out with the remote tool as before.
+
+HashingEmbedder is deterministic and needs no model, for tests and offline
+runs. GenaiEmbedder uses an embedding model through the genai client.
+"""
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from google.genai import types
+
+import metrics
+from vector_index import FlatIndex, normalize
+
+retrieval_logger = logging.getLogger(__name__)
+
+retrieval_seconds = metrics.registry.histogram(
+    "retrieval_duration_seconds", "Time to embed a query and search the local index.")
+retrieval_requests = metrics.registry.counter(
+    "retrieval_requests_total",
+    "Requests for the Vertex AI Search tool, by whether the local index served them.", ("outcome",))
+
+# splits after sentence ends, Chinese and Latin punctuation alike
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;.\n])")
+
+
+def chunk_text(text: str, max_chars: int = 800, overlap: int = 100) -> List[str]:
+    """
+    Splits a document into passages of at most max_chars, on sentence ends
+    where possible. Each passage repeats up to `overlap` characters of the
+    previous one so that no sentence pair is only ever seen cut apart.
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    sentences = []
+    for sentence in _SENTENCE_END.split(text):
+        # sentences longer than a passage are cut hard
+        sentences.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+    chunks, current = [], ""
+    for sentence in sentences:
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current.strip())
+            current = current[-overlap:] if overlap > 0 else ""
+            if len(current) + len(sentence) > max_chars:
+                current = ""
+        current += sentence
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
+
+
+class HashingEmbedder:
+    """
+    Signed feature hashing of character 1- to 3-grams into `dim` buckets.
+    Deterministic across processes and free, but only matches shared
+    wording, not meaning.
+    """
+    may_block = False
+
+    def __init__(self, dim: int = 256, ngrams: Sequence[int] = (1, 2, 3)):
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+
+    def _embed(self, text: str) -> np.ndarray:
+        text = " ".join(text.lower().split())
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in self.ngrams:
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                if gram.isspace():
+                    continue
+                h = zlib.crc32(gram.encode("utf-8"))
+                vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vector
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return normalize(np.stack([self._embed(text) for text in texts]))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return normalize(self._embed(text))
+
+
+class GenaiEmbedder:
+    may_block = True
+
+    def __init__(self, client, model: str = "text-multilingual-embedding-002", dim: int = 768,
+                 batch_size: int = 100):
+        """
+        Args:
+            client: genai client with an embedding model.
+            model: multilingual by default, the documents are mostly Chinese.
+            dim: output_dimensionality asked for.
+            batch_size: texts per embed_content call.
+        """
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+
+    def _embed(self, texts: Sequence[str], task_type: str) -> np.ndarray:
+        config = types.EmbedContentConfig(task_type=task_type, output_dimensionality=self.dim)
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.models.embed_content(
+                model=self.model, contents=list(texts[start:start + self.batch_size]), config=config)
+            vectors.extend(embedding.values for embedding in response.embeddings)
+        return normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        return self._embed(texts, "RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], "RETRIEVAL_QUERY")[0]
+
+
+class BigQueryDocumentSource:
+    def __init__(self, client, table_id: str, fetch_batch: int = 500):
+        """
+        Args:
+            client: google.cloud.bigquery.Client, or fake_bigquery.FakeBigQueryClient.
+            table_id: project.dataset.table of the documents table.
+            fetch_batch: ids per fetch query.
+        """
+        self.client = client
+        self.table_id = table_id
+        self.fetch_batch = fetch_batch
+
+    def fingerprints(self) -> Dict[str, int]:
+        """
+        idx -> fingerprint of the indexed columns, for every row of the table.
+        """
+        query = f"""
+            SELECT idx, FARM_FINGERPRINT(CONCAT(
+                IFNULL(title, ''), '\\x1f', IFNULL(url, ''), '\\x1f', IFNULL(text, ''))) AS fingerprint
+            FROM `{self.table_id}`
+        """
+        return {row["idx"]: row["fingerprint"] for row in self.client.query(query).result()}
+
+    def fetch(self, ids: Sequence[str]) -> Iterator[Dict[str, Any]]:
+        from google.cloud import bigquery
+
+        query = f"SELECT idx, title, url, text FROM `{self.table_id}` WHERE idx IN UNNEST(@ids)"
+        for start in range(0, len(ids), self.fetch_batch):
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ArrayQueryParameter("ids", "STRING", list(ids[start:start + self.fetch_batch]))])
+            for row in self.client.query(query, job_config=job_config).result():
+                yield dict(row)
+
+
+class Passage(NamedTuple):
+    doc_id: str
+    title: Optional[str]
+    url: Optional[str]
+    text: str
+    score: float
+
+
+class _Document(NamedTuple):
+    fingerprint: int
+    title: Optional[str]
+    url: Optional[str]
+    chunks: List[str]
+
+
+def uses_vertex_ai_search(config: Optional[types.GenerateContentConfig]) -> bool:
+    return bool(config and config.tools and any(
+        tool.retrieval is not None and tool.retrieval.vertex_ai_search is not None for tool in config.tools))
+
+
+def format_passages(passages: Sequence[Passage]) -> str:
+    lines = ["Reference passages from our documents, cite them where they help:"]
+    for number, passage in enumerate(passages, 1):
+        source = " ".join(part for part in (passage.title, f"({passage.url})" if passage.url else None) if part)
+        lines.append(f"\n[{number}] {source}\n{passage.text}" if source else f"\n[{number}]\n{passage.text}")
+    return "\n".join(lines)
+
+
+class LocalRetriever:
+    def __init__(self, source, embedder, index: Optional[FlatIndex] = None, top_k: int = 4,
+                 min_score: float = 0.0, chunk_chars: int = 800, chunk_overlap: int = 100,
+                 sync_interval: float = 300, max_variants: int = 64):
+        """
+        Args:
+            source: BigQueryDocumentSource or anything with fingerprints() and fetch(ids).
+            embedder: HashingEmbedder, GenaiEmbedder or alike.
+            index: FlatIndex (default) or IVFIndex of the embedder's dimension.
+            top_k: passages put in front of a message.
+            min_score: passages less similar than this are left out.
+            chunk_chars, chunk_overlap: see chunk_text.
+            sync_interval: seconds between background syncs, see start().
+            max_variants: configs without the Vertex AI Search tool kept for reuse.
+        """
+        self.source = source
+        self.embedder = embedder
+        self.index = index if index is not None else FlatIndex(embedder.dim)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.chunk_chars = chunk_chars
+        self.chunk_overlap = chunk_overlap
+        self.sync_interval = sync_interval
+        self.max_variants = max_variants
+        self._documents: Dict[str, _Document] = {}
+        self._variants: "OrderedDict[int, Tuple[Any, types.GenerateContentConfig]]" = OrderedDict()
+        # readers and the apply step of a sync, embedding happens outside
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = dict.fromkeys(("syncs", "sync_errors", "added", "updated", "deleted", "searches"), 0)
+        self._last_sync: Optional[float] = None
+
+    @property
+    def may_block(self) -> bool:
+        return self.embedder.may_block
+
+    def sync(self) -> Dict[str, int]:
+        """
+        Brings the index up to date with the table, embedding only new and
+        changed documents. Returns how many were added, updated and deleted.
+        """
+        with self._sync_lock:
+            fingerprints = self.source.fingerprints()
+            with self._lock:
+                known = {doc_id: document.fingerprint for doc_id, document in self._documents.items()}
+            changed = [doc_id for doc_id, fingerprint in fingerprints.items() if known.get(doc_id) != fingerprint]
+            deleted = [doc_id for doc_id in known if doc_id not in fingerprints]
+            counts = {"added": 0, "updated": 0, "deleted": 0}
+
+            rows = list(self.source.fetch(changed)) if changed else []
+            chunked = [(row, chunk_text(row.get("text"), self.chunk_chars, self.chunk_overlap)) for row in rows]
+            vectors = self.embedder.embed_documents([chunk for _, chunks in chunked for chunk in chunks])
+            with self._lock:
+                offset = 0
+                for row, chunks in chunked:
+                    doc_id = row["idx"]
+                    counts["updated" if doc_id in self._documents else "added"] += 1
+                    if chunks:
+                        self.index.add(doc_id, vectors[offset:offset + len(chunks)])
+                    else:
+                        self.index.remove(doc_id)
+                    offset += len(chunks)
+                    self._documents[doc_id] = _Document(
+                        fingerprints[doc_id], row.get("title"), row.get("url"), chunks)
+                for doc_id in deleted:
+                    self.index.remove(doc_id)
+                    del self._documents[doc_id]
+                    counts["deleted"] += 1
+                self._stats["syncs"] += 1
+                for key, count in counts.items():
+                    self._stats[key] += count
+                self._last_sync = time.time()
+            return counts
+
+    def start(self):
+        """
+        Syncs in a background thread now and every sync_interval seconds.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="retrieval-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                with self._lock:
+                    self._stats["sync_errors"] += 1
+                retrieval_logger.error(f"Retrieval index sync failed: {e}", exc_info=True)
+            self._stopped.wait(self.sync_interval)
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Passage]:
+        started_at = time.perf_counter()
+        vector = self.embedder.embed_query(query)
+        with self._lock:
+            hits = self.index.search(vector, k or self.top_k)
+            passages = []
+            for (doc_id, chunk), score in hits:
+                if score < self.min_score:
+                    break
+                document = self._documents[doc_id]
+                passages.append(Passage(doc_id, document.title, document.url, document.chunks[chunk], score))
+            self._stats["searches"] += 1
+        retrieval_seconds.observe(time.perf_counter() - started_at)
+        return passages
+
+    def _local_config(self, config: types.GenerateContentConfig) -> types.GenerateContentConfig:
+        # caller holds self._lock
+        entry = self._variants.get(id(config))
+        if entry is not None and entry[0] is config:
+            self._variants.move_to_end(id(config))
+            return entry[1]
+        tools = [tool for tool in config.tools
+                 if tool.retrieval is None or tool.retrieval.vertex_ai_search is None]
+        variant = config.model_copy(update={"tools": tools or None})
+        # the config is held as well, so its id cannot be reused while the entry lives
+        self._variants[id(config)] = (config, variant)
+        while len(self._variants) > self.max_variants:
+            self._variants.popitem(last=False)
+        return variant
+
+    def augment(self, contents: List[types.Content], config: Optional[types.GenerateContentConfig]) -> Tuple[List[types.Content], Optional[types.GenerateContentConfig]]:
+        """
+        Swaps the Vertex AI Search tool of a request for local passages put
+        in front of the last user message. Leaves the request as it is if
+        it does not use the tool, the index is empty or the search fails.
+        """
+        if not uses_vertex_ai_search(config) or not contents or contents[-1].role != "user":
+            return contents, config
+        if not len(self.index):
+            retrieval_requests.labels("fallback").inc()
+            return contents, config
+        query = " ".join(part.text for part in (contents[-1].parts or []) if part.text)
+        try:
+            passages = self.search(query)
+        except Exception as e:
+            retrieval_logger.warning(f"Local retrieval failed, using the remote datastore: {e}")
+            retrieval_requests.labels("fallback").inc()
+            return contents, config
+        with self._lock:
+            local_config = self._local_config(config)
+        retrieval_requests.labels("local").inc()
+        if not passages:
+            return contents, local_config
+        message = types.Content(role="user", parts=[
+            types.Part.from_text(text=format_passages(passages)), *contents[-1].parts])
+        return contents[:-1] + [message], local_config
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                documents=len(self._documents),
+                chunks=len(self.index),
+                index=type(self.index).__name__,
+                index_bytes=self.index.nbytes,
+                last_sync=self._last_sync,
+            )
+        return stats
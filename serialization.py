@@ -0,0 +1,116 @@
+import gzip
+import json
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from google.genai import types
+
+
+def serialize_content(content: types.Content) -> Dict[str, Any]:
+    part_text = ""
+    if content.parts:
+        part_text = " ".join(
+            [part.text for part in content.parts if hasattr(part, 'text')])
+    return {"role": content.role, "text": part_text}
+
+
+def parse_history_window(args: Mapping[str, str], max_limit: int = 0) -> Tuple[int, Optional[int]]:
+    """
+    The since/limit query parameters of a history request, raises ValueError
+    on bad values. No limit returns everything from `since` on, unless
+    max_limit caps the page size.
+    """
+    try:
+        since = int(args.get("since", 0))
+        limit = int(args["limit"]) if "limit" in args else None
+    except ValueError:
+        raise ValueError("'since' and 'limit' must be integers.")
+    if since < 0 or (limit is not None and limit <= 0):
+        raise ValueError("'since' must be >= 0 and 'limit' > 0.")
+    if max_limit > 0:
+        limit = min(limit or max_limit, max_limit)
+    return since, limit
+
+
+def history_page_body(conversation_id: str, turns_json: bytes, count: int, total: int, since: int) -> bytes:
+    """
+    A history page as JSON, spliced together from the comma separated turn
+    JSON that ConversationHistory.serialized_turns keeps, instead of encoding
+    every turn again. `next` is the `since` of the following page, equal to
+    `length` once the client is up to date.
+    """
+    return b"".join((
+        b'{"conversation_id":', json.dumps(conversation_id).encode("utf-8"),
+        b',"history":[', turns_json,
+        b'],"length":%d,"since":%d,"next":%d}' % (total, since, since + count),
+    ))
+
+
+def compress_body(body: bytes, accept_encoding: str, min_size: int = 1024, level: int = 5) -> Tuple[bytes, Optional[str]]:
+    """
+    Gzips a response body if the client accepts it and it is worth it.
+    Returns the body and its Content-Encoding, None if left as is.
+    """
+    if len(body) < min_size or "gzip" not in (accept_encoding or "").lower():
+        return body, None
+    return gzip.compress(body, compresslevel=level), "gzip"
+
+
+def to_jsonable(value: Any) -> Any:
+    """
+    Converts genai pydantic objects (and lists of them) into plain JSON data,
+    leaving unset fields out so equal objects always dump the same way.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return value
+
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """
+    Formats one Server-Sent Events message.
+    """
+    message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+
+def error_status(error: BaseException) -> Tuple[int, str]:
+    """
+    The HTTP status and client-facing message for an error of a model call
+    that is reported in a body rather than as the response status.
+    """
+    from conversation import ConversationBusyError, ConversationNotFoundError
+    from deadline import DeadlineExceeded
+    from rate_limiter import RateLimitError
+
+    if isinstance(error, ConversationNotFoundError):
+        return 404, str(error)
+    if isinstance(error, ConversationBusyError):
+        return 409, str(error)
+    if isinstance(error, RateLimitError):
+        return 429, str(error)
+    if isinstance(error, DeadlineExceeded):
+        return 504, str(error)
+    if isinstance(error, (ValueError, TypeError)):
+        return 400, str(error)
+    return 500, "An internal server error occurred."
+
+
+def serialize_bulk_result(result) -> Dict[str, Any]:
+    """
+    One item of a bulk send as an HTTP-style status plus response or error.
+    """
+    data = {"index": result.index, "conversation_id": result.conversation_id}
+    if result.error is None:
+        data.update(status=200, response=result.response)
+    else:
+        status, message = error_status(result.error)
+        data.update(status=status, error=message)
+    if result.routing is not None:
+        data["routing"] = result.routing
+    return data
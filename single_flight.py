@@ -0,0 +1,110 @@
+"""
+Single-flight deduplication of identical model calls in flight.
+
+During news spikes many users ask the same first-turn question within
+seconds, and the response cache only helps once the first answer is back.
+SingleFlight lets the first of several concurrent identical calls (same
+canonical key as the response cache: model, config and every content sent)
+go upstream and hands its response to the others as they arrive, the way a
+cache hit would.
+
+Only deterministic requests are eligible, see is_coalescable. A leader that
+fails with an ordinary error shares it, since the followers would have hit the
+same. A leader that was cancelled (its client went away or its deadline
+passed) shares nothing, its followers try again and one of them leads.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from google.genai import types
+
+import deadline as deadlines
+import metrics
+from response_cache import is_cacheable
+
+coalesced_calls = metrics.registry.counter(
+    "model_calls_coalesced_total",
+    "Model calls answered by an identical call already in flight instead of going upstream.")
+
+
+def is_coalescable(config: Optional[types.GenerateContentConfig]) -> bool:
+    """
+    Seeded requests without a caller-supplied context cache, which is
+    somebody's own upstream resource.
+    """
+    return is_cacheable(config) and not config.cached_content
+
+
+class _Abandoned(Exception):
+    """
+    Set on a flight whose leader was cancelled, followers retry.
+    """
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(("leaders", "coalesced", "abandoned"), 0)
+
+    def join(self, key: str) -> Tuple[concurrent.futures.Future, bool]:
+        """
+        The flight for `key` and whether the caller leads it. A leader must
+        call finish() whatever happens, followers wait() for the result.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                coalesced_calls.inc()
+                return flight, False
+            flight = self._flights[key] = concurrent.futures.Future()
+            self._stats["leaders"] += 1
+            return flight, True
+
+    def finish(self, key: str, flight: concurrent.futures.Future,
+               response: Optional[types.GenerateContentResponse] = None, error: Optional[BaseException] = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if response is not None:
+            flight.set_result(response)
+            return
+        deadline = deadlines.current()
+        if not isinstance(error, Exception) or isinstance(error, deadlines.DeadlineExceeded) or \
+                (deadline is not None and deadline.expired):
+            with self._lock:
+                self._stats["abandoned"] += 1
+            error = _Abandoned()
+        flight.set_exception(error)
+
+    def wait(self, flight: concurrent.futures.Future, timeout: Optional[float] = None) -> Optional[types.GenerateContentResponse]:
+        """
+        The leader's response, None if it gave up. Raises its error, or
+        DeadlineExceeded if `timeout` passes first.
+        """
+        try:
+            return flight.result(timeout)
+        except _Abandoned:
+            return None
+        except concurrent.futures.TimeoutError:
+            raise deadlines.DeadlineExceeded(
+                "Request deadline exceeded waiting for an identical call in flight.") from None
+
+    async def async_wait(self, flight: concurrent.futures.Future, timeout: Optional[float] = None) -> Optional[types.GenerateContentResponse]:
+        # shielded, a follower that is cancelled must not cancel the flight for the others
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)), timeout)
+        except _Abandoned:
+            return None
+        except asyncio.TimeoutError:
+            raise deadlines.DeadlineExceeded(
+                "Request deadline exceeded waiting for an identical call in flight.") from None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        return stats
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.genai import types
+
+from batch_prediction import BatchPipeline, read_jsonl
+from config import GOOGLE_SEARCH_CONFIG
+from fake_genai import FakeClient
+
+PROMPTS = [(f"k{i}", f"summarize {i}") for i in range(5)]
+
+
+class TestBatchPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = os.path.join(self.tmp.name, "work")
+        self.output = os.path.join(self.tmp.name, "results.jsonl")
+        self.client = FakeClient()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def pipeline(self, **kwargs) -> BatchPipeline:
+        options = {"shard_size": 2, "poll_interval": 0, "max_attempts": 3}
+        options.update(kwargs)
+        return BatchPipeline(self.client, "fake-model", GOOGLE_SEARCH_CONFIG, self.work_dir, **options)
+
+    def results(self):
+        return {record["key"]: record["response"] for record in read_jsonl(self.output)}
+
+    def test_shards_requests_and_matches_results_by_key(self):
+        summary = self.pipeline().run(PROMPTS, self.output)
+
+        self.assertEqual(summary, {"total": 5, "succeeded": 5,
+                         "failed": 0, "jobs_submitted": 3})
+        self.assertEqual(self.results(), {
+            key: f"echo: {prompt}" for key, prompt in PROMPTS})
+        with open(os.path.join(self.work_dir, "attempt-000", "input-00000.jsonl")) as f:
+            line = json.loads(f.readline())
+        request = line["request"]
+        self.assertEqual(line["key"], "k0")
+        self.assertEqual(request["generationConfig"]["seed"], 0)
+        self.assertEqual(request["tools"], [{"googleSearch": {}}])
+        self.assertIn("parts", request["systemInstruction"])
+
+    def test_failed_lines_and_jobs_are_retried(self):
+        self.client.batches.fail_keys = {"k1": 1}
+        self.client.batches.fail_jobs = 1
+        summary = self.pipeline().run(PROMPTS, self.output)
+
+        self.assertEqual(summary["succeeded"], 5)
+        # 3 shards, then one retry shard for the failed job's 2 lines plus k1
+        self.assertEqual(summary["jobs_submitted"], 5)
+        self.assertEqual(len(self.results()), 5)
+
+    def test_resumes_failures_and_in_flight_jobs(self):
+        self.client.batches.fail_keys = {"k3": 2}
+        summary = self.pipeline(max_attempts=1).run(PROMPTS, self.output)
+        self.assertEqual(summary["failed"], 1)
+        with open(os.path.join(self.work_dir, "failed.jsonl")) as f:
+            self.assertEqual(json.loads(f.readline())["key"], "k3")
+
+        # a later run retries only k3
+        summary = self.pipeline(max_attempts=1).run(PROMPTS, self.output)
+        self.assertEqual((summary["failed"], summary["jobs_submitted"]), (1, 1))
+        summary = self.pipeline(max_attempts=1).run(PROMPTS, self.output)
+        self.assertEqual((summary["succeeded"], summary["failed"]), (5, 0))
+        self.assertEqual(len(list(read_jsonl(self.output))), 5)
+
+        # a job submitted by a run that died is collected, not resubmitted
+        prompts = PROMPTS + [("k9", "late")]
+        crashed = self.pipeline()
+        crashed._submit(9, crashed._write_shards(9, dict(prompts), ["k9"])[0])
+        summary = self.pipeline().run(prompts, self.output)
+        self.assertEqual((summary["succeeded"], summary["jobs_submitted"]), (6, 0))
+        self.assertEqual(self.results()["k9"], "echo: late")
+        self.assertEqual(self.client.batches.jobs["batchPredictionJobs/6"].state,
+                         types.JobState.JOB_STATE_SUCCEEDED)
+
+    def test_jobs_created_before_a_crash_are_found_by_display_name(self):
+        create = self.client.batches.create
+
+        def create_then_crash(**kwargs):
+            create(**kwargs)
+            raise KeyboardInterrupt
+
+        crashed = self.pipeline()
+        shards = crashed._write_shards(0, dict(PROMPTS), ["k0", "k1", "k2", "k3"])
+        with mock.patch.object(self.client.batches, "create", side_effect=create_then_crash):
+            with self.assertRaises(KeyboardInterrupt):
+                crashed._submit(0, shards[0])
+        # the crash came before the job was created
+        with mock.patch.object(self.client.batches, "create", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                crashed._submit(0, shards[1])
+
+        summary = self.pipeline().run(PROMPTS, self.output)
+        # the second shard is submitted once, then one new shard for k4
+        self.assertEqual((summary["succeeded"], summary["jobs_submitted"]), (5, 2))
+        self.assertEqual(len(self.client.batches.jobs), 3)
+        self.assertEqual(len(list(read_jsonl(self.output))), 5)
+
+    def test_a_partial_last_output_line_is_dropped_on_resume(self):
+        self.pipeline().run(PROMPTS[:2], self.output)
+        with open(self.output, "a", encoding="utf-8") as f:
+            f.write('{"key": "k2", "resp')
+        summary = self.pipeline().run(PROMPTS, self.output)
+        self.assertEqual((summary["succeeded"], summary["jobs_submitted"]), (5, 2))
+        self.assertEqual(sorted(self.results()), [key for key, _ in PROMPTS])
+
+
+if __name__ == "__main__":
+    unittest.main()
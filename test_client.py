@@ -1,3 +1,4 @@
+import json
 import unittest
 import requests
 import uuid
@@ -234,6 +235,64 @@ class TestConversationAPI(unittest.TestCase):
         print(
             f"Persistence Test: History after 2nd message has {len(history2)} items. Test passed.")
 
+    def test_10_stream_message_and_get_history(self):
+        """Test streaming a message as SSE and then retrieving the committed history."""
+        print("\nRunning test_10_stream_message_and_get_history...")
+        conversation_id = self._create_conversation()
+
+        message_payload = {"message": "Hello, streaming model!"}
+        response = requests.post(
+            f"{BASE_URL}/conversations/{conversation_id}/messages:stream",
+            json=message_payload,
+            stream=True,
+            timeout=300
+        )
+        self.assertEqual(response.status_code, 200,
+                         f"Stream message failed: {response.text}")
+        self.assertTrue(response.headers["Content-Type"].startswith(
+            "text/event-stream"))
+
+        chunks = []
+        done_response = None
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = None
+                continue
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                continue
+            payload = json.loads(line[len("data: "):])
+            self.assertNotEqual(event, "error", f"Stream failed: {payload}")
+            if event == "done":
+                done_response = payload["response"]
+            else:
+                chunks.append(payload["text"])
+        print(f"Received {len(chunks)} chunks")
+
+        self.assertIsNotNone(done_response)
+        self.assertEqual("".join(chunks), done_response)
+
+        get_response = requests.get(
+            f"{BASE_URL}/conversations/{conversation_id}", timeout=5)
+        self.assertEqual(get_response.status_code, 200)
+        history = get_response.json()["history"]
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[0]["text"], message_payload["message"])
+        self.assertEqual(history[1]["role"], "model")
+        self.assertEqual(history[1]["text"], done_response)
+
+    def test_11_stream_message_to_non_existent_conversation(self):
+        """Test streaming a message to a conversation that does not exist."""
+        print("\nRunning test_11_stream_message_to_non_existent_conversation...")
+        non_existent_id = str(uuid.uuid4())
+        response = requests.post(
+            f"{BASE_URL}/conversations/{non_existent_id}/messages:stream",
+            json={"message": "Hello?"},
+            timeout=5
+        )
+        self.assertEqual(response.status_code, 404)
+
 
 if __name__ == '__main__':
     unittest.main()
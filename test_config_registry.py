@@ -0,0 +1,75 @@
+import pickle
+import unittest
+
+from config import GOOGLE_SEARCH_CONFIG, FrozenGenerateContentConfig
+from config_registry import ConfigRegistry
+
+OVERRIDE = {
+    "temperature": 0.5,
+    "seed": 1,
+    "tools": [{"type": "google_search"}],
+    "system_instruction": [{"type": "text", "content": "hi"}],
+}
+
+
+class TestConfigRegistry(unittest.TestCase):
+
+    def test_equal_blobs_share_one_frozen_config(self):
+        registry = ConfigRegistry()
+        first = registry.compile(OVERRIDE)
+        reordered = registry.compile(dict(reversed(list(OVERRIDE.items()))))
+
+        self.assertIs(first, reordered)
+        self.assertIsInstance(first, FrozenGenerateContentConfig)
+        self.assertEqual((first.temperature, first.seed), (0.5, 1))
+        with self.assertRaises(ValueError):
+            first.seed = 2
+        self.assertEqual(first.model_copy(update={"seed": 2}).seed, 2)
+        stats = registry.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_nested_fields_are_frozen_and_not_shared(self):
+        registry = ConfigRegistry()
+        compiled = registry.compile(dict(OVERRIDE, thinking_config={"thinking_budget": 64}))
+        for frozen in (compiled, GOOGLE_SEARCH_CONFIG):
+            with self.assertRaises(ValueError):
+                frozen.thinking_config.thinking_budget = 0
+            with self.assertRaises(ValueError):
+                frozen.safety_settings[0].threshold = "BLOCK_NONE"
+            with self.assertRaises(TypeError):
+                frozen.tools.append(frozen.tools[0])
+        # derived and copied configs are the caller's own again
+        variant = compiled.model_copy(update={"thinking_config": compiled.thinking_config.model_copy(
+            update={"thinking_budget": 0})})
+        self.assertEqual((variant.thinking_config.thinking_budget, compiled.thinking_config.thinking_budget), (0, 64))
+        copied = compiled.model_copy(deep=True)
+        copied.tools.append(copied.tools[0])
+        self.assertEqual(len(compiled.tools), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(compiled)), compiled)
+
+    def test_lru_bound_and_invalid_blobs_not_cached(self):
+        registry = ConfigRegistry(max_entries=2)
+        for seed in range(3):
+            registry.compile({"seed": seed})
+        with self.assertRaises(ValueError):
+            registry.compile({"temperature": "hot"})
+
+        stats = registry.stats()
+        self.assertEqual((stats["entries"], stats["evicted"]), (2, 1))
+        self.assertEqual(stats["misses"], 4)
+
+    def test_resolve_presets(self):
+        registry = ConfigRegistry()
+        self.assertIs(registry.resolve(
+            config_id="google_search"), GOOGLE_SEARCH_CONFIG)
+        self.assertIs(registry.resolve(default=GOOGLE_SEARCH_CONFIG),
+                      GOOGLE_SEARCH_CONFIG)
+        # an explicit blob wins over the preset id
+        self.assertEqual(registry.resolve(
+            config_id="google_search", data={"seed": 7}).seed, 7)
+        with self.assertRaises(ValueError):
+            registry.resolve(config_id="nope")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+
+from google.genai import types
+
+from conftest import fresh_manager
+from context_cache import ContextCacheManager
+from conversation import ConversationHistory
+from fake_genai import FakeClient
+
+LONG_INSTRUCTION_CONFIG = types.GenerateContentConfig(
+    temperature=1,
+    seed=0,
+    tools=[types.Tool(google_search=types.GoogleSearch())],
+    system_instruction=[types.Part.from_text(
+        text="You are a news summary assistant. " * 20)],
+)
+
+
+def new_history(cache: ContextCacheManager) -> ConversationHistory:
+    history = ConversationHistory()
+    history.context_cache = cache
+    return history
+
+
+class TestContextCacheManager(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+
+    def test_small_prefix_is_sent_as_is(self):
+        cache = ContextCacheManager(self.client, min_tokens=100000)
+        history = new_history(cache)
+        history.send_message("fake-model", self.client,
+                             "hello", LONG_INSTRUCTION_CONFIG)
+
+        contents, config = self.client.models.last_request
+        self.assertIsNone(config.cached_content)
+        self.assertEqual(len(contents), 1)
+        self.assertEqual(cache.stats()["skipped"], 1)
+        self.assertEqual(self.client.caches.call_counts["create"], 0)
+
+    def test_system_prefix_is_shared_across_conversations(self):
+        cache = ContextCacheManager(self.client, min_tokens=50)
+        for message in ("first", "second", "third"):
+            new_history(cache).send_message(
+                "fake-model", self.client, message, LONG_INSTRUCTION_CONFIG)
+
+            contents, config = self.client.models.last_request
+            self.assertTrue(config.cached_content)
+            self.assertIsNone(config.system_instruction)
+            self.assertIsNone(config.tools)
+            self.assertEqual(config.temperature, 1)
+            self.assertEqual(len(contents), 1)
+
+        stats = cache.stats()
+        self.assertEqual(self.client.caches.call_counts["create"], 1)
+        self.assertEqual(stats["hits"], 2)
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
+        self.assertGreater(stats["tokens_saved"], 0)
+
+    def test_conversation_prefix_moves_in_steps(self):
+        cache = ContextCacheManager(self.client, min_tokens=50, prefix_step=4)
+        history = new_history(cache)
+        sent = []
+        for i in range(5):
+            history.send_message("fake-model", self.client,
+                                 f"message {i}", LONG_INSTRUCTION_CONFIG)
+            contents, _ = self.client.models.last_request
+            sent.append(len(contents))
+
+        # history lengths before each reply: 1, 3, 5, 7, 9 -> prefixes 0, 0, 4, 4, 8
+        self.assertEqual(sent, [1, 3, 1, 3, 1])
+        self.assertEqual(self.client.caches.call_counts["create"], 3)
+
+    def test_entries_are_refreshed_before_expiry(self):
+        cache = ContextCacheManager(
+            self.client, min_tokens=50, ttl=60, refresh_margin=120)
+        for _ in range(2):
+            new_history(cache).send_message(
+                "fake-model", self.client, "hi", LONG_INSTRUCTION_CONFIG)
+
+        self.assertEqual(self.client.caches.call_counts["update"], 1)
+        self.assertEqual(cache.stats()["refreshed"], 1)
+
+    def test_entry_deleted_upstream_is_recreated(self):
+        cache = ContextCacheManager(self.client, min_tokens=50)
+        new_history(cache).send_message(
+            "fake-model", self.client, "hi", LONG_INSTRUCTION_CONFIG)
+        self.client.caches.entries.clear()
+
+        history = new_history(cache)
+        with self.assertRaises(ValueError):
+            history.send_message("fake-model", self.client,
+                                 "hi", LONG_INSTRUCTION_CONFIG)
+        self.assertEqual(len(history), 0)
+
+        history.send_message("fake-model", self.client,
+                             "hi", LONG_INSTRUCTION_CONFIG)
+        self.assertEqual(self.client.caches.call_counts["create"], 2)
+
+    def test_reaper_drops_expired_entries(self):
+        cache = ContextCacheManager(self.client, min_tokens=50)
+        manager = fresh_manager(context_cache=cache, reap_interval=3600)
+        new_history(cache).send_message(
+            "fake-model", self.client, "hi", LONG_INSTRUCTION_CONFIG)
+        self.assertEqual(cache.stats()["entries"], 1)
+        for entry in cache._entries.values():
+            entry.expires_at = 0
+        manager.evict_idle()
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_lru_entries_are_deleted_upstream(self):
+        cache = ContextCacheManager(
+            self.client, min_tokens=10, max_entries=1)
+        for instruction in ("a " * 100, "b " * 100):
+            config = LONG_INSTRUCTION_CONFIG.model_copy(update={
+                "system_instruction": [types.Part.from_text(text=instruction)]})
+            new_history(cache).send_message(
+                "fake-model", self.client, "hi", config)
+
+        self.assertEqual(cache.stats()["evicted"], 1)
+        self.assertEqual(self.client.caches.call_counts["delete"], 1)
+        self.assertEqual(len(self.client.caches.entries), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
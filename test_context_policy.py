@@ -0,0 +1,86 @@
+import unittest
+
+from context_policy import SlidingWindowPolicy, estimate_tokens
+from conversation import ConversationHistory
+from fake_genai import FakeClient
+
+
+class RecordingSummarizer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, previous_summary, evicted):
+        self.calls.append(len(evicted))
+        return f"{previous_summary or ''}+{len(evicted)}"
+
+
+def texts(contents):
+    return [content.parts[0].text for content in contents]
+
+
+class TestSlidingWindowPolicy(unittest.TestCase):
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("abcdefgh"), 2)
+        self.assertEqual(estimate_tokens("你好"), 2)
+
+    def test_token_counts_are_cached_per_turn(self):
+        history = ConversationHistory()
+        history.send_message("fake-model", FakeClient(), "hello")
+        self.assertEqual(len(history.token_counts), 2)
+        counts = list(history.token_counts)
+        history.request_contents()
+        self.assertEqual(history.token_counts, counts)
+
+    def test_window_stays_within_budget_and_keeps_pinned_turns(self):
+        policy = SlidingWindowPolicy(max_tokens=60, pin_turns=2)
+        history = ConversationHistory(context_policy=policy)
+        client = FakeClient()
+        for i in range(20):
+            history.send_message("fake-model", client, f"message number {i}")
+
+        selected = history.request_contents()
+        self.assertLess(len(selected), len(history))
+        self.assertEqual(texts(selected[:2]), [
+                         "message number 0", "echo: message number 0"])
+        self.assertEqual(selected[-1].parts[0].text,
+                         "echo: message number 19")
+        self.assertEqual(selected[2].role, "user")
+        selected_tokens = sum(history.token_counts[:2]) + sum(
+            history.token_counts[len(history) - len(selected) + 2:])
+        self.assertLessEqual(selected_tokens, 60)
+
+    def test_evicted_turns_are_summarized_incrementally(self):
+        summarizer = RecordingSummarizer()
+        policy = SlidingWindowPolicy(max_tokens=80, summarizer=summarizer)
+        history = ConversationHistory(context_policy=policy)
+        client = FakeClient()
+        for i in range(30):
+            history.send_message("fake-model", client, f"message number {i}")
+
+        # hysteresis: the window only moves every few turns
+        self.assertGreater(len(summarizer.calls), 1)
+        self.assertLess(len(summarizer.calls), 30)
+        self.assertEqual(sum(summarizer.calls),
+                         history.context_state["window_start"])
+
+        selected = history.request_contents()
+        self.assertTrue(selected[0].parts[0].text.startswith(
+            "[Summary of the earlier conversation]"))
+
+    def test_roles_alternate_around_the_summary(self):
+        for pin_turns in (0, 1, 2, 3):
+            policy = SlidingWindowPolicy(max_tokens=80, pin_turns=pin_turns, summarizer=RecordingSummarizer())
+            history = ConversationHistory(context_policy=policy)
+            client = FakeClient()
+            for i in range(30):
+                history.send_message("fake-model", client, f"message number {i}")
+                roles = [content.role for content in client.models.last_request[0]]
+                self.assertEqual(roles, ["user", "model"] * (len(roles) // 2) + ["user"],
+                                 f"pin_turns={pin_turns}, turn {i}")
+            self.assertIn("window_start", history.context_state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import gzip
+import json
+import threading
+import unittest
+
+import time
+
+from conftest import fresh_manager
+from conversation import (
+    ConversationBusyError,
+    ConversationHistory,
+    ConversationNotFoundError,
+)
+from fake_genai import FakeClient, make_response
+from serialization import compress_body, history_page_body, parse_history_window
+
+
+class BlockingModels:
+    """Holds every generate_content call until `release` is set."""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def generate_content(self, model, contents, config=None):
+        self.entered.set()
+        self.release.wait(5)
+        return make_response(f"echo: {contents[-1].parts[0].text}")
+
+
+class FailingModels:
+    def generate_content(self, model, contents, config=None):
+        raise RuntimeError("upstream failure")
+
+
+class TestConversationHistory(unittest.TestCase):
+
+    def test_rollback_removes_only_own_turn(self):
+        history = ConversationHistory()
+        client = FakeClient()
+        history.send_message("fake-model", client, "first")
+
+        client.models = FailingModels()
+        with self.assertRaises(RuntimeError):
+            history.send_message("fake-model", client, "second")
+
+        self.assertEqual([c.role for c in history.contents], ["user", "model"])
+        self.assertEqual(history.contents[0].parts[0].text, "first")
+
+    def test_concurrent_turn_is_rejected(self):
+        history = ConversationHistory(busy_timeout=0)
+        client = FakeClient()
+        client.models = BlockingModels()
+
+        worker = threading.Thread(target=history.send_message,
+                                  args=("fake-model", client, "slow"))
+        worker.start()
+        self.assertTrue(client.models.entered.wait(5))
+        with self.assertRaises(ConversationBusyError):
+            history.send_message("fake-model", client, "concurrent")
+        client.models.release.set()
+        worker.join(5)
+
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history.contents[0].parts[0].text, "slow")
+
+    def test_concurrent_turns_are_queued_in_order(self):
+        history = ConversationHistory(busy_timeout=None)
+        client = FakeClient(latency=0.01)
+
+        workers = [
+            threading.Thread(target=history.send_message,
+                             args=("fake-model", client, f"message {i}"))
+            for i in range(8)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(5)
+
+        roles = [c.role for c in history.contents]
+        self.assertEqual(roles, ["user", "model"] * 8)
+        for user, model in zip(history.contents[::2], history.contents[1::2]):
+            self.assertEqual(model.parts[0].text,
+                             f"echo: {user.parts[0].text}")
+
+    def test_serialized_turns_pages_and_versions(self):
+        history = ConversationHistory()
+        client = FakeClient()
+        history.send_message("fake-model", client, "first")
+        turns_json, count, total, version = history.serialized_turns()
+        self.assertEqual((count, total), (2, 2))
+        self.assertEqual(json.loads(b"[" + turns_json + b"]")[1],
+                         {"role": "model", "text": "echo: first"})
+        self.assertEqual(history.serialized_turns()[3], version)
+
+        history.send_message("fake-model", client, "second")
+        page, count, total, newer = history.serialized_turns(since=2, limit=1)
+        self.assertEqual((count, total), (1, 4))
+        self.assertEqual(json.loads(page), {"role": "user", "text": "second"})
+        self.assertNotEqual(newer, version)
+        self.assertEqual(history.serialized_turns(since=9)[:2], (b"", 0))
+
+        body = json.loads(history_page_body("c1", page, count, total, 2))
+        self.assertEqual((body["history"], body["length"], body["next"]),
+                         ([{"role": "user", "text": "second"}], 4, 3))
+
+    def test_rolled_back_turn_changes_version(self):
+        history = ConversationHistory()
+        client = FakeClient()
+        history.send_message("fake-model", client, "first")
+        history.send_message("fake-model", client, "second")
+        # same length as before the rollback, different content
+        pending = history.add_user_message("pending")
+        _, _, _, pending_version = history.serialized_turns()
+        history._rollback(pending)
+        history.add_user_message("other")
+
+        turns_json, _, total, version = history.serialized_turns(since=4)
+        self.assertEqual(total, 5)
+        self.assertNotEqual(version, pending_version)
+        self.assertEqual(json.loads(turns_json)["text"], "other")
+        self.assertEqual(history.size_bytes, sum(
+            len(content.parts[0].text) for content in history.contents))
+
+    def test_history_window_and_compression(self):
+        self.assertEqual(parse_history_window({}), (0, None))
+        self.assertEqual(parse_history_window({"since": "4", "limit": "2"}), (4, 2))
+        self.assertEqual(parse_history_window({"limit": "500"}, max_limit=100), (0, 100))
+        for bad in ({"since": "-1"}, {"limit": "0"}, {"since": "x"}):
+            with self.assertRaises(ValueError):
+                parse_history_window(bad)
+
+        body = b'{"text": "' + b"hello " * 500 + b'"}'
+        compressed, encoding = compress_body(body, "gzip, deflate")
+        self.assertEqual((encoding, gzip.decompress(compressed)), ("gzip", body))
+        self.assertEqual(compress_body(body, "identity"), (body, None))
+        self.assertEqual(compress_body(b"{}", "gzip"), (b"{}", None))
+
+
+class TestConversationManager(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = fresh_manager()
+
+    def test_busy_conversation_does_not_block_others(self):
+        client = FakeClient()
+        blocking = BlockingModels()
+        busy_client = FakeClient()
+        busy_client.models = blocking
+
+        busy_id = self.manager.create_conversation()
+        other_id = self.manager.create_conversation()
+        worker = threading.Thread(
+            target=self.manager.send_message_to_conversation,
+            args=(busy_id, "fake-model", busy_client, "slow"))
+        worker.start()
+        self.assertTrue(blocking.entered.wait(5))
+
+        response = self.manager.send_message_to_conversation(
+            other_id, "fake-model", client, "hello")
+        self.assertEqual(response, "echo: hello")
+        self.assertIsNotNone(self.manager.get_conversation(busy_id))
+
+        blocking.release.set()
+        worker.join(5)
+        self.assertTrue(self.manager.delete_conversation(busy_id))
+        self.assertTrue(self.manager.delete_conversation(other_id))
+        self.assertIsNone(self.manager.get_conversation(busy_id))
+
+    def test_lru_eviction_by_count(self):
+        manager = fresh_manager(num_shards=1, max_conversations=2)
+        first = manager.create_conversation()
+        second = manager.create_conversation()
+        manager.get_conversation(first)  # second is now least recently used
+        third = manager.create_conversation()
+
+        self.assertIsNone(manager.get_conversation(second))
+        self.assertIsNotNone(manager.get_conversation(first))
+        self.assertIsNotNone(manager.get_conversation(third))
+        stats = manager.stats()
+        self.assertEqual(stats["conversations"], 2)
+        self.assertEqual(stats["evictions"]["max_conversations"], 1)
+
+    def test_eviction_by_history_bytes(self):
+        manager = fresh_manager(num_shards=1, max_history_bytes=100)
+        client = FakeClient()
+        old_id = manager.create_conversation()
+        manager.send_message_to_conversation(
+            old_id, "fake-model", client, "x" * 30)
+        self.assertEqual(manager.stats()["history_bytes"], 30 + 36)
+
+        new_id = manager.create_conversation()
+        manager.send_message_to_conversation(
+            new_id, "fake-model", client, "y" * 30)
+
+        self.assertIsNone(manager.get_conversation(old_id))
+        stats = manager.stats()
+        self.assertEqual(stats["history_bytes"], 30 + 36)
+        self.assertEqual(stats["evictions"]["max_history_bytes"], 1)
+
+    def test_idle_ttl(self):
+        manager = fresh_manager(idle_ttl=0.05, reap_interval=3600)
+        idle_id = manager.create_conversation()
+        time.sleep(0.1)
+        active_id = manager.create_conversation()
+
+        self.assertEqual(manager.evict_idle(), 1)
+        self.assertIsNone(manager.get_conversation(idle_id))
+        self.assertIsNotNone(manager.get_conversation(active_id))
+        self.assertEqual(manager.stats()["evictions"]["idle_ttl"], 1)
+
+    def test_send_messages_fans_out_and_isolates_failures(self):
+        manager = fresh_manager(fanout_workers=4)
+        client = FakeClient(latency=0.1)
+        ids = [manager.create_conversation() for _ in range(8)]
+        items = [(conversation_id, f"m{i}") for i, conversation_id in enumerate(ids)]
+        items += [(ids[0], "second"), ("missing", "lost")]
+
+        started = time.perf_counter()
+        results = sorted(manager.send_messages(
+            items, "fake-model", client), key=lambda r: r.index)
+        elapsed = time.perf_counter() - started
+
+        # 8 conversations on 4 workers take two rounds, not eight
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual([r.response for r in results[:9]],
+                         [f"echo: m{i}" for i in range(8)] + ["echo: second"])
+        self.assertIsInstance(results[9].error, ConversationNotFoundError)
+        # messages to one conversation keep their order
+        self.assertEqual([c.parts[0].text for c in manager.get_conversation(ids[0]).contents],
+                         ["m0", "echo: m0", "second", "echo: second"])
+
+
+if __name__ == '__main__':
+    unittest.main()
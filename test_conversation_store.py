@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from conftest import fresh_manager, reset_manager
+from conversation import ConversationBusyError, ConversationManager, ConversationNotFoundError
+from conversation_store import SQLiteConversationStore
+from fake_genai import FakeClient
+
+
+def worker_manager(db_path: str) -> ConversationManager:
+    # every gunicorn worker has its own ConversationManager singleton,
+    # emulate that by building a new instance per "worker"
+    return fresh_manager(store=SQLiteConversationStore(db_path))
+
+
+class TestSQLiteConversationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "conversations.db")
+        self.client = FakeClient()
+
+    def tearDown(self):
+        reset_manager()
+        self.tmp_dir.cleanup()
+
+    def test_conversation_visible_across_workers(self):
+        worker_a = worker_manager(self.db_path)
+        worker_b = worker_manager(self.db_path)
+
+        conversation_id = worker_a.create_conversation()
+        worker_a.send_message_to_conversation(
+            conversation_id, "fake-model", self.client, "first")
+
+        history_b = worker_b.get_conversation(conversation_id)
+        self.assertIsNotNone(history_b)
+        self.assertEqual(len(history_b), 2)
+
+        worker_b.send_message_to_conversation(
+            conversation_id, "fake-model", self.client, "second")
+        history_a = worker_a.get_conversation(conversation_id)
+        self.assertEqual([c.parts[0].text for c in history_a.contents],
+                         ["first", "echo: first", "second", "echo: second"])
+
+        self.assertTrue(worker_b.delete_conversation(conversation_id))
+        self.assertIsNone(worker_a.get_conversation(conversation_id))
+
+    def test_only_new_turns_are_loaded(self):
+        store = SQLiteConversationStore(self.db_path)
+        store.create("c1")
+        store.append_turns("c1", 0, [("user", "a"), ("model", "b")])
+        store.append_turns("c1", 2, [("user", "c"), ("model", "d")])
+
+        self.assertEqual(store.load_turns("c1", since=2),
+                         [("user", "c"), ("model", "d")])
+        self.assertIsNone(store.load_turns("missing"))
+
+    def test_conflicting_append_is_rejected(self):
+        store = SQLiteConversationStore(self.db_path)
+        store.create("c1")
+        store.append_turns("c1", 0, [("user", "a"), ("model", "b")])
+        with self.assertRaises(ConversationBusyError):
+            store.append_turns("c1", 0, [("user", "x"), ("model", "y")])
+        self.assertEqual(len(store.load_turns("c1")), 2)
+
+    def test_stale_worker_resyncs_before_sending(self):
+        worker_a = worker_manager(self.db_path)
+        worker_b = worker_manager(self.db_path)
+        conversation_id = worker_a.create_conversation()
+        history_b = worker_b.get_conversation(conversation_id)
+
+        worker_a.send_message_to_conversation(
+            conversation_id, "fake-model", self.client, "from a")
+        # worker b still holds the stale copy, the turn picks up a's messages first
+        history_b.send_message("fake-model", self.client, "from b")
+
+        self.assertEqual(len(history_b), 4)
+        self.assertEqual(len(worker_a.get_conversation(conversation_id)), 4)
+
+    def test_conversation_deleted_by_another_worker_is_not_found(self):
+        worker_a = worker_manager(self.db_path)
+        worker_b = worker_manager(self.db_path)
+        conversation_id = worker_a.create_conversation()
+        history_b = worker_b.get_conversation(conversation_id)
+        worker_a.delete_conversation(conversation_id)
+
+        with self.assertRaises(ConversationNotFoundError):
+            history_b.send_message("fake-model", self.client, "still there?")
+
+    def test_idle_conversations_are_purged(self):
+        store = SQLiteConversationStore(self.db_path)
+        store.create("c1")
+        self.assertEqual(store.delete_idle(idle_ttl=-1), 1)
+        self.assertIsNone(store.load_turns("c1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import time
+import unittest
+
+from google.genai import types
+
+from async_conversation import AsyncConversationHistory
+from conversation import ConversationHistory
+from deadline import Deadline, DeadlineExceeded, deadline_scope, parse_timeout, remaining, with_timeout
+from fake_genai import FakeClient
+from rate_limiter import RateLimitedClient, RateLimiter
+from test_rate_limiter import FlakyModels, api_error
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_parse_timeout(self):
+        self.assertIsNone(parse_timeout(None, 0))
+        self.assertEqual(parse_timeout(None, 30).timeout, 30)
+        self.assertEqual(parse_timeout("2.5", 30).timeout, 2.5)
+        self.assertEqual(parse_timeout("120", 30, maximum=60).timeout, 60)
+        self.assertEqual(parse_timeout(None, 0, maximum=60).timeout, 60)
+        for header in ("soon", "0", "-1"):
+            with self.assertRaises(ValueError):
+                parse_timeout(header, 30)
+
+    def test_scope_resets_and_sets_genai_timeout(self):
+        deadline = Deadline(5)
+        with deadline_scope(deadline):
+            self.assertLessEqual(remaining(), 5)
+        self.assertIsNone(remaining())
+
+        config = types.GenerateContentConfig(temperature=0.5)
+        timed = with_timeout(config, deadline)
+        self.assertIsNone(config.http_options)
+        self.assertEqual(timed.temperature, 0.5)
+        self.assertTrue(4000 < timed.http_options.timeout <= 5000)
+        self.assertIs(with_timeout(config, None), config)
+        with self.assertRaises(DeadlineExceeded):
+            with_timeout(config, Deadline(0))
+
+    def test_turn_past_deadline_is_rolled_back(self):
+        client = FakeClient(latency=3)
+        history = ConversationHistory()
+        started = time.monotonic()
+        with deadline_scope(Deadline(0.05)):
+            with self.assertRaises(DeadlineExceeded):
+                history.send_message("fake-model", client, "hello")
+        # the call went out with the remaining time, rounded up to a second
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(len(history), 0)
+
+    def test_closing_a_stream_cancels_the_upstream_call(self):
+        client = FakeClient(chunk_count=4)
+        history = ConversationHistory()
+        stream = history.send_message_stream("fake-model", client, "hello there")
+        next(stream)
+        stream.close()
+        self.assertEqual(client.models.cancelled_count, 1)
+        self.assertEqual(len(history), 0)
+
+    def test_async_call_is_cancelled_at_the_deadline(self):
+        client = FakeClient(latency=5)
+        history = AsyncConversationHistory()
+
+        async def main():
+            # long enough to reach the model call on a busy machine, far below its latency
+            with deadline_scope(Deadline(0.5)):
+                with self.assertRaises(DeadlineExceeded):
+                    await history.send_message("fake-model", client, "hello")
+
+        asyncio.run(main())
+        self.assertEqual(client.aio.models.cancelled_count, 1)
+        self.assertEqual(len(history), 0)
+
+    def test_rate_limiter_does_not_retry_past_deadline(self):
+        models = FlakyModels([api_error(503)] * 3)
+        fake = FakeClient()
+        fake.models = models
+        limiter = RateLimiter(base_delay=5, max_delay=5)
+        # jitter would allow a retry now and then, a fixed backoff past the deadline must not
+        limiter.backoff = lambda attempt: 5.0
+        client = RateLimitedClient(fake, limiter)
+        with deadline_scope(Deadline(1)):
+            with self.assertRaises(Exception):
+                client.models.generate_content(model="m", contents="hi")
+        self.assertEqual(models.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
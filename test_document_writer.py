@@ -0,0 +1,141 @@
+import time
+import unittest
+from unittest import mock
+
+import bigquery_app
+from document_writer import DocumentWriter
+from fake_bigquery import FakeBigQueryClient
+
+
+def document(idx, **fields):
+    return dict({"idx": idx, "title": f"Title {idx}", "type": "news", "text": f"Text of {idx}."}, **fields)
+
+
+class TestDocumentWriter(unittest.TestCase):
+
+    def test_full_buffer_is_written_in_one_job(self):
+        client = FakeBigQueryClient()
+        writer = DocumentWriter(client, "p.d.documents", max_rows=100, max_delay=60)
+        futures = writer.submit([document(str(i)) for i in range(100)])
+        self.assertTrue(all(future.result(timeout=5).ok for future in futures))
+        self.assertEqual((client.load_jobs, len(client.rows)), (1, 100))
+        writer.close()
+
+    def test_partial_buffer_is_written_after_the_delay(self):
+        client = FakeBigQueryClient()
+        writer = DocumentWriter(client, "p.d.documents", max_rows=1000, max_delay=0.2)
+        started_at = time.monotonic()
+        futures = writer.submit([document("a")]) + writer.submit([document("b"), document("c")])
+        self.assertTrue(all(future.result(timeout=5).ok for future in futures))
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.2)
+        self.assertEqual(client.load_jobs, 1)
+        self.assertEqual(writer.stats()["written"], 3)
+        writer.close()
+
+    def test_stream_mode_fails_rows_one_by_one(self):
+        client = FakeBigQueryClient()
+        writer = DocumentWriter(client, "p.d.documents", mode="stream", max_rows=3)
+        results = [future.result(timeout=5) for future in writer.submit(
+            [document("a"), document(None), document("c")])]
+        self.assertEqual([result.ok for result in results], [True, False, True])
+        self.assertIn("idx", results[1].error)
+        self.assertEqual((client.insert_calls, sorted(client.rows)), (1, ["a", "c"]))
+        writer.close()
+
+    def test_load_mode_fails_only_the_invalid_rows(self):
+        client = FakeBigQueryClient()
+        writer = DocumentWriter(client, "p.d.documents", max_rows=8, max_delay=60)
+        # two callers share one flush, the invalid row of the first must not fail the second
+        futures = writer.submit([document("a"), document("b"), document(None)]) + writer.submit(
+            [document(str(i)) for i in range(5)])
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual([result.ok for result in results], [True, True, False] + [True] * 5)
+        self.assertIn("idx", results[2].error)
+        self.assertEqual(sorted(client.rows), ["0", "1", "2", "3", "4", "a", "b"])
+        # the failed job, then halves down to the invalid row
+        self.assertEqual((client.load_jobs, writer.stats()["splits"]), (7, 3))
+        writer.close()
+
+    def test_load_errors_not_caused_by_rows_are_not_split(self):
+        client = FakeBigQueryClient()
+        writer = DocumentWriter(client, "p.d.documents", max_rows=4, max_delay=60)
+        with mock.patch.object(client, "load_table_from_json", side_effect=ConnectionError("reset")) as load:
+            results = [future.result(timeout=5) for future in writer.submit([document(str(i)) for i in range(4)])]
+        self.assertFalse(any(result.ok for result in results))
+        self.assertEqual((load.call_count, writer.stats()["splits"]), (1, 0))
+        writer.close()
+
+    def test_ids_waiting_to_be_written_conflict(self):
+        client = FakeBigQueryClient()
+        writer = DocumentWriter(client, "p.d.documents", max_rows=10, max_delay=60)
+        first = writer.submit([document("a")])
+        second = writer.submit([document("a"), document("b")])
+        self.assertTrue(second[0].result(timeout=0).conflict)
+        self.assertIn("a", writer)
+        writer.close(timeout=5)
+        self.assertTrue(first[0].result(timeout=0).ok and second[1].result(timeout=0).ok)
+        self.assertNotIn("a", writer)
+        self.assertEqual((client.load_jobs, writer.stats()["conflicts"]), (1, 1))
+
+    def test_backpressure_and_close(self):
+        client = FakeBigQueryClient()
+        writer = DocumentWriter(client, "p.d.documents", max_rows=10, max_delay=60, max_buffered=3)
+        futures = writer.submit([document("a"), document("b")])
+        with self.assertRaises(BufferError):
+            writer.submit([document("c"), document("d")])
+        # close writes what is still buffered
+        writer.close(timeout=5)
+        self.assertTrue(all(future.result(timeout=0).ok for future in futures))
+        self.assertEqual(writer.stats()["rejected"], 2)
+        with self.assertRaises(RuntimeError):
+            writer.submit([document("e")])
+
+
+class TestBatchEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeBigQueryClient([document("old")])
+        self.writer = DocumentWriter(self.client, bigquery_app.TABLE_ID, mode="stream", max_delay=0.05)
+        patches = [mock.patch.object(bigquery_app, "client", self.client),
+                   mock.patch.object(bigquery_app, "document_writer", self.writer)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.writer.close)
+        self.app = bigquery_app.app.test_client()
+
+    def test_reports_a_status_per_document(self):
+        response = self.app.post("/documents:batch", json={"documents": [
+            document("new"), document("old"), {"title": "no text", "type": "news"},
+            document("new"), {"title": "t", "type": "news", "text": "generated id"},
+            document("typed", title={"not": "a string"}), document(7)]})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual([result["status"] for result in body["results"]], [201, 409, 400, 409, 201, 400, 400])
+        self.assertEqual((body["succeeded"], body["failed"]), (2, 5))
+        self.assertIn("title", body["results"][5]["error"])
+        self.assertIn(body["results"][4]["idx"], self.client.rows)
+        self.assertEqual(self.client.insert_calls, 1)
+        # the existing ids came from one parameterized query
+        self.assertEqual(sum("UNNEST(@ids)" in query for query in self.client.queries), 1)
+
+    def test_buffered_ids_conflict_across_requests(self):
+        self.writer.max_delay = 60
+        self.writer.submit([document("queued")])
+        response = self.app.post("/documents:batch", json={"documents": [document("queued")]})
+        self.assertEqual(response.get_json()["results"][0]["status"], 409)
+        response = self.app.post("/documents", json=document("queued"))
+        self.assertEqual(response.status_code, 409)
+
+    def test_rejects_bad_bodies_and_full_buffers(self):
+        self.assertEqual(self.app.post("/documents:batch", json={"documents": []}).status_code, 400)
+        with mock.patch.object(bigquery_app, "MAX_BATCH_DOCUMENTS", 1):
+            response = self.app.post("/documents:batch", json={"documents": [document("x"), document("y")]})
+            self.assertEqual(response.status_code, 400)
+        self.writer.max_buffered = 0
+        response = self.app.post("/documents:batch", json={"documents": [document("x")]})
+        self.assertEqual(response.status_code, 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from google.genai import errors
+
+from fake_genai import FakeClient, fixed, lognormal, parse_latency, uniform
+
+
+class TestFakeBackend(unittest.TestCase):
+
+    def test_latency_distributions_are_seeded(self):
+        first = FakeClient(latency=lognormal(1.0, 0.5), seed=7).models
+        second = FakeClient(latency=lognormal(1.0, 0.5), seed=7).models
+        samples = [first._sample_latency() for _ in range(200)]
+        self.assertEqual(samples, [second._sample_latency() for _ in range(200)])
+        self.assertAlmostEqual(sorted(samples)[100], 1.0, delta=0.2)
+
+        low_high = [uniform(0.5, 3)(FakeClient(seed=i).models._rng) for i in range(20)]
+        self.assertTrue(all(0.5 <= value <= 3 for value in low_high))
+        self.assertEqual(parse_latency("2")(None), 2.0)
+        self.assertEqual(parse_latency("fixed:0.5")(None), fixed(0.5)(None))
+        with self.assertRaises(ValueError):
+            parse_latency("gamma:1")
+
+    def test_injects_errors_at_the_given_rate(self):
+        client = FakeClient(error_rate=0.3, error_codes=(429,), seed=1)
+        failures = 0
+        for _ in range(500):
+            try:
+                client.models.generate_content(model="m", contents=["hi"])
+            except errors.ClientError as e:
+                self.assertEqual(e.code, 429)
+                failures += 1
+        self.assertEqual(failures, client.models.error_count)
+        self.assertAlmostEqual(failures / 500, 0.3, delta=0.06)
+
+    def test_stream_cadence(self):
+        client = FakeClient(latency=0.2, chunk_count=4, chunk_interval=0.01)
+        self.assertEqual(client.models._chunk_delays(4), [0.2, 0.01, 0.01, 0.01])
+        client.models.chunk_interval = None
+        self.assertEqual(client.models._chunk_delays(4), [0.05] * 4)
+        chunks = list(FakeClient(chunk_count=4).models.generate_content_stream(model="m", contents=["hi"]))
+        self.assertEqual("".join(chunk.text for chunk in chunks), "echo: hi")
+
+
+if __name__ == "__main__":
+    unittest.main()
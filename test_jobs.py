@@ -0,0 +1,175 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import app as chat_app
+from conversation import ConversationBusyError
+from fake_genai import FakeClient
+from jobs import FAILED, SUCCEEDED, JobQueue, QueueFullError
+
+
+def wait_for(jobs, timeout=5):
+    end = time.monotonic() + timeout
+    while not all(job.done for job in jobs) and time.monotonic() < end:
+        time.sleep(0.01)
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.close(5)
+
+    def new_queue(self, **kwargs) -> JobQueue:
+        queue = JobQueue(**kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def blocked(self, queue, conversation_id="blocker"):
+        """Occupies the only worker until the returned event is set."""
+        release = threading.Event()
+        job = queue.submit(conversation_id, lambda: release.wait(5) and {})
+        while job.status != "running":
+            time.sleep(0.01)
+        return release
+
+    def test_runs_jobs_by_priority(self):
+        queue = self.new_queue(workers=1)
+        release = self.blocked(queue)
+        order = []
+        jobs = [queue.submit(f"c{priority}", lambda p=priority: order.append(p) or {"response": p},
+                             priority=priority) for priority in (0, 5, -1, 5)]
+        release.set()
+        wait_for(jobs)
+        self.assertEqual(order, [5, 5, 0, -1])
+        self.assertEqual(jobs[1].to_dict()["result"], {"response": 5})
+        self.assertIn("queue_seconds", jobs[2].to_dict())
+
+    def test_keeps_turns_of_a_conversation_in_order(self):
+        queue = self.new_queue(workers=4)
+        order, running = [], set()
+
+        def run(i, conversation_id):
+            # a second turn of the same conversation must never overlap
+            self.assertNotIn(conversation_id, running)
+            running.add(conversation_id)
+            time.sleep(0.02)
+            order.append((conversation_id, i))
+            running.discard(conversation_id)
+            return {}
+
+        jobs = [queue.submit(cid, lambda i=i, cid=cid: run(i, cid), priority=i)
+                for i in range(4) for cid in ("a", "b")]
+        wait_for(jobs)
+        self.assertTrue(all(job.status == SUCCEEDED for job in jobs))
+        for cid in ("a", "b"):
+            self.assertEqual([i for c, i in order if c == cid], [0, 1, 2, 3])
+
+    def test_errors_are_reported_with_their_status(self):
+        queue = self.new_queue()
+
+        def busy():
+            raise ConversationBusyError("busy")
+
+        job = queue.submit("c", busy)
+        wait_for([job])
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.to_dict()["error"], {"status": 409, "message": "busy"})
+        self.assertEqual(queue.stats()[FAILED], 1)
+
+    def test_rejects_jobs_beyond_max_queued(self):
+        queue = self.new_queue(workers=1, max_queued=1)
+        release = self.blocked(queue)
+        queue.submit("c", dict)
+        with self.assertRaises(QueueFullError):
+            queue.submit("d", dict)
+        self.assertEqual(queue.stats()["queued"], 1)
+        release.set()
+
+    def test_webhooks_are_restricted_and_retried(self):
+        delivered, attempts = [], []
+
+        def post(url, payload):
+            attempts.append(url)
+            if len(attempts) == 1:
+                raise ConnectionError("refused")
+            delivered.append(payload)
+
+        with self.assertRaises(ValueError):
+            self.new_queue().submit("c", dict, webhook="https://example.com/hook")
+        queue = self.new_queue(webhook_prefixes=("https://hooks.example.com", "https://api.test/cb"), post=post)
+        for url in ("https://hooks.example.com.evil.test/", "https://hooks.example.com@evil.test/",
+                    "http://hooks.example.com/", "https://hooks.example.com:8443/", "https://api.test/cbx",
+                    "not a url"):
+            with self.assertRaises(ValueError, msg=url):
+                queue.check_webhook(url)
+        queue.check_webhook("https://HOOKS.example.com:443/x")
+        queue.check_webhook("https://api.test/cb/1")
+        job = queue.submit("c", lambda: {"response": "hi"}, webhook="https://hooks.example.com/done")
+        queue.close(5)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(delivered[0]["job_id"], job.id)
+        self.assertEqual(delivered[0]["result"], {"response": "hi"})
+
+    def test_finished_jobs_expire(self):
+        queue = self.new_queue(retention=0.05)
+        job = queue.submit("c", dict)
+        wait_for([job])
+        time.sleep(0.1)
+        queue.submit("c", dict)
+        self.assertIsNone(queue.get(job.id))
+
+
+class TestJobRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue(workers=1, webhook_prefixes=("https://hooks.example.com",), post=lambda url, payload: None)
+        self.addCleanup(self.queue.close, 5)
+        for patch in (mock.patch.object(chat_app, "client", FakeClient()),
+                      mock.patch.object(chat_app, "job_queue", self.queue)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.app = chat_app.app.test_client()
+        self.messages_url = f"/conversations/{self.app.post('/conversations').get_json()['conversation_id']}/messages"
+
+    def poll(self, url):
+        for _ in range(500):
+            response = self.app.get(url)
+            if response.get_json()["status"] in (SUCCEEDED, FAILED):
+                return response
+            self.assertEqual(response.headers["Retry-After"], "1")
+            time.sleep(0.01)
+        self.fail(f"{url} did not finish")
+
+    def test_prefer_respond_async_answers_202_and_the_job_is_polled(self):
+        response = self.app.post(self.messages_url, json={"message": "hi", "model_name": "fake-model"},
+                                 headers={"Prefer": "respond-async"})
+        self.assertEqual(response.status_code, 202)
+        body = response.get_json()
+        self.assertEqual(response.headers["Location"], body["status_url"])
+        self.assertEqual(body["status_url"], f"/jobs/{body['job_id']}")
+
+        job = self.poll(body["status_url"]).get_json()
+        self.assertEqual(job["status"], SUCCEEDED)
+        self.assertTrue(job["result"]["response"])
+        self.assertEqual(self.app.get("/jobs/unknown").status_code, 404)
+
+    def test_async_flag_checks_priority_and_webhook(self):
+        message = {"message": "hi", "model_name": "fake-model", "async": True}
+        self.assertEqual(self.app.post(self.messages_url, json=dict(message, priority="high")).status_code, 400)
+        response = self.app.post(self.messages_url, json=dict(message, webhook="https://hooks.example.com@evil.test/"))
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post(self.messages_url, json=dict(message, webhook="https://hooks.example.com/done"))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.poll(response.headers["Location"]).get_json()["status"], SUCCEEDED)
+        # without async the message is answered inline
+        response = self.app.post(self.messages_url, json={"message": "again", "model_name": "fake-model"})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
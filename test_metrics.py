@@ -0,0 +1,110 @@
+import threading
+import unittest
+
+from flask import Flask, Response
+from google.genai import types
+
+import metrics
+from fake_genai import FakeClient
+from metrics import InstrumentedClient, Registry
+
+
+def sample(text: str, line_prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not in exposition:\n{text}")
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counters_are_summed_over_threads(self):
+        registry = Registry()
+        counter = registry.counter("jobs_total", "Jobs.", ("kind",))
+
+        def work():
+            for _ in range(1000):
+                counter.labels("a").inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # finished threads were folded into the retired total before any scrape
+        self.assertEqual(len(counter.labels("a")._values._shards), 0)
+        counter.labels("a").inc()  # from a live thread, after the others retired
+
+        text = registry.exposition()
+        self.assertEqual(sample(text, 'jobs_total{kind="a"}'), 8001)
+        self.assertIn("# TYPE jobs_total counter", text)
+        self.assertEqual(len(counter.labels("a")._values._shards), 1)
+
+    def test_short_lived_threads_do_not_pile_up_arrays(self):
+        registry = Registry()
+        histogram = registry.histogram("request_seconds", "Requests.", buckets=(0.1, 1))
+        # a thread per request, as werkzeug serves them
+        for _ in range(200):
+            thread = threading.Thread(target=histogram.labels().observe, args=(0.5,))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(histogram.labels()._values._shards), 0)
+        buckets, total = histogram.labels().snapshot()
+        self.assertEqual((buckets, total), ([0, 200, 200], 100))
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+
+        text = registry.exposition()
+        self.assertEqual(sample(text, 'latency_seconds_bucket{le="0.1"}'), 2)
+        self.assertEqual(sample(text, 'latency_seconds_bucket{le="1"}'), 3)
+        self.assertEqual(sample(text, 'latency_seconds_bucket{le="+Inf"}'), 4)
+        self.assertEqual(sample(text, "latency_seconds_count"), 4)
+        self.assertAlmostEqual(sample(text, "latency_seconds_sum"), 2.65)
+
+    def test_instrumented_client_records_calls_and_first_token(self):
+        client = InstrumentedClient(FakeClient())
+        model = "metrics-test-model"
+        contents = [types.Content(role="user", parts=[types.Part.from_text(text="hi")])]
+        client.models.generate_content(model=model, contents=contents)
+        chunks = list(client.models.generate_content_stream(model=model, contents=contents))
+        self.assertEqual("".join(chunk.text for chunk in chunks), "echo: hi")
+
+        text = metrics.registry.exposition()
+        self.assertEqual(sample(
+            text, f'model_request_duration_seconds_count{{model="{model}",method="generate_content"}}'), 1)
+        self.assertEqual(sample(
+            text, f'model_request_duration_seconds_count{{model="{model}",method="generate_content_stream"}}'), 1)
+        self.assertEqual(sample(text, f'model_time_to_first_token_seconds_count{{model="{model}"}}'), 1)
+        self.assertEqual(sample(text, f'model_requests_in_flight{{model="{model}"}}'), 0)
+        self.assertGreater(sample(text, f'model_tokens_total{{model="{model}",type="input"}}'), 0)
+
+    def test_flask_routes_are_timed_until_the_stream_closes(self):
+        app = Flask(__name__)
+        metrics.instrument_flask(app)
+
+        @app.route("/metrics-test/<string:item>")
+        def stream(item):
+            return Response(iter(["a", "b"]), mimetype="text/plain")
+
+        test_client = app.test_client()
+        response = test_client.get("/metrics-test/x")
+        self.assertEqual(response.data, b"ab")
+        # the server closes the response once the body is sent, the test client doesn't
+        self.assertEqual(sample(
+            metrics.registry.exposition(), 'http_requests_in_flight{route="/metrics-test/<string:item>"}'), 1)
+        response.close()
+        test_client.get("/metrics-test-missing").close()
+
+        text = metrics.registry.exposition()
+        self.assertEqual(sample(
+            text, 'http_request_duration_seconds_count{route="/metrics-test/<string:item>",method="GET",status="200"}'), 1)
+        self.assertEqual(sample(text, 'http_requests_in_flight{route="/metrics-test/<string:item>"}'), 0)
+        self.assertGreaterEqual(sample(text, 'errors_total{source="http",type="404"}'), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import asyncio
+import unittest
+
+from async_conversation import AsyncConversationManager
+from conftest import fresh_manager
+from fake_genai import FakeClient
+from model_router import ModelRouter, RoutingDecision, parse_routes
+
+
+def router_over(*clients, slo: float = 1.0, **kwargs) -> ModelRouter:
+    routes = parse_routes(",".join(f"model-{i}@region-{i}:{slo}" for i in range(len(clients))))
+    for route, client in zip(routes, clients):
+        route.client = client
+    return ModelRouter(routes, **kwargs)
+
+
+class TestModelRouter(unittest.TestCase):
+
+    def test_parse_routes(self):
+        routes = parse_routes("gemini-2.5-flash@us-central1:4, gemini-2.5-pro")
+        self.assertEqual([(r.model, r.region, r.slo) for r in routes],
+                         [("gemini-2.5-flash", "us-central1", 4.0), ("gemini-2.5-pro", None, 10.0)])
+        self.assertEqual(routes[0].name, "gemini-2.5-flash@us-central1")
+
+    def test_prefers_first_route_until_it_misses_its_slo(self):
+        router = router_over(FakeClient(), FakeClient())
+        first, second = router.routes
+        self.assertEqual(router.choose(), (first, "preferred"))
+        router.record_success(first, 5.0)  # way over the 1s SLO
+        self.assertEqual(router.choose(), (second, "slo"))
+        router.record_success(second, 3.0)
+        # nobody meets the SLO, take the faster one
+        self.assertEqual(router.choose(), (second, "fastest"))
+
+    def test_stale_routes_are_probed_again(self):
+        router = router_over(FakeClient(), FakeClient(), probe_interval=0)
+        first, _ = router.routes
+        router.record_success(first, 5.0)
+        self.assertIs(router.choose()[0], first)
+
+    def test_fails_over_and_keeps_history_consistent(self):
+        manager = fresh_manager()
+        failing = FakeClient(error_rate=1.0, error_codes=(503,))
+        router = router_over(failing, FakeClient(), failure_threshold=2)
+        conversation_id = manager.create_conversation()
+
+        for message in ("one", "two"):
+            decision = RoutingDecision()
+            response = router.call(lambda route: manager.send_message_to_conversation(
+                conversation_id, route.model, route.client, message), decision)
+            self.assertEqual(response, f"echo: {message}")
+            self.assertEqual(decision.to_dict()["route"], "model-1@region-1")
+            self.assertEqual(decision.to_dict()["failovers"],
+                             [{"route": "model-0@region-0", "error": "ServerError"}])
+
+        contents = manager.get_conversation(conversation_id).contents
+        self.assertEqual([c.parts[0].text for c in contents],
+                         ["one", "echo: one", "two", "echo: two"])
+        # two failures in a row take the first route out of rotation
+        self.assertTrue(router.stats()["routes"]["model-0@region-0"]["open"])
+        decision = RoutingDecision()
+        router.call(lambda route: route.client.models.generate_content(
+            model=route.model, contents=["hi"]), decision)
+        self.assertEqual((decision.route.name, decision.attempts), ("model-1@region-1", []))
+
+    def test_bulk_items_are_routed_one_by_one(self):
+        manager = fresh_manager()
+        router = router_over(FakeClient(error_rate=1.0, error_codes=(503,)), FakeClient(), failure_threshold=10)
+        items = [(manager.create_conversation(), f"message {i}") for i in range(3)]
+
+        results = sorted(manager.send_messages(items, model_name="auto", client=None, router=router))
+        self.assertEqual([result.response for result in results], [f"echo: message {i}" for i in range(3)])
+        self.assertEqual({result.routing["route"] for result in results}, {"model-1@region-1"})
+        # once the first route failed, later items may skip it altogether
+        self.assertIn([{"route": "model-0@region-0", "error": "ServerError"}],
+                      [result.routing["failovers"] for result in results])
+        # every item was reported to the router
+        routes = router.stats()["routes"]
+        self.assertEqual(routes["model-1@region-1"]["samples"], 3)
+        self.assertGreater(routes["model-0@region-0"]["error_rate"], 0)
+
+        async def run_async():
+            manager = fresh_manager(AsyncConversationManager)
+            items = [(manager.create_conversation(), "async")]
+            return [result async for result in manager.send_messages(
+                items, model_name="auto", client=None, router=router)]
+
+        result, = asyncio.run(run_async())
+        self.assertEqual((result.response, result.routing["route"]), ("echo: async", "model-1@region-1"))
+
+    def test_non_retryable_errors_do_not_fail_over(self):
+        router = router_over(FakeClient(error_rate=1.0, error_codes=(400,)), FakeClient())
+        with self.assertRaises(Exception) as ctx:
+            router.call(lambda route: route.client.models.generate_content(
+                model=route.model, contents=["hi"]))
+        self.assertEqual(ctx.exception.code, 400)
+
+    def test_last_error_is_raised_when_routes_are_exhausted(self):
+        router = router_over(FakeClient(error_rate=1.0), FakeClient(error_rate=1.0))
+        with self.assertRaises(Exception) as ctx:
+            router.call(lambda route: route.client.models.generate_content(
+                model=route.model, contents=["hi"]))
+        self.assertEqual(ctx.exception.code, 503)
+
+    def test_streams_fail_over_before_the_first_chunk(self):
+        router = router_over(FakeClient(error_rate=1.0), FakeClient())
+        decision = RoutingDecision()
+        chunks = list(router.stream(lambda route: route.client.models.generate_content_stream(
+            model=route.model, contents=["hi"]), decision))
+        self.assertEqual("".join(chunk.text for chunk in chunks), "echo: hi")
+        self.assertEqual(decision.route.name, "model-1@region-1")
+
+        async def run_async():
+            decision = RoutingDecision()
+
+            async def chunks_of(route):
+                async for chunk in await route.client.aio.models.generate_content_stream(
+                        model=route.model, contents=["hi"]):
+                    yield chunk.text
+
+            text = "".join([chunk async for chunk in router.async_stream(chunks_of, decision)])
+            response = await router.async_call(lambda route: route.client.aio.models.generate_content(
+                model=route.model, contents=["hi"]))
+            return text, response.text, decision
+
+        text, response_text, decision = asyncio.run(run_async())
+        self.assertEqual((text, response_text), ("echo: hi", "echo: hi"))
+        self.assertEqual(decision.route.name, "model-1@region-1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from google.genai import errors, types
+
+from fake_genai import FakeClient, make_response
+from rate_limiter import AIMDLimiter, RateLimitedClient, RateLimiter, RateLimitError, TokenBucket
+
+
+def api_error(code: int) -> errors.APIError:
+    cls = errors.ClientError if code < 500 else errors.ServerError
+    return cls(code, {"error": {"code": code, "message": "simulated", "status": "SIMULATED"}})
+
+
+class FlakyModels:
+    """Fails with the queued errors first, then answers with the given usage."""
+
+    def __init__(self, failures=(), total_tokens=None):
+        self.failures = list(failures)
+        self.total_tokens = total_tokens
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        usage = types.GenerateContentResponseUsageMetadata(
+            total_token_count=self.total_tokens, candidates_token_count=1) if self.total_tokens else None
+        return make_response("ok", usage)
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.02)
+            return self._next()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def generate_content_stream(self, model, contents, config=None):
+        response = self._next()
+        yield response
+        yield response
+
+
+def limited_client(models, **kwargs) -> RateLimitedClient:
+    fake = FakeClient()
+    fake.models = models
+    kwargs.setdefault("base_delay", 0)
+    return RateLimitedClient(fake, RateLimiter(**kwargs))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_retries_throttling_and_backs_off_concurrency(self):
+        models = FlakyModels([api_error(429), api_error(503)])
+        client = limited_client(models, max_concurrency=8)
+
+        response = client.models.generate_content(model="m", contents="hi")
+        self.assertEqual(response.text, "ok")
+        self.assertEqual(models.calls, 3)
+        stats = client.limiter.stats()
+        self.assertEqual((stats["retries"], stats["throttled"]), (2, 2))
+        # both 429 and 503 came within the cooldown, one halving only
+        self.assertEqual(stats["concurrency"]["limit"], 4)
+
+    def test_gives_up_with_rate_limit_error_and_skips_client_errors(self):
+        client = limited_client(FlakyModels([api_error(429)] * 3), max_retries=2)
+        with self.assertRaises(RateLimitError):
+            client.models.generate_content(model="m", contents="hi")
+
+        models = FlakyModels([api_error(400)])
+        client = limited_client(models)
+        with self.assertRaises(errors.ClientError):
+            client.models.generate_content(model="m", contents="hi")
+        self.assertEqual(models.calls, 1)
+
+    def test_stream_retries_before_first_chunk(self):
+        models = FlakyModels([api_error(429)])
+        client = limited_client(models)
+        chunks = list(client.models.generate_content_stream(
+            model="m", contents="hi"))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(client.limiter.concurrency.in_flight, 0)
+
+    def test_concurrency_limit_bounds_in_flight_calls(self):
+        models = FlakyModels()
+        client = limited_client(models, max_concurrency=2)
+        threads = [threading.Thread(target=client.models.generate_content,
+                                    kwargs={"model": "m", "contents": "hi"}) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(models.max_in_flight, 2)
+        self.assertEqual(client.limiter.stats()["queue_wait"]["count"], 6)
+
+    def test_token_bucket_settles_usage_and_rejects_long_waits(self):
+        bucket = TokenBucket(per_minute=600, burst_seconds=1)  # 10 tokens/s
+        self.assertEqual(bucket.reserve(10), 0)
+        self.assertAlmostEqual(bucket.reserve(5), 0.5, places=1)
+
+        # a response that used far more tokens than estimated leaves debt behind
+        client = limited_client(FlakyModels(total_tokens=1000), tpm=600, max_wait=1)
+        client.models.generate_content(model="m", contents="hi")
+        with self.assertRaises(RateLimitError) as ctx:
+            client.models.generate_content(model="m", contents="hi")
+        self.assertGreater(ctx.exception.retry_after, 1)
+        self.assertEqual(client.limiter.stats()["rejected"], 1)
+
+    def test_async_calls_share_the_limiter(self):
+        limiter = AIMDLimiter(max_limit=1)
+
+        async def main():
+            self.assertTrue(await limiter.async_acquire())
+            self.assertFalse(await limiter.async_acquire(timeout=0.05))
+            waiter = asyncio.ensure_future(limiter.async_acquire(timeout=1))
+            await asyncio.sleep(0.01)
+            limiter.release()
+            self.assertTrue(await waiter)
+
+            client = RateLimitedClient(FakeClient(), RateLimiter(base_delay=0))
+            response = await client.aio.models.generate_content(model="m", contents=["hi"])
+            stream = await client.aio.models.generate_content_stream(model="m", contents=["hi"])
+            chunks = [chunk async for chunk in stream]
+            return response, chunks
+
+        response, chunks = asyncio.run(main())
+        self.assertEqual(response.text, "echo: hi")
+        self.assertEqual("".join(chunk.text for chunk in chunks), "echo: hi")
+
+
+if __name__ == "__main__":
+    unittest.main()
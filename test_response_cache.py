@@ -0,0 +1,104 @@
+import time
+import unittest
+
+from google.genai import types
+
+from conversation import ConversationHistory
+from fake_genai import FakeClient
+from response_cache import ResponseCache
+
+SEEDED_CONFIG = types.GenerateContentConfig(temperature=1, seed=0)
+SEARCH_CONFIG = types.GenerateContentConfig(
+    seed=0, tools=[types.Tool(google_search=types.GoogleSearch())])
+
+
+def new_history(cache: ResponseCache) -> ConversationHistory:
+    history = ConversationHistory()
+    history.response_cache = cache
+    return history
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+
+    def test_hit_skips_model_call_but_records_turn(self):
+        cache = ResponseCache()
+        first = new_history(cache)
+        first.send_message("fake-model", self.client,
+                           "headlines?", SEEDED_CONFIG)
+        second = new_history(cache)
+        second.send_message("fake-model", self.client,
+                            "headlines?", SEEDED_CONFIG)
+
+        self.assertEqual(self.client.models.call_count, 1)
+        self.assertEqual([c.parts[0].text for c in second.contents],
+                         ["headlines?", "echo: headlines?"])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_key_covers_model_config_and_contents(self):
+        cache = ResponseCache()
+        contents = [types.Content(
+            role="user", parts=[types.Part.from_text(text="hi")])]
+        key = cache.key("model-a", SEEDED_CONFIG, contents)
+        self.assertEqual(key, cache.key(
+            "model-a", SEEDED_CONFIG.model_copy(), contents))
+        self.assertNotEqual(key, cache.key("model-b", SEEDED_CONFIG, contents))
+        self.assertNotEqual(key, cache.key(
+            "model-a", SEEDED_CONFIG.model_copy(update={"temperature": 0.5}), contents))
+
+    def test_bypass_and_unseeded_requests(self):
+        cache = ResponseCache()
+        for use_cache, config in ((False, SEEDED_CONFIG), (True, types.GenerateContentConfig())):
+            for _ in range(2):
+                new_history(cache).send_message(
+                    "fake-model", self.client, "hi", config, use_cache=use_cache)
+
+        self.assertEqual(self.client.models.call_count, 4)
+        self.assertEqual(cache.stats()["bypassed"], 4)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_search_configs_expire_sooner(self):
+        cache = ResponseCache(ttl=600, search_ttl=0.05)
+        self.assertEqual(cache.ttl_for(SEARCH_CONFIG), 0.05)
+        self.assertEqual(cache.ttl_for(SEEDED_CONFIG), 600)
+
+        new_history(cache).send_message(
+            "fake-model", self.client, "news", SEARCH_CONFIG)
+        time.sleep(0.1)
+        new_history(cache).send_message(
+            "fake-model", self.client, "news", SEARCH_CONFIG)
+
+        self.assertEqual(self.client.models.call_count, 2)
+        self.assertEqual(cache.stats()["expired"], 1)
+
+    def test_size_bounded_lru(self):
+        cache = ResponseCache(max_entries=2)
+        for message in ("a", "b", "a", "c", "a"):
+            new_history(cache).send_message(
+                "fake-model", self.client, message, SEEDED_CONFIG)
+
+        self.assertEqual(self.client.models.call_count, 3)
+        self.assertEqual(cache.stats()["evicted"], 1)
+
+    def test_streamed_responses_are_cached(self):
+        cache = ResponseCache()
+        streamed = new_history(cache)
+        chunks = list(streamed.send_message_stream(
+            "fake-model", self.client, "stream me", SEEDED_CONFIG))
+        self.assertGreater(len(chunks), 1)
+
+        cached = new_history(cache)
+        chunks = list(cached.send_message_stream(
+            "fake-model", self.client, "stream me", SEEDED_CONFIG))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].text, "echo: stream me")
+        self.assertEqual(cached.contents[-1].parts[0].text, "echo: stream me")
+        self.assertEqual(self.client.models.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+
+import numpy as np
+from google.genai import types
+
+from conversation import ConversationHistory
+from fake_bigquery import FakeBigQueryClient
+from fake_genai import FakeClient
+from retrieval import BigQueryDocumentSource, HashingEmbedder, LocalRetriever, chunk_text
+from vector_index import FlatIndex, IVFIndex
+
+VERTEX_SEARCH = types.Tool(retrieval=types.Retrieval(
+    vertex_ai_search=types.VertexAISearch(datastore="projects/p/locations/global/dataStores/d")))
+RAG = types.GenerateContentConfig(seed=0, tools=[VERTEX_SEARCH])
+
+DOCUMENTS = [
+    {"idx": "a", "title": "Rocket launch", "url": "https://news/a",
+     "text": "The rocket launch was delayed by strong winds. Engineers expect a new launch window next week."},
+    {"idx": "b", "title": "Harvest", "url": None,
+     "text": "Farmers report a record rice harvest this autumn thanks to steady rain."},
+    {"idx": "c", "title": "台风", "url": "https://news/c",
+     "text": "台风今晚登陆沿海城市。航班全部取消，学校停课。"},
+]
+
+
+def new_retriever(rows=DOCUMENTS, **kwargs):
+    client = FakeBigQueryClient(rows)
+    retriever = LocalRetriever(BigQueryDocumentSource(client, "p.d.documents"), HashingEmbedder(), **kwargs)
+    return client, retriever
+
+
+class TestVectorIndex(unittest.TestCase):
+
+    def test_flat_search_replace_and_remove(self):
+        index = FlatIndex(3, initial_capacity=2)
+        index.add("x", [[1, 0, 0], [0, 1, 0]])
+        index.add("y", [[0, 0, 1]])
+        self.assertEqual(index.search([0.9, 0.1, 0], 2)[0][0], ("x", 0))
+        index.add("x", [[0, 0.8, 0.2]])
+        self.assertEqual(len(index), 2)
+        self.assertEqual([label for label, _ in index.search([0, 1, 0], 5)], [("x", 0), ("y", 0)])
+        self.assertTrue(index.remove("y"))
+        self.assertEqual([label for label, _ in index.search([0, 0, 1], 5)], [("x", 0)])
+
+    def test_ivf_agrees_with_flat_search(self):
+        rng = np.random.default_rng(1)
+        centers = rng.normal(size=(8, 32))
+        vectors = np.repeat(centers, 100, axis=0) + 0.05 * rng.normal(size=(800, 32))
+        flat, ivf = FlatIndex(32), IVFIndex(32, nlist=8, nprobe=2, min_train_size=400)
+        for i, vector in enumerate(vectors):
+            flat.add(i, vector)
+            ivf.add(i, vector)
+        hits = 0
+        for query in centers + 0.05 * rng.normal(size=centers.shape):
+            expected = {label for label, _ in flat.search(query, 10)}
+            hits += len(expected & {label for label, _ in ivf.search(query, 10)})
+        self.assertTrue(ivf.trained)
+        self.assertGreaterEqual(hits / 80, 0.9)
+
+
+class TestLocalRetriever(unittest.TestCase):
+
+    def test_chunks_overlap_and_respect_the_size(self):
+        text = "".join(f"Sentence number {i} is here. " for i in range(40))
+        chunks = chunk_text(text, max_chars=120, overlap=30)
+        self.assertTrue(all(len(chunk) <= 120 for chunk in chunks))
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(chunk_text("  "), [])
+        self.assertEqual(len(chunk_text("台风今晚登陆。" * 3, max_chars=10, overlap=0)), 3)
+
+    def test_sync_is_incremental(self):
+        client, retriever = new_retriever()
+        self.assertEqual(retriever.sync(), {"added": 3, "updated": 0, "deleted": 0})
+        self.assertEqual(retriever.sync(), {"added": 0, "updated": 0, "deleted": 0})
+        # the second sync fetched nothing
+        self.assertEqual(sum("UNNEST" in query for query in client.queries), 1)
+
+        client.upsert(idx="b", title="Harvest", url=None, text="Drought ruined the wheat this year.")
+        client.delete("c")
+        client.upsert(idx="d", title="Markets", url=None, text="Stocks rallied on Friday.")
+        self.assertEqual(retriever.sync(), {"added": 1, "updated": 1, "deleted": 1})
+        self.assertEqual(retriever.stats()["documents"], 3)
+        self.assertEqual(retriever.search("wheat drought", 1)[0].doc_id, "b")
+
+    def test_search_finds_the_matching_document(self):
+        _, retriever = new_retriever()
+        retriever.sync()
+        best = retriever.search("why was the rocket launch delayed?", 2)[0]
+        self.assertEqual((best.doc_id, best.title), ("a", "Rocket launch"))
+        self.assertEqual(retriever.search("台风登陆", 1)[0].doc_id, "c")
+
+    def test_passages_replace_the_remote_datastore(self):
+        _, retriever = new_retriever(top_k=1)
+        retriever.sync()
+        client = FakeClient()
+        history = ConversationHistory()
+        history.retriever = retriever
+        history.send_message("fake-model", client, "rocket launch delayed?", RAG)
+
+        contents, config = client.models.last_request
+        self.assertIsNone(config.tools)
+        self.assertIn("Rocket launch (https://news/a)", contents[-1].parts[0].text)
+        self.assertEqual(contents[-1].parts[1].text, "rocket launch delayed?")
+        # the history keeps the message alone, and the shared config is untouched
+        self.assertEqual(history.turn_at(0), ("user", "rocket launch delayed?"))
+        self.assertEqual(len(RAG.tools), 1)
+
+    def test_falls_back_to_the_remote_datastore(self):
+        _, retriever = new_retriever()
+        client = FakeClient()
+        history = ConversationHistory()
+        history.retriever = retriever
+        # not synced yet
+        history.send_message("fake-model", client, "rocket?", RAG)
+        self.assertEqual(client.models.last_request[1].tools, RAG.tools)
+        # requests without the tool are left alone
+        history.send_message("fake-model", client, "rocket?", types.GenerateContentConfig(seed=0))
+        self.assertEqual(len(client.models.last_request[0][-1].parts), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
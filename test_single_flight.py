@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from google.genai import errors, types
+
+from async_conversation import AsyncConversationHistory
+from conversation import ConversationHistory
+from deadline import Deadline, DeadlineExceeded, deadline_scope
+from fake_genai import FakeClient
+from single_flight import SingleFlight, is_coalescable
+
+SEEDED = types.GenerateContentConfig(seed=0)
+
+
+def new_history(flight: SingleFlight, history_class=ConversationHistory) -> ConversationHistory:
+    history = history_class()
+    history.single_flight = flight
+    return history
+
+
+def send_concurrently(client, flight, count, config=SEEDED, stagger=0.02):
+    """Sends the same first message from `count` conversations, the first one well ahead."""
+    results = [None] * count
+
+    def send(i):
+        try:
+            results[i] = new_history(flight).send_message(
+                "fake-model", client, "headlines?", config).text
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_identical_calls_share_one_upstream_call(self):
+        client = FakeClient(latency=0.3)
+        flight = SingleFlight()
+        results = send_concurrently(client, flight, 5)
+        self.assertEqual(results, ["echo: headlines?"] * 5)
+        self.assertEqual(client.models.call_count, 1)
+        self.assertEqual(flight.stats(), {"leaders": 1, "coalesced": 4, "abandoned": 0, "in_flight": 0})
+
+    def test_only_seeded_requests_without_own_cache_coalesce(self):
+        self.assertFalse(is_coalescable(None))
+        self.assertFalse(is_coalescable(types.GenerateContentConfig(temperature=0)))
+        self.assertFalse(is_coalescable(types.GenerateContentConfig(seed=0, cached_content="cachedContents/1")))
+
+        client = FakeClient(latency=0.1)
+        results = send_concurrently(client, SingleFlight(), 3, config=types.GenerateContentConfig())
+        self.assertEqual(results, ["echo: headlines?"] * 3)
+        self.assertEqual(client.models.call_count, 3)
+
+    def test_followers_share_the_leaders_error(self):
+        client = FakeClient(latency=0.3, error_rate=1.0, seed=1)
+        results = send_concurrently(client, SingleFlight(), 3)
+        self.assertTrue(all(isinstance(result, errors.APIError) for result in results))
+        self.assertEqual(client.models.error_count, 1)
+
+    def test_streaming_follower_gets_the_answer_in_one_chunk(self):
+        client = FakeClient(latency=0.3, chunk_count=3)
+        flight = SingleFlight()
+        leader = threading.Thread(target=new_history(flight).send_message,
+                                  args=("fake-model", client, "headlines?", SEEDED))
+        leader.start()
+        time.sleep(0.05)
+        history = new_history(flight)
+        chunks = list(history.send_message_stream("fake-model", client, "headlines?", SEEDED))
+        leader.join(5)
+        self.assertEqual([chunk.text for chunk in chunks], ["echo: headlines?"])
+        self.assertEqual(history.turn_at(-1), ("model", "echo: headlines?"))
+        self.assertEqual(client.models.call_count, 1)
+
+    def test_follower_takes_over_from_a_cancelled_leader(self):
+        client = FakeClient(latency=0.3)
+        flight = SingleFlight()
+
+        async def leader():
+            with deadline_scope(Deadline(0.1)):
+                await new_history(flight, AsyncConversationHistory).send_message(
+                    "fake-model", client, "headlines?", SEEDED)
+
+        async def follower():
+            await asyncio.sleep(0.02)
+            history = new_history(flight, AsyncConversationHistory)
+            return await history.send_message("fake-model", client, "headlines?", SEEDED)
+
+        async def main():
+            return await asyncio.gather(leader(), follower(), return_exceptions=True)
+
+        first, second = asyncio.run(main())
+        self.assertIsInstance(first, DeadlineExceeded)
+        self.assertEqual(second.text, "echo: headlines?")
+        self.assertEqual(client.aio.models.cancelled_count, 1)
+        self.assertEqual(flight.stats()["abandoned"], 1)
+        self.assertEqual(flight.stats()["leaders"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
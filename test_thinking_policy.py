@@ -0,0 +1,150 @@
+import unittest
+
+from google.genai import types
+
+from conversation import ConversationHistory
+from fake_genai import FakeClient, make_response
+from thinking_policy import AdaptiveThinkingPolicy, FixedThinkingPolicy, ThinkingChoice
+
+THINKING_CONFIG = types.GenerateContentConfig(
+    temperature=1, max_output_tokens=8192,
+    thinking_config=types.ThinkingConfig(thinking_budget=1024))
+SEARCH_CONFIG = THINKING_CONFIG.model_copy(
+    update={"tools": [types.Tool(google_search=types.GoogleSearch())]})
+
+LONG_MESSAGE = "Summarize today's news on the European energy market in detail. " * 8
+
+
+def history_with(*messages: str) -> ConversationHistory:
+    history = ConversationHistory()
+    for i, message in enumerate(messages):
+        if i:
+            history.add_model_response("ok")
+        history.add_user_message(message)
+    return history
+
+
+def response_with(thinking_tokens: int, finish_reason=types.FinishReason.STOP) -> types.GenerateContentResponse:
+    response = make_response("ok", types.GenerateContentResponseUsageMetadata(
+        thoughts_token_count=thinking_tokens, candidates_token_count=10))
+    response.candidates[0].finish_reason = finish_reason
+    return response
+
+
+def budget_of(config: types.GenerateContentConfig) -> int:
+    return config.thinking_config.thinking_budget
+
+
+class TestAdaptiveThinkingPolicy(unittest.TestCase):
+
+    def test_buckets_by_size_turn_and_tools(self):
+        policy = AdaptiveThinkingPolicy()
+        self.assertEqual(policy.bucket(history_with("thanks!"), THINKING_CONFIG), "tiny/first/none")
+        self.assertEqual(policy.bucket(history_with("hi", LONG_MESSAGE), SEARCH_CONFIG),
+                         "long/followup/search")
+
+    def test_initial_budgets_scale_with_message_size(self):
+        policy = AdaptiveThinkingPolicy(explore_rate=0)
+        tiny, choice = policy.choose(history_with("thanks!"), "m", THINKING_CONFIG)
+        self.assertEqual((budget_of(tiny), tiny.max_output_tokens), (0, 1024))
+        self.assertEqual(choice.group, "adaptive")
+
+        short, _ = policy.choose(history_with("What is the capital of France?"), "m", THINKING_CONFIG)
+        self.assertEqual(budget_of(short), 256)
+        self.assertEqual(short.max_output_tokens, 8192)
+
+        # long messages keep the configured budget, the config is not copied
+        long, _ = policy.choose(history_with(LONG_MESSAGE), "m", THINKING_CONFIG)
+        self.assertIs(long, THINKING_CONFIG)
+
+    def test_budgets_respect_the_model_floor(self):
+        policy = AdaptiveThinkingPolicy(explore_rate=0)
+        pro, choice = policy.choose(history_with("thanks!"), "gemini-2.5-pro", THINKING_CONFIG)
+        self.assertEqual((budget_of(pro), choice.thinking_budget), (128, 128))
+        # the bucket itself is shared, other models still get 0
+        flash, _ = policy.choose(history_with("thanks!"), "gemini-2.5-flash", THINKING_CONFIG)
+        self.assertEqual(budget_of(flash), 0)
+
+    def test_derived_configs_are_reused_and_keep_other_fields(self):
+        policy = AdaptiveThinkingPolicy(explore_rate=0)
+        first, _ = policy.choose(history_with("thanks!"), "m", SEARCH_CONFIG)
+        second, _ = policy.choose(history_with("cheers"), "m", SEARCH_CONFIG)
+        self.assertIs(first, second)
+        self.assertEqual(first.tools, SEARCH_CONFIG.tools)
+        self.assertEqual(budget_of(SEARCH_CONFIG), 1024)
+
+    def test_configs_without_budget_are_left_alone(self):
+        policy = AdaptiveThinkingPolicy(explore_rate=0)
+        config = types.GenerateContentConfig(temperature=1)
+        self.assertEqual(policy.choose(history_with("thanks!"), "m", config), (config, None))
+        self.assertEqual(policy.choose(history_with("thanks!"), "m", None), (None, None))
+
+    def test_control_group_sets_budget_from_observed_demand(self):
+        policy = AdaptiveThinkingPolicy(explore_rate=1, min_samples=3, seed=1)
+        history = history_with(LONG_MESSAGE)
+        for _ in range(3):
+            config, choice = policy.choose(history, "m", THINKING_CONFIG)
+            self.assertIs(config, THINKING_CONFIG)
+            self.assertEqual(choice.group, "control")
+            policy.observe(choice, response_with(200), 2.0)
+
+        policy.explore_rate = 0
+        config, choice = policy.choose(history, "m", THINKING_CONFIG)
+        # 200 x 1.5 headroom, rounded up to 64
+        self.assertEqual(budget_of(config), 320)
+        policy.observe(choice, response_with(150), 1.0)
+
+        bucket = policy.stats()["buckets"]["long/first/none"]
+        self.assertEqual(bucket["control"]["requests"], 3)
+        self.assertEqual(bucket["saved"], {"latency_seconds": 1.0, "thinking_tokens": 50.0})
+
+    def test_saturated_budget_grows(self):
+        policy = AdaptiveThinkingPolicy(explore_rate=0)
+        history = history_with("What is the capital of France?")
+        config, choice = policy.choose(history, "m", THINKING_CONFIG)
+        policy.observe(choice, response_with(256), 1.0)
+        config, _ = policy.choose(history, "m", THINKING_CONFIG)
+        self.assertEqual(budget_of(config), 512)
+
+    def test_truncated_answers_lift_output_cap(self):
+        policy = AdaptiveThinkingPolicy(explore_rate=0)
+        history = history_with("thanks!")
+        _, choice = policy.choose(history, "m", THINKING_CONFIG)
+        policy.observe(choice, response_with(0, types.FinishReason.MAX_TOKENS), 1.0)
+        config, _ = policy.choose(history, "m", THINKING_CONFIG)
+        self.assertEqual(config.max_output_tokens, 8192)
+        self.assertEqual(budget_of(config), 0)
+
+
+class TestThinkingPolicyInConversation(unittest.TestCase):
+
+    def test_request_goes_out_with_chosen_budget_and_is_observed(self):
+        client = FakeClient()
+        history = ConversationHistory()
+        history.thinking_policy = AdaptiveThinkingPolicy(explore_rate=0)
+        history.send_message("fake-model", client, "thanks!", THINKING_CONFIG)
+
+        _, sent_config = client.models.last_request
+        self.assertEqual(budget_of(sent_config), 0)
+        stats = history.thinking_policy.stats()
+        self.assertEqual(stats["buckets"]["tiny/first/none"]["adaptive"]["requests"], 1)
+
+    def test_fixed_policy_only_reports(self):
+        client = FakeClient()
+        history = ConversationHistory()
+        history.thinking_policy = FixedThinkingPolicy()
+        for message in ("thanks!", "ok"):
+            history.send_message("fake-model", client, message, THINKING_CONFIG)
+
+        self.assertIs(client.models.last_request[1], THINKING_CONFIG)
+        stats = history.thinking_policy.stats()["buckets"]
+        self.assertEqual(stats["tiny/first/none"]["fixed"]["requests"], 1)
+        self.assertEqual(stats["tiny/followup/none"]["fixed"]["requests"], 1)
+
+    def test_fixed_choice_carries_configured_budget(self):
+        _, choice = FixedThinkingPolicy().choose(history_with("thanks!"), "m", THINKING_CONFIG)
+        self.assertEqual(choice, ThinkingChoice("tiny/first/none", "fixed", 1024, 8192))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import threading
+import unittest
+
+from conversation import ConversationHistory
+from fake_genai import FakeClient
+from turn_store import CompactTurnStore, ContentsView, ContentTurnStore
+
+TURNS = [("user", "hello"), ("model", "你好, how can I help?"), ("user", ""), ("model", "bye 👋")]
+
+
+def filled(store_class):
+    store = store_class()
+    for role, text in TURNS:
+        store.append(role, text)
+    return store
+
+
+class TestTurnStores(unittest.TestCase):
+
+    def test_stores_agree(self):
+        for store_class in (CompactTurnStore, ContentTurnStore):
+            store = filled(store_class)
+            self.assertEqual(len(store), 4)
+            self.assertEqual([(store.role(i), store.text(i)) for i in range(4)], TURNS)
+            self.assertEqual([store.size(i) for i in range(4)],
+                             [len(text.encode("utf-8")) for _, text in TURNS])
+            self.assertEqual((store.role(-1), store.text(-1)), TURNS[-1])
+            content = store.content(1)
+            self.assertEqual((content.role, content.parts[0].text), TURNS[1])
+
+    def test_truncate_drops_tail(self):
+        store = filled(CompactTurnStore)
+        store.truncate(2)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.text(-1), TURNS[1][1])
+        self.assertEqual(store.append("user", "again"), 2)
+        self.assertEqual(store.text(2), "again")
+        with self.assertRaises(IndexError):
+            store.text(3)
+
+    def test_readers_never_see_half_appended_turns(self):
+        store = CompactTurnStore()
+        done = threading.Event()
+        errors = []
+
+        def read():
+            while not done.is_set():
+                try:
+                    if len(store):
+                        store.text(-1)
+                except IndexError as e:
+                    errors.append(e)
+
+        # switch threads as often as possible, between the statements of append
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            for i in range(50000):
+                store.append("user" if i % 2 else "model", f"turn {i}")
+        finally:
+            done.set()
+            reader.join()
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(errors, [])
+
+    def test_contents_view_builds_contents_on_access(self):
+        view = ContentsView(filled(CompactTurnStore))
+        self.assertEqual(len(view), 4)
+        self.assertEqual(view[0].parts[0].text, "hello")
+        self.assertEqual([c.role for c in view[::2]], ["user", "user"])
+        self.assertIsInstance(view[:], list)
+        self.assertEqual([c.role for c in view], [role for role, _ in TURNS])
+
+    def test_history_sends_materialized_contents(self):
+        client = FakeClient()
+        history = ConversationHistory()
+        history.send_message("fake-model", client, "first")
+        history.send_message("fake-model", client, "second")
+        contents, _ = client.models.last_request
+        self.assertEqual([c.parts[0].text for c in contents],
+                         ["first", "echo: first", "second"])
+        self.assertEqual(history.turn_at(-1), ("model", "echo: second"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,331 @@
+"""
+Thinking policies decide the thinking budget and output cap of each request.
+
+Both built-in configs grant thinking_budget=1024, so "thanks!" pays the same
+thinking latency and tokens as "summarize today's news on X". FixedThinkingPolicy
+keeps whatever the config says and only reports what it costs.
+AdaptiveThinkingPolicy buckets requests by cheap features (message length,
+first turn or follow-up, tools in use) and starts each bucket from a heuristic
+budget. A small control group keeps the configured budget; the
+thoughts_token_count it observes tells how much thinking a bucket really
+wants, and the bucket's budget follows that demand with some headroom.
+Requests that use up their reduced budget grow it again. Budgets never go
+below what the model accepts, pro models reject anything under 128.
+
+The control group doubles as the baseline for the report: per bucket, the
+average latency and thinking tokens of control and adaptive requests, and
+what the adaptive ones saved.
+
+The policy runs in ConversationHistory.prepare_call on a response cache
+miss, right before the request goes out, and learns in finish_call.
+"""
+import abc
+import logging
+import math
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from google.genai import types
+
+import metrics
+from context_policy import estimate_tokens
+
+thinking_logger = logging.getLogger(__name__)
+
+thinking_requests = metrics.registry.counter(
+    "thinking_policy_requests_total", "Requests per thinking policy, bucket and group.",
+    ("policy", "bucket", "group"))
+thinking_tokens_saved = metrics.registry.counter(
+    "thinking_policy_tokens_saved_total",
+    "Thinking tokens below the control group's average for the same bucket.", ("policy",))
+
+
+class ThinkingChoice(NamedTuple):
+    """
+    What the policy picked for one request, handed back to observe().
+    """
+    bucket: str
+    group: str  # "adaptive", "control" or "fixed"
+    thinking_budget: Optional[int]
+    max_output_tokens: Optional[int]
+
+
+def tool_kind(config: Optional[types.GenerateContentConfig]) -> str:
+    for tool in (config.tools or []) if config is not None else []:
+        if getattr(tool, "google_search", None):
+            return "search"
+        if getattr(tool, "retrieval", None):
+            return "retrieval"
+    return "none"
+
+
+# model name prefix -> lowest thinking_budget the model accepts, others take 0
+MIN_THINKING_BUDGETS = {
+    "gemini-2.5-pro": 128,
+}
+
+
+def min_thinking_budget(model_name: str) -> int:
+    for prefix, budget in MIN_THINKING_BUDGETS.items():
+        if model_name.startswith(prefix):
+            return budget
+    return 0
+
+
+def configured_budget(config: Optional[types.GenerateContentConfig]) -> Optional[int]:
+    if config is None or config.thinking_config is None:
+        return None
+    return config.thinking_config.thinking_budget
+
+
+class _Averages:
+    __slots__ = ("count", "latency", "thinking_tokens", "output_tokens")
+
+    def __init__(self):
+        self.count = 0
+        self.latency = 0.0
+        self.thinking_tokens = 0.0
+        self.output_tokens = 0.0
+
+    def add(self, latency: float, thinking_tokens: int, output_tokens: int):
+        # running means, the report should not depend on a decay factor
+        self.count += 1
+        self.latency += (latency - self.latency) / self.count
+        self.thinking_tokens += (thinking_tokens - self.thinking_tokens) / self.count
+        self.output_tokens += (output_tokens - self.output_tokens) / self.count
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.count,
+            "avg_latency_seconds": round(self.latency, 3),
+            "avg_thinking_tokens": round(self.thinking_tokens, 1),
+            "avg_output_tokens": round(self.output_tokens, 1),
+        }
+
+
+class ThinkingPolicy(abc.ABC):
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups: Dict[Tuple[str, str], _Averages] = {}
+
+    def bucket(self, history, config: Optional[types.GenerateContentConfig]) -> str:
+        return "all"
+
+    @abc.abstractmethod
+    def choose(self, history, model_name: str, config: Optional[types.GenerateContentConfig]) -> Tuple[Optional[types.GenerateContentConfig], Optional[ThinkingChoice]]:
+        """
+        Returns the config to send and the choice to report back, or the
+        config unchanged and None if the policy does not apply.
+        """
+
+    def observe(self, choice: ThinkingChoice, response: types.GenerateContentResponse, latency: float):
+        usage = response.usage_metadata
+        if usage is None:
+            return
+        thinking_tokens = usage.thoughts_token_count or 0
+        with self._lock:
+            self._groups.setdefault((choice.bucket, choice.group), _Averages()).add(
+                latency, thinking_tokens, usage.candidates_token_count or 0)
+        thinking_requests.labels(self.name, choice.bucket, choice.group).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets: Dict[str, Dict[str, Any]] = {}
+            for (bucket, group), averages in sorted(self._groups.items()):
+                buckets.setdefault(bucket, {})[group] = averages.to_dict()
+        return {"policy": self.name, "buckets": buckets}
+
+
+class FixedThinkingPolicy(ThinkingPolicy):
+    """
+    Sends the configured budget, reports latency and thinking tokens per bucket.
+    """
+    name = "fixed"
+
+    def bucket(self, history, config: Optional[types.GenerateContentConfig]) -> str:
+        return AdaptiveThinkingPolicy.features(history, config)
+
+    def choose(self, history, model_name: str, config: Optional[types.GenerateContentConfig]):
+        return config, ThinkingChoice(
+            self.bucket(history, config), "fixed", configured_budget(config),
+            config.max_output_tokens if config is not None else None)
+
+
+class _Bucket:
+    __slots__ = ("budget", "demand", "samples", "output_cap")
+
+    def __init__(self, budget: int, output_cap: Optional[int]):
+        self.budget = budget
+        # thoughts_token_count of control requests, i.e. with the full budget
+        self.demand: Optional[float] = None
+        self.samples = 0
+        self.output_cap = output_cap
+
+
+class AdaptiveThinkingPolicy(ThinkingPolicy):
+    name = "adaptive"
+
+    # (message size, turn) -> share of the configured budget to start from
+    INITIAL_SHARE = {
+        ("tiny", "first"): 0.0,
+        ("tiny", "followup"): 0.0,
+        ("short", "first"): 0.25,
+        ("short", "followup"): 0.5,
+        ("long", "first"): 1.0,
+        ("long", "followup"): 1.0,
+    }
+
+    def __init__(self, explore_rate: float = 0.05, min_budget: int = 0, headroom: float = 1.5,
+                 min_samples: int = 5, alpha: float = 0.2, budget_step: int = 64,
+                 tiny_tokens: int = 4, short_tokens: int = 64, tiny_output_tokens: int = 1024,
+                 max_variants: int = 256, seed: Optional[int] = None):
+        """
+        Args:
+            explore_rate: share of requests sent with the configured budget as control group.
+            min_budget: lowest budget handed out to any model, on top of the
+                floor MIN_THINKING_BUDGETS sets per model.
+            headroom: budget = control group demand x headroom.
+            min_samples: control observations a bucket needs before it follows the demand.
+            alpha: weight of the newest control observation in the demand.
+            budget_step: budgets are rounded up to multiples of this, which keeps
+                the number of derived configs (and response cache keys) small.
+            tiny_tokens, short_tokens: message size classes, in estimated tokens.
+            tiny_output_tokens: max_output_tokens for tiny messages, the rest keep the config's.
+            max_variants: derived configs kept for reuse.
+        """
+        super().__init__()
+        self.explore_rate = explore_rate
+        self.min_budget = min_budget
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.budget_step = max(1, budget_step)
+        self.tiny_tokens = tiny_tokens
+        self.short_tokens = short_tokens
+        self.tiny_output_tokens = tiny_output_tokens
+        self.max_variants = max_variants
+        self._rng = random.Random(seed)
+        self._buckets: Dict[str, _Bucket] = {}
+        self._variants: "OrderedDict[Tuple[int, int, Optional[int]], Tuple[Any, types.GenerateContentConfig]]" = OrderedDict()
+
+    @staticmethod
+    def features(history, config: Optional[types.GenerateContentConfig],
+                 tiny_tokens: int = 4, short_tokens: int = 64) -> str:
+        message = history.turn_at(-1)[1] if len(history) else ""
+        tokens = estimate_tokens(message)
+        size = "tiny" if tokens <= tiny_tokens else "short" if tokens <= short_tokens else "long"
+        # the message being sent is already part of the history
+        turn = "first" if len(history) <= 1 else "followup"
+        return f"{size}/{turn}/{tool_kind(config)}"
+
+    def bucket(self, history, config: Optional[types.GenerateContentConfig]) -> str:
+        return self.features(history, config, self.tiny_tokens, self.short_tokens)
+
+    def _round(self, budget: float, ceiling: int) -> int:
+        budget = math.ceil(budget / self.budget_step) * self.budget_step
+        return int(min(ceiling, max(self.min_budget, budget)))
+
+    def _bucket_state(self, bucket: str, ceiling: int, config_output: Optional[int]) -> _Bucket:
+        state = self._buckets.get(bucket)
+        if state is None:
+            size, turn, _ = bucket.split("/")
+            output_cap = self.tiny_output_tokens if size == "tiny" else None
+            if config_output is not None and output_cap is not None:
+                output_cap = min(output_cap, config_output)
+            state = self._buckets[bucket] = _Bucket(
+                self._round(ceiling * self.INITIAL_SHARE[(size, turn)], ceiling), output_cap)
+        return state
+
+    def _variant(self, config: types.GenerateContentConfig, budget: int, max_output_tokens: Optional[int]) -> types.GenerateContentConfig:
+        # caller holds self._lock
+        key = (id(config), budget, max_output_tokens)
+        entry = self._variants.get(key)
+        if entry is not None and entry[0] is config:
+            self._variants.move_to_end(key)
+            return entry[1]
+        update: Dict[str, Any] = {"thinking_config": config.thinking_config.model_copy(
+            update={"thinking_budget": budget})}
+        if max_output_tokens is not None:
+            update["max_output_tokens"] = max_output_tokens
+        variant = config.model_copy(update=update)
+        # the config is held as well, so its id cannot be reused while the entry lives
+        self._variants[key] = (config, variant)
+        while len(self._variants) > self.max_variants:
+            self._variants.popitem(last=False)
+        return variant
+
+    def choose(self, history, model_name: str, config: Optional[types.GenerateContentConfig]):
+        ceiling = configured_budget(config)
+        if ceiling is None or ceiling <= 0:
+            # dynamic or disabled thinking, nothing to tune
+            return config, None
+        bucket = self.bucket(history, config)
+        with self._lock:
+            state = self._bucket_state(bucket, ceiling, config.max_output_tokens)
+            if self._rng.random() < self.explore_rate:
+                return config, ThinkingChoice(bucket, "control", ceiling, config.max_output_tokens)
+            budget = min(max(state.budget, min_thinking_budget(model_name)), ceiling)
+            if budget == ceiling and state.output_cap is None:
+                return config, ThinkingChoice(bucket, "adaptive", ceiling, config.max_output_tokens)
+            variant = self._variant(config, budget, state.output_cap)
+        return variant, ThinkingChoice(bucket, "adaptive", budget, variant.max_output_tokens)
+
+    def observe(self, choice: ThinkingChoice, response: types.GenerateContentResponse, latency: float):
+        super().observe(choice, response, latency)
+        usage = response.usage_metadata
+        if usage is None:
+            return
+        thinking_tokens = usage.thoughts_token_count or 0
+        finish_reason = response.candidates[0].finish_reason if response.candidates else None
+        with self._lock:
+            state = self._buckets.get(choice.bucket)
+            if state is None:
+                return
+            ceiling = choice.thinking_budget if choice.group == "control" else None
+            if choice.group == "control":
+                state.demand = thinking_tokens if state.demand is None else \
+                    (1 - self.alpha) * state.demand + self.alpha * thinking_tokens
+                state.samples += 1
+                if state.samples >= self.min_samples:
+                    state.budget = self._round(state.demand * self.headroom, ceiling)
+                return
+            if choice.thinking_budget and thinking_tokens >= 0.9 * choice.thinking_budget:
+                # used up what it got, give the bucket more until the control group says otherwise
+                state.budget = self._round(max(self.budget_step, state.budget * 2), 1 << 30)
+            if finish_reason == types.FinishReason.MAX_TOKENS and state.output_cap is not None:
+                thinking_logger.info(
+                    f"Answers in bucket {choice.bucket} hit max_output_tokens, lifting the cap.")
+                state.output_cap = None
+            control = self._groups.get((choice.bucket, "control"))
+            saved = control.thinking_tokens - thinking_tokens if control and control.count else 0
+        if saved > 0:
+            thinking_tokens_saved.labels(self.name).inc(saved)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            for bucket, groups in stats["buckets"].items():
+                state = self._buckets.get(bucket)
+                if state is not None:
+                    groups["budget"] = state.budget
+                    groups["demand"] = round(state.demand, 1) if state.demand is not None else None
+                    groups["max_output_tokens"] = state.output_cap
+                control, adaptive = groups.get("control"), groups.get("adaptive")
+                if control and adaptive:
+                    groups["saved"] = {
+                        "latency_seconds": round(control["avg_latency_seconds"] - adaptive["avg_latency_seconds"], 3),
+                        "thinking_tokens": round(control["avg_thinking_tokens"] - adaptive["avg_thinking_tokens"], 1),
+                    }
+            stats["variants"] = len(self._variants)
+            stats["explore_rate"] = self.explore_rate
+        return stats
+
+
+THINKING_POLICIES = {
+    "fixed": FixedThinkingPolicy,
+    "adaptive": AdaptiveThinkingPolicy,
+}
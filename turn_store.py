@@ -0,0 +1,147 @@
+"""
+Storage for the turns of one conversation.
+
+A types.Content holding one text Part is a small tree of pydantic objects,
+with their __dict__s, a list and field bookkeeping, several hundred bytes
+before the text itself. Conversations only ever hold single-part text turns,
+so CompactTurnStore keeps them as one role byte per turn, the utf-8 texts back
+to back in one bytearray and the end offset of each text in an array.
+Content objects are built when a request is assembled (see
+ConversationHistory.contents) and are garbage once it has been sent.
+
+ContentTurnStore keeps a list of Content objects like before, for comparison
+with `bench_load.py --memory ... --turn-store content,compact`.
+"""
+import enum
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import List
+
+from google.genai import types
+
+
+class Role(enum.IntEnum):
+    USER = 0
+    MODEL = 1
+
+
+# interned so every materialized turn shares the same role strings
+ROLE_NAMES = tuple(sys.intern(role.name.lower()) for role in Role)
+ROLES = {name: Role(i) for i, name in enumerate(ROLE_NAMES)}
+
+
+def make_content(role: str, text: str) -> types.Content:
+    return types.Content(role=role, parts=[types.Part.from_text(text=text)])
+
+
+class CompactTurnStore:
+    __slots__ = ("_roles", "_ends", "_text")
+
+    def __init__(self):
+        self._roles = bytearray()
+        # end offset of each turn's text in _text, the start is the previous end
+        self._ends = array("Q")
+        self._text = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._roles)
+
+    def _bounds(self, index: int) -> range:
+        index = range(len(self._roles))[index]  # negative indices, IndexError
+        return range(self._ends[index - 1] if index else 0, self._ends[index])
+
+    def append(self, role: str, text: str) -> int:
+        """
+        Adds a turn, returns its index.
+        """
+        # _roles last, its length publishes the turn to readers without a lock
+        self._text += text.encode("utf-8")
+        self._ends.append(len(self._text))
+        self._roles.append(ROLES[role])
+        return len(self._roles) - 1
+
+    def role(self, index: int) -> str:
+        return ROLE_NAMES[self._roles[index]]
+
+    def text(self, index: int) -> str:
+        bounds = self._bounds(index)
+        return self._text[bounds.start:bounds.stop].decode("utf-8")
+
+    def size(self, index: int) -> int:
+        """
+        utf-8 size of the turn's text.
+        """
+        return len(self._bounds(index))
+
+    def content(self, index: int) -> types.Content:
+        return make_content(self.role(index), self.text(index))
+
+    def truncate(self, length: int):
+        """
+        Drops the turns from `length` on.
+        """
+        if length >= len(self._roles):
+            return
+        start = self._bounds(length).start
+        # the reverse of append, readers never see a turn without its text
+        del self._roles[length:]
+        del self._ends[length:]
+        del self._text[start:]
+
+
+class ContentTurnStore:
+    """
+    One types.Content per turn, the representation CompactTurnStore replaced.
+    """
+    __slots__ = ("_contents",)
+
+    def __init__(self):
+        self._contents: List[types.Content] = []
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def append(self, role: str, text: str) -> int:
+        self._contents.append(make_content(role, text))
+        return len(self._contents) - 1
+
+    def role(self, index: int) -> str:
+        return self._contents[index].role
+
+    def text(self, index: int) -> str:
+        return " ".join(part.text for part in (self._contents[index].parts or []) if part.text)
+
+    def size(self, index: int) -> int:
+        return len(self.text(index).encode("utf-8"))
+
+    def content(self, index: int) -> types.Content:
+        return self._contents[index]
+
+    def truncate(self, length: int):
+        del self._contents[length:]
+
+
+TURN_STORES = {
+    "compact": CompactTurnStore,
+    "content": ContentTurnStore,
+}
+
+
+class ContentsView(Sequence):
+    """
+    Read-only list-like view of a turn store, indexing builds the Content
+    objects and slicing returns a list of them.
+    """
+    __slots__ = ("_turns",)
+
+    def __init__(self, turns):
+        self._turns = turns
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._turns.content(i) for i in range(*index.indices(len(self._turns)))]
+        return self._turns.content(index)
@@ -0,0 +1,202 @@
+"""
+In-memory vector indexes for the local retriever (see retrieval.py).
+
+Vectors are unit length float32 rows of one growing NumPy matrix, so a
+similarity is a dot product and a query one matrix-vector product. Every row
+carries a label, here (document id, chunk number). Replacing a document
+removes its rows by clearing their alive flag; the matrix is compacted once
+more than half of it is dead.
+
+FlatIndex scores every row, exact and fast enough for tens of thousands of
+chunks. IVFIndex clusters the rows with k-means and scores only the rows of
+the `nprobe` clusters nearest to the query, trading a little recall for a
+scan of roughly nprobe/nlist of the matrix.
+"""
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+
+Label = Tuple[Hashable, int]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class FlatIndex:
+    def __init__(self, dim: int, initial_capacity: int = 1024):
+        self.dim = dim
+        self._vectors = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._alive = np.zeros(initial_capacity, dtype=bool)
+        self._labels: List[Label] = []
+        self._rows: Dict[Hashable, np.ndarray] = {}
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._labels) - self._dead
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._rows
+
+    @property
+    def nbytes(self) -> int:
+        return self._vectors.nbytes + self._alive.nbytes
+
+    def _grow(self, needed: int):
+        capacity = len(self._vectors)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:len(self._labels)] = self._vectors[:len(self._labels)]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._labels)] = self._alive[:len(self._labels)]
+        self._vectors, self._alive = vectors, alive
+
+    def add(self, key: Hashable, vectors: np.ndarray):
+        """
+        Stores the chunk vectors of one document, replacing what it had before.
+        """
+        self.remove(key)
+        vectors = normalize(vectors).reshape(-1, self.dim)
+        start = len(self._labels)
+        self._grow(start + len(vectors))
+        self._vectors[start:start + len(vectors)] = vectors
+        self._alive[start:start + len(vectors)] = True
+        self._labels.extend((key, chunk) for chunk in range(len(vectors)))
+        self._rows[key] = np.arange(start, start + len(vectors))
+        self._added(start, start + len(vectors))
+
+    def _added(self, start: int, stop: int):
+        pass
+
+    def remove(self, key: Hashable) -> bool:
+        rows = self._rows.pop(key, None)
+        if rows is None:
+            return False
+        self._alive[rows] = False
+        self._dead += len(rows)
+        if self._dead > 1024 and self._dead * 2 > len(self._labels):
+            self._compact()
+        return True
+
+    def _compact(self):
+        size = len(self._labels)
+        keep = np.flatnonzero(self._alive[:size])
+        self._compacted(keep)
+        self._vectors[:len(keep)] = self._vectors[keep]
+        self._alive[:len(keep)] = True
+        self._alive[len(keep):] = False
+        self._labels = [self._labels[row] for row in keep]
+        self._rows = {}
+        for row, (key, _) in enumerate(self._labels):
+            self._rows.setdefault(key, []).append(row)
+        self._rows = {key: np.asarray(rows) for key, rows in self._rows.items()}
+        self._dead = 0
+
+    def _compacted(self, keep: np.ndarray):
+        pass
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(self._alive[:len(self._labels)])
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[Label, float]]:
+        """
+        The k labels most similar to the query, best first, with their cosine similarity.
+        """
+        if not len(self) or k <= 0:
+            return []
+        query = normalize(query).reshape(self.dim)
+        rows = self._candidates(query)
+        if not len(rows):
+            return []
+        scores = self._vectors[rows] @ query
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return [(self._labels[rows[i]], float(scores[i])) for i in top]
+
+
+class IVFIndex(FlatIndex):
+    def __init__(self, dim: int, nlist: int = 64, nprobe: int = 8, min_train_size: int = 0,
+                 iterations: int = 10, seed: int = 0, initial_capacity: int = 1024):
+        """
+        Args:
+            nlist: clusters the rows are split into.
+            nprobe: clusters scored per query.
+            min_train_size: rows needed before clustering, 39 per cluster by
+                default; smaller indexes are searched exhaustively.
+            iterations: k-means rounds per training.
+            seed: makes the clustering reproducible.
+        The clusters are trained again whenever the index doubled since.
+        """
+        super().__init__(dim, initial_capacity)
+        self.nlist = nlist
+        self.nprobe = min(nprobe, nlist)
+        self.min_train_size = min_train_size or 39 * nlist
+        self.iterations = iterations
+        self._rng = np.random.default_rng(seed)
+        self._centroids = None
+        self._assignment = np.full(initial_capacity, -1, dtype=np.int32)
+        self._trained_size = 0
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _grow(self, needed: int):
+        super()._grow(needed)
+        if len(self._assignment) < len(self._vectors):
+            assignment = np.full(len(self._vectors), -1, dtype=np.int32)
+            assignment[:len(self._labels)] = self._assignment[:len(self._labels)]
+            self._assignment = assignment
+
+    def _added(self, start: int, stop: int):
+        if self.trained:
+            self._assignment[start:stop] = np.argmax(self._vectors[start:stop] @ self._centroids.T, axis=1)
+
+    def _compacted(self, keep: np.ndarray):
+        self._assignment[:len(keep)] = self._assignment[keep]
+        self._assignment[len(keep):] = -1
+
+    def train(self):
+        """
+        Spherical k-means over a sample of the live rows.
+        """
+        rows = np.flatnonzero(self._alive[:len(self._labels)])
+        sample = rows if len(rows) <= 256 * self.nlist else \
+            self._rng.choice(rows, 256 * self.nlist, replace=False)
+        data = self._vectors[sample]
+        centroids = data[self._rng.choice(len(data), self.nlist, replace=False)]
+        for _ in range(self.iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, data)
+            empty = ~np.bincount(assignment, minlength=self.nlist).astype(bool)
+            # an empty cluster restarts at a random row
+            sums[empty] = data[self._rng.choice(len(data), int(empty.sum()))]
+            centroids = normalize(sums)
+        self._centroids = centroids
+        size = len(self._labels)
+        self._assignment[:size] = np.argmax(self._vectors[:size] @ centroids.T, axis=1)
+        self._trained_size = len(self)
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        if len(self) >= self.min_train_size and (not self.trained or len(self) >= 2 * self._trained_size):
+            self.train()
+        if not self.trained:
+            return super()._candidates(query)
+        probe = np.argpartition(-(self._centroids @ query), self.nprobe - 1)[:self.nprobe]
+        size = len(self._labels)
+        return np.flatnonzero(self._alive[:size] & np.isin(self._assignment[:size], probe))
+
+
+INDEXES = {
+    "flat": FlatIndex,
+    "ivf": IVFIndex,
+}